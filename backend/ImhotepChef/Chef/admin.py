@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth import get_user_model
-from .models import RecipeHistory
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import MonthlyRecipeUsage, Recipe, RecipeHistory, RecipeJob
 
 User = get_user_model()
 
@@ -49,28 +51,34 @@ class UserAdmin(BaseUserAdmin):
     
     def recipes_last_month(self, obj):
         """Display the number of recipes created by the user in the current calendar month"""
-        return obj.get_recipes_last_month_count()
+        return obj.recipe_count_last_month
     recipes_last_month.short_description = 'Recipes (This Month)'
     recipes_last_month.admin_order_field = 'recipe_count_last_month'
     
     def get_queryset(self, request):
-        """Optimize query by prefetching recipe history"""
-        return super().get_queryset(request).prefetch_related('user_recipe_history')
+        """Annotate the monthly recipe count in the page query, for display and sorting"""
+        monthly_count = MonthlyRecipeUsage.objects.filter(
+            user=OuterRef('pk'),
+            month=MonthlyRecipeUsage.current_month()
+        ).values('recipe_count')[:1]
+        return super().get_queryset(request).annotate(
+            recipe_count_last_month=Coalesce(Subquery(monthly_count), 0)
+        )
 
-@admin.register(RecipeHistory)
-class RecipeHistoryAdmin(admin.ModelAdmin):
-    """Admin interface for the RecipeHistory model"""
+@admin.register(Recipe)
+class RecipeAdmin(admin.ModelAdmin):
+    """Admin interface for the shared Recipe model, edits show in every history the recipe is in"""
     
     # Fields to display in the recipe list
-    list_display = ('recipe_name', 'user', 'recipe_difficulty', 'servings', 'prep_time', 'cook_time', 'created_at')
+    list_display = ('recipe_name', 'recipe_difficulty', 'servings', 'prep_time', 'cook_time', 'created_at')
     list_filter = ('recipe_difficulty', 'created_at', 'servings')
-    search_fields = ('recipe_name', 'user__username', 'user__email', 'recipe_description')
+    search_fields = ('recipe_name', 'recipe_description')
     ordering = ('-created_at',)
     
     # Fields to display in the recipe detail view
     fieldsets = (
         ('Basic Information', {
-            'fields': ('user', 'recipe_name', 'recipe_description', 'recipe_difficulty')
+            'fields': ('recipe_name', 'recipe_description', 'recipe_difficulty')
         }),
         ('Timing & Servings', {
             'fields': ('prep_time', 'cook_time', 'total_time', 'servings')
@@ -88,13 +96,13 @@ class RecipeHistoryAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Metadata', {
-            'fields': ('created_at',),
+            'fields': ('ingredients_fingerprint', 'content_hash', 'created_at'),
             'classes': ('collapse',)
         }),
     )
     
-    # Make created_at read-only
-    readonly_fields = ('created_at',)
+    # Make the keys and created_at read-only
+    readonly_fields = ('ingredients_fingerprint', 'content_hash', 'created_at')
     
     # Number of recipes per page
     list_per_page = 25
@@ -119,8 +127,48 @@ class RecipeHistoryAdmin(admin.ModelAdmin):
         updated = queryset.update(recipe_difficulty='Hard')
         self.message_user(request, f'{updated} recipes marked as Hard.')
     mark_as_hard.short_description = 'Mark selected recipes as Hard'
+
+@admin.register(RecipeHistory)
+class RecipeHistoryAdmin(admin.ModelAdmin):
+    """Admin interface for the RecipeHistory model, the recipes users were served"""
+    
+    list_display = ('id', 'user', 'recipe', 'created_at')
+    list_filter = ('created_at',)
+    search_fields = ('recipe__recipe_name', 'user__username', 'user__email')
+    ordering = ('-created_at',)
+    list_select_related = ('user', 'recipe')
+    
+    # Pickers instead of dropdowns, both tables are large
+    raw_id_fields = ('user', 'recipe')
+    fields = ('user', 'recipe', 'created_at')
+    readonly_fields = ('created_at',)
+    list_per_page = 25
+
+@admin.register(RecipeJob)
+class RecipeJobAdmin(admin.ModelAdmin):
+    """Admin interface for queued recipe generations"""
+    
+    list_display = ('id', 'user', 'status', 'attempts', 'run_after', 'locked_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username', 'user__email', 'locked_by')
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at', 'finished_at', 'locked_until', 'locked_by', 'attempts')
+    list_per_page = 25
+    
+    def get_queryset(self, request):
+        """Optimize query by selecting related user data"""
+        return super().get_queryset(request).select_related('user')
+
+@admin.register(MonthlyRecipeUsage)
+class MonthlyRecipeUsageAdmin(admin.ModelAdmin):
+    """Admin interface for the monthly recipe counters, rebuilt by reconcile_recipe_usage"""
+    
+    list_display = ('user', 'month', 'recipe_count')
+    list_filter = ('month',)
+    search_fields = ('user__username', 'user__email')
+    ordering = ('-month', '-recipe_count')
+    list_per_page = 25
     
-    # Custom display methods
     def get_queryset(self, request):
         """Optimize query by selecting related user data"""
         return super().get_queryset(request).select_related('user')
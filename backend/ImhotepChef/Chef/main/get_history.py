@@ -21,7 +21,7 @@ def get_user_history(request):
             page = 1
 
         # Get all recipes for the user
-        recipe_queryset = RecipeHistory.objects.filter(user=request.user).order_by('-created_at')
+        recipe_queryset = RecipeHistory.objects.filter(user=request.user).select_related('recipe').order_by('-created_at')
         
         # Create paginator
         paginator = Paginator(recipe_queryset, page_size)
@@ -39,9 +39,11 @@ def get_user_history(request):
 
         # Serialize the recipe history data
         serialized_recipes = []
-        for recipe in recipe_page:
+        for entry in recipe_page:
+            # The body is shared, the id and date are the user's own
+            recipe = entry.get_recipe()
             serialized_recipes.append({
-                'id': recipe.id,
+                'id': entry.id,
                 'recipe_name': recipe.recipe_name,
                 'recipe_description': recipe.recipe_description,
                 'recipe_difficulty': recipe.recipe_difficulty,
@@ -54,7 +56,7 @@ def get_user_history(request):
                 'instructions': recipe.instructions,
                 'tips': recipe.tips,
                 'nutrition': recipe.nutrition,
-                'created_at': recipe.created_at.isoformat(),
+                'created_at': entry.created_at.isoformat(),
             })
 
         # Prepare response with pagination info
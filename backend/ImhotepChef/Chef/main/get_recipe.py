@@ -1,161 +1,335 @@
-from ..models import User, RecipeHistory
+from ..models import MonthlyRecipeUsage, Recipe, RecipeHistory
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.views.decorators.csrf import csrf_exempt
-from ..utils.ai_get_recipe import get_recipe_from_gemini
+from django.conf import settings
+from ..utils.ai_get_recipe import DEADLINE_EXCEEDED_MESSAGE, get_recipe_from_gemini
+from ..utils.deadline import Deadline, statement_timeout
+from ..utils.ingredients import canonical_ingredients, ingredients_fingerprint
+from ..utils.ingredient_index import get_ingredient_index
+from ..utils.metrics import QUOTA_REJECTIONS
+from ..utils.recipe_cache import get_recipe_cache
+from ..utils.single_flight import get_single_flight
+
+MONTHLY_RECIPE_LIMIT = 30
+
+def validate_ingredients(array_of_ingredients):
+    """
+    Validate the ingredients sent by the client
+
+    Returns:
+        tuple: (sorted_ingredients, error_message), exactly one of them is None
+    """
+    if not array_of_ingredients:
+        return None, 'Ingredients array is required'
+
+    if not isinstance(array_of_ingredients, list):
+        return None, 'Ingredients must be provided as an array'
+
+    if len(array_of_ingredients) < 3:
+        return None, 'The array of ingredients must contain at least 3 items'
+
+    # Bound the prompt size
+    if len(array_of_ingredients) > settings.RECIPE_MAX_INGREDIENTS:
+        return None, f'The array of ingredients can contain at most {settings.RECIPE_MAX_INGREDIENTS} items'
+
+    if any(isinstance(ingredient, str) and len(ingredient) > settings.RECIPE_MAX_INGREDIENT_LENGTH for ingredient in array_of_ingredients):
+        return None, f'Ingredient names can be at most {settings.RECIPE_MAX_INGREDIENT_LENGTH} characters long'
+
+    # Keep only non-empty string ingredients in canonical form (plurals, synonyms and
+    # quantities folded), sorted for consistent comparison
+    sorted_ingredients = canonical_ingredients(array_of_ingredients)
+
+    if len(sorted_ingredients) < 3:
+        return None, 'At least 3 valid ingredient names are required'
+
+    return sorted_ingredients, None
+
+def find_similar_recipe(sorted_ingredients, threshold):
+    """Find a stored recipe whose ingredients overlap the request by at least threshold, or None"""
+    index = get_ingredient_index()
+    recipe_id, similarity = index.best_match(sorted_ingredients, threshold)
+    if recipe_id is None:
+        return None
+
+    source_recipe = Recipe.objects.filter(id=recipe_id).first()
+    if source_recipe is None:
+        index.discard(recipe_id)
+        return None
+
+    print(f"Found similar recipe ({similarity:.0%} overlap): {source_recipe.recipe_name}")
+    return source_recipe.to_recipe_dict()
+
+def load_recipe_from_history(sorted_ingredients):
+    """Load the newest stored recipe for an ingredient set, or a close enough one, in API format"""
+    source_recipe = Recipe.find_by_ingredients(sorted_ingredients)
+    if source_recipe:
+        return source_recipe.to_recipe_dict()
+    return find_similar_recipe(sorted_ingredients, settings.RECIPE_SIMILARITY_THRESHOLD)
+
+def load_variant_pool(sorted_ingredients):
+    """
+    Load the different stored recipes for an ingredient set in API format, newest first
+
+    Variant pools are only used by get_ingredients, see RECIPE_VARIANTS_PER_CALL.
+    """
+    return [
+        recipe.to_recipe_dict()
+        for recipe in Recipe.variant_pool(sorted_ingredients, settings.RECIPE_VARIANT_POOL_SIZE)
+    ]
+
+def choose_variant(pool, fingerprint, difficulty=None):
+    """
+    Pick the recipe to serve from an ingredient set's variant pool
+
+    Requests take turns over the pool, or over its recipes of the requested
+    difficulty when it has any.
+    """
+    matching = [recipe for recipe in pool if recipe.get('difficulty') == difficulty] if difficulty else []
+    candidates = matching or pool
+    return candidates[get_recipe_cache().next_rotation(fingerprint) % len(candidates)]
+
+def store_variant_pool(recipes, sorted_ingredients, fingerprint):
+    """Save every recipe of a multi-variant reply, so later requests for the set are served from the pool"""
+    try:
+        Recipe.intern_many([
+            Recipe.from_recipe_dict(recipe, main_ingredients=sorted_ingredients)
+            for recipe in recipes
+        ])
+        get_recipe_cache().set_pool(fingerprint, load_variant_pool(sorted_ingredients))
+        print(f"Stored {len(recipes)} recipe variants for {', '.join(sorted_ingredients)}")
+    except Exception as pool_error:
+        print(f"Error storing recipe variants: {pool_error}")
+
+def cached_recipe_data(cached_recipe):
+    """Wrap a cached recipe in the same format get_recipe_from_gemini returns"""
+    return {
+        'success': True,
+        'recipes': [cached_recipe],
+        'message': 'Recipe retrieved from our database'
+    }
+
+def process_generated_recipes(recipe_data, error_message, sorted_ingredients, fingerprint):
+    """
+    Post-process a Gemini result before it is shared with waiting requests
+
+    Returns:
+        dict: The recipe data to serve
+    """
+    # Update main_ingredients in recipe data to use sorted ingredients
+    if recipe_data and recipe_data.get('recipes'):
+        for recipe in recipe_data['recipes']:
+            recipe['main_ingredients'] = sorted_ingredients
+
+        # Publish successful results so requests waiting in other processes can use them
+        if not error_message:
+            recipe = Recipe.from_recipe_dict(recipe_data['recipes'][0])
+            get_recipe_cache().set(fingerprint, recipe.to_recipe_dict())
+            if len(recipe_data['recipes']) > 1:
+                store_variant_pool(recipe_data['recipes'], sorted_ingredients, fingerprint)
+
+    # Every API key failed, prefer a loosely matching real recipe over the generic fallback
+    if error_message:
+        similar_recipe = find_similar_recipe(sorted_ingredients, settings.RECIPE_FALLBACK_SIMILARITY_THRESHOLD)
+        if similar_recipe:
+            recipe_data = {
+                'recipes': [similar_recipe],
+                'success': False,
+                'message': 'AI service unavailable. Showing a similar recipe from our database.'
+            }
+
+    return recipe_data
+
+def generate_recipes(sorted_ingredients, fingerprint, deadline=None, variants=1):
+    """
+    Generate recipes for an ingredient set, coalescing concurrent identical requests
+
+    Only one Gemini call runs per ingredient set at a time, across threads and worker
+    processes. Waiting requests get the same result, or read it from the recipe cache
+    when the call ran in another process. Waiting is bounded by the deadline too.
+    With several variants, all of them are stored as the set's variant pool.
+
+    Returns:
+        tuple: (recipe_data, error_message)
+    """
+    recipe_cache = get_recipe_cache()
+
+    def generate():
+        recipe_data, error_message = get_recipe_from_gemini(sorted_ingredients, deadline, variants)
+        recipe_data = process_generated_recipes(recipe_data, error_message, sorted_ingredients, fingerprint)
+        return recipe_data, error_message
+
+    def peek():
+        cached_recipe = recipe_cache.get(fingerprint)
+        if cached_recipe is None:
+            return None
+        return cached_recipe_data(cached_recipe), None
+
+    timeout = deadline.remaining() if deadline is not None else None
+    return get_single_flight().do(fingerprint, generate, peek, timeout)
+
+def save_recipes_for_user(user, recipe_data, sorted_ingredients, deadline=None, reservation=None):
+    """
+    Save the served recipes to the user's history
+
+    On PostgreSQL the queries are bounded by the request's remaining budget.
+    The new history entries are counted in the user's monthly usage, in place
+    of the recipes the reservation held for them.
+
+    Returns:
+        list: IDs of the user's history entries for the served recipes
+    """
+    saved_recipes = []
+    new_recipes = 0
+    if recipe_data and recipe_data.get('recipes'):
+        for recipe in recipe_data['recipes']:
+            try:
+                recipe_name = recipe.get('name', 'Untitled Recipe')
+
+                with statement_timeout(deadline):
+                    # Check if this user already has a recipe with this exact name
+                    existing_user_recipe = RecipeHistory.objects.filter(
+                        user=user,
+                        recipe__recipe_name=recipe_name
+                    ).first()
+
+                    if existing_user_recipe:
+                        # User already has a recipe with this name, don't save again
+                        saved_recipes.append(existing_user_recipe.id)
+                        print(f"User already has recipe with name: {recipe_name}")
+                    else:
+                        # Create new recipe entry for this user
+                        recipe_history = RecipeHistory.from_recipe_dict(
+                            recipe,
+                            user=user,
+                            main_ingredients=sorted_ingredients
+                        )
+                        recipe_history.save()
+                        saved_recipes.append(recipe_history.id)
+                        new_recipes += 1
+                        print(f"Saved new recipe for user: {recipe_name}")
+
+            except Exception as save_error:
+                print(f"Error saving recipe: {save_error}")
+                continue
+
+    try:
+        MonthlyRecipeUsage.record(user, new_recipes, reservation)
+    except Exception as usage_error:
+        # The recipes are served anyway, reconcile_recipe_usage corrects the counter
+        print(f"Error counting recipe usage: {usage_error}")
+
+    return saved_recipes
+
+def build_response_data(recipe_data, error_message, sorted_ingredients, saved_recipes, from_cache):
+    """Build the generate endpoint response body"""
+    response_data = {
+        'success': recipe_data.get('success', True) if recipe_data else False,
+        'recipes': recipe_data.get('recipes', []) if recipe_data else [],
+        'message': recipe_data.get('message', 'Recipes generated successfully') if recipe_data else 'Failed to generate recipes',
+        'ingredients_used': sorted_ingredients,
+        'saved_recipe_ids': saved_recipes,
+        'from_cache': from_cache
+    }
+
+    # Add error message if AI failed but fallback was used
+    if error_message:
+        response_data['ai_error'] = error_message
+        response_data['fallback_used'] = True
+        # Reported apart from upstream errors
+        response_data['timed_out'] = error_message == DEADLINE_EXCEEDED_MESSAGE
+
+    return response_data
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 @csrf_exempt
 def get_ingredients(request):
+    # Budget for the whole request, shared by every Gemini attempt and DB save
+    deadline = Deadline(settings.RECIPE_GENERATE_DEADLINE)
+    reservation = None
     try:
         # Get ingredients from request
         array_of_ingredients = request.data.get('ingredients', [])
 
-        if not array_of_ingredients:
-            return Response(
-                {'error': 'Ingredients array is required'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if not isinstance(array_of_ingredients, list):
+        sorted_ingredients, validation_error = validate_ingredients(array_of_ingredients)
+        if validation_error:
             return Response(
-                {'error': 'Ingredients must be provided as an array'}, 
+                {'error': validation_error},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        if len(array_of_ingredients) < 3:
+
+        # Optional, picks the variant to serve when the set has several
+        difficulty = request.data.get('difficulty') or None
+        difficulties = [choice for choice, _ in Recipe.RECIPE_DIFFICULTY_CHOICES]
+        if difficulty is not None and difficulty not in difficulties:
             return Response(
-                {'error': 'The array of ingredients must contain at least 3 items'}, 
+                {'error': f"Difficulty must be one of {', '.join(difficulties)}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Validate that ingredients are strings and not empty
-        valid_ingredients = []
-        for ingredient in array_of_ingredients:
-            if isinstance(ingredient, str) and ingredient.strip():
-                valid_ingredients.append(ingredient.strip().lower())
-        
-        if len(valid_ingredients) < 3:
-            return Response(
-                {'error': 'At least 3 valid ingredient names are required'}, 
-                status=status.HTTP_400_BAD_REQUEST
+
+        fingerprint = ingredients_fingerprint(sorted_ingredients)
+        variants = settings.RECIPE_VARIANTS_PER_CALL
+        cached_recipe = None
+        if variants > 1:
+            # Serve the variants already generated for this set before calling Gemini again
+            pool = get_recipe_cache().get_or_load_pool(fingerprint, lambda: load_variant_pool(sorted_ingredients))
+            if pool:
+                cached_recipe = choose_variant(pool, fingerprint, difficulty)
+
+        # Check if we have an existing recipe with the same ingredients (from any user),
+        # going through the in-process and shared cache tiers before the database
+        if cached_recipe is None:
+            cached_recipe = get_recipe_cache().get_or_load(
+                fingerprint,
+                lambda: load_recipe_from_history(sorted_ingredients)
             )
-        
-        # Sort ingredients for consistent comparison
-        sorted_ingredients = sorted(valid_ingredients)
-        
-        # Check if we have existing recipes with the same ingredients (from any user)
-        existing_recipes = RecipeHistory.objects.filter(
-            main_ingredients=sorted_ingredients
-        ).order_by('-created_at')
-        
-        if existing_recipes.exists():
-            # Use existing recipe data - convert from database format
-            source_recipe = existing_recipes.first()
-            recipe_data = {
-                'success': True,
-                'recipes': [{
-                    'name': source_recipe.recipe_name,
-                    'description': source_recipe.recipe_description,
-                    'difficulty': source_recipe.recipe_difficulty,
-                    'prep_time': source_recipe.prep_time,
-                    'cook_time': source_recipe.cook_time,
-                    'total_time': source_recipe.total_time,
-                    'servings': source_recipe.servings,
-                    'main_ingredients': source_recipe.main_ingredients,
-                    'additional_ingredients': source_recipe.additional_ingredients,
-                    'instructions': source_recipe.instructions,
-                    'tips': source_recipe.tips,
-                    'nutrition': source_recipe.nutrition
-                }],
-                'message': 'Recipe retrieved from our database'
-            }
+        from_cache = cached_recipe is not None
+
+        if from_cache:
+            recipe_data = cached_recipe_data(cached_recipe)
             error_message = None
-            print(f"Using cached recipe: {source_recipe.recipe_name}")
+            print(f"Using cached recipe: {cached_recipe['name']}")
         else:
             # Get new recipes from Gemini AI
             print("Generating new recipes from AI...")
 
-            #Check if the user have used more the 30 AI responses this month
-            if request.user.get_recipes_last_month_count() >= 30:
+            # Reserve the recipe before calling Gemini, so concurrent requests can't go over the monthly limit
+            reservation = MonthlyRecipeUsage.reserve(request.user, 1, MONTHLY_RECIPE_LIMIT)
+            if reservation is None:
+                QUOTA_REJECTIONS.inc(endpoint='generate')
                 return Response(
-                    {'error': 'You have a maximum of 30 Recipes to be Generated each month'}, 
+                    {'error': f'You have a maximum of {MONTHLY_RECIPE_LIMIT} Recipes to be Generated each month'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            recipe_data, error_message = get_recipe_from_gemini(valid_ingredients)
-            
-            # Update main_ingredients in recipe data to use sorted ingredients
-            if recipe_data and recipe_data.get('recipes'):
-                for recipe in recipe_data['recipes']:
-                    recipe['main_ingredients'] = sorted_ingredients
-        
+
+            # Concurrent requests for the same ingredients share a single Gemini call
+            recipe_data, error_message = generate_recipes(sorted_ingredients, fingerprint, deadline, variants)
+
+            # The user gets one of the variants, the others wait in the pool
+            if not error_message and len(recipe_data['recipes']) > 1:
+                recipe_data = dict(
+                    recipe_data,
+                    recipes=[choose_variant(recipe_data['recipes'], fingerprint, difficulty)]
+                )
+
         # Handle saving recipes to database for this user
-        saved_recipes = []
-        if recipe_data and recipe_data.get('recipes'):
-            for recipe in recipe_data['recipes']:
-                try:
-                    recipe_name = recipe.get('name', 'Untitled Recipe')
-                    
-                    # Check if this user already has a recipe with this exact name
-                    existing_user_recipe = RecipeHistory.objects.filter(
-                        user=request.user,
-                        recipe_name=recipe_name
-                    ).first()
-                    
-                    if existing_user_recipe:
-                        # User already has a recipe with this name, don't save again
-                        saved_recipes.append(existing_user_recipe.id)
-                        print(f"User already has recipe with name: {recipe_name}")
-                    else:
-                        # Create new recipe entry for this user
-                        recipe_history = RecipeHistory.objects.create(
-                            user=request.user,
-                            recipe_name=recipe_name,
-                            recipe_description=recipe.get('description', ''),
-                            recipe_difficulty=recipe.get('difficulty', 'Easy'),
-                            prep_time=recipe.get('prep_time', ''),
-                            cook_time=recipe.get('cook_time', ''),
-                            total_time=recipe.get('total_time', ''),
-                            servings=recipe.get('servings', 1),
-                            main_ingredients=recipe.get('main_ingredients', sorted_ingredients),
-                            additional_ingredients=recipe.get('additional_ingredients', []),
-                            instructions=recipe.get('instructions', []),
-                            tips=recipe.get('tips', []),
-                            nutrition=recipe.get('nutrition', {})
-                        )
-                        saved_recipes.append(recipe_history.id)
-                        print(f"Saved new recipe for user: {recipe_name}")
-                        
-                except Exception as save_error:
-                    print(f"Error saving recipe: {save_error}")
-                    continue
-        
+        saved_recipes = save_recipes_for_user(request.user, recipe_data, sorted_ingredients, deadline, reservation)
+
         # Prepare response
-        response_data = {
-            'success': recipe_data.get('success', True) if recipe_data else False,
-            'recipes': recipe_data.get('recipes', []) if recipe_data else [],
-            'message': recipe_data.get('message', 'Recipes generated successfully') if recipe_data else 'Failed to generate recipes',
-            'ingredients_used': sorted_ingredients,
-            'saved_recipe_ids': saved_recipes,
-            'from_cache': existing_recipes.exists() if 'existing_recipes' in locals() else False
-        }
-        
-        # Add error message if AI failed but fallback was used
-        if error_message:
-            response_data['ai_error'] = error_message
-            response_data['fallback_used'] = True
-        
+        response_data = build_response_data(recipe_data, error_message, sorted_ingredients, saved_recipes, from_cache)
+
         return Response(response_data, status=status.HTTP_200_OK)
-        
+
     except Exception:
+        if reservation is not None:
+            reservation.release()
         return Response(
             {
                 'error': 'An error occurred while generating recipes',
                 'success': False
-            }, 
+            },
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
@@ -0,0 +1,154 @@
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from ..models import MonthlyRecipeUsage, Recipe
+from ..utils.ai_get_recipe import aget_recipe_from_gemini
+from ..utils.deadline import Deadline
+from ..utils.ingredients import ingredients_fingerprint
+from ..utils.ingredient_index import get_ingredient_index
+from ..utils.metrics import QUOTA_REJECTIONS
+from ..utils.recipe_cache import get_recipe_cache
+from ..utils.single_flight import get_single_flight
+from .get_recipe import (
+    MONTHLY_RECIPE_LIMIT,
+    build_response_data,
+    cached_recipe_data,
+    process_generated_recipes,
+    save_recipes_for_user,
+    validate_ingredients,
+)
+
+# Plain Django async views: DRF's APIView is sync only, so JWT authentication
+# is done here with the same authenticator DRF uses for the sync endpoints.
+
+async def authenticate_request(request):
+    """Return the user of a JWT authenticated request, or None"""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+async def afind_similar_recipe(sorted_ingredients, threshold):
+    """Async version of find_similar_recipe"""
+    index = await sync_to_async(get_ingredient_index)()
+    recipe_id, similarity = index.best_match(sorted_ingredients, threshold)
+    if recipe_id is None:
+        return None
+
+    source_recipe = await Recipe.objects.filter(id=recipe_id).afirst()
+    if source_recipe is None:
+        index.discard(recipe_id)
+        return None
+
+    print(f"Found similar recipe ({similarity:.0%} overlap): {source_recipe.recipe_name}")
+    return source_recipe.to_recipe_dict()
+
+async def aload_recipe_from_history(sorted_ingredients):
+    """Async version of load_recipe_from_history"""
+    source_recipe = await Recipe.afind_by_ingredients(sorted_ingredients)
+    if source_recipe:
+        return source_recipe.to_recipe_dict()
+    return await afind_similar_recipe(sorted_ingredients, settings.RECIPE_SIMILARITY_THRESHOLD)
+
+async def agenerate_recipes(sorted_ingredients, fingerprint, deadline=None):
+    """Async version of generate_recipes"""
+    recipe_cache = get_recipe_cache()
+
+    async def generate():
+        recipe_data, error_message = await aget_recipe_from_gemini(sorted_ingredients, deadline)
+        recipe_data = await sync_to_async(process_generated_recipes)(
+            recipe_data, error_message, sorted_ingredients, fingerprint
+        )
+        return recipe_data, error_message
+
+    async def peek():
+        cached_recipe = await recipe_cache.aget(fingerprint)
+        if cached_recipe is None:
+            return None
+        return cached_recipe_data(cached_recipe), None
+
+    timeout = deadline.remaining() if deadline is not None else None
+    return await get_single_flight().ado(fingerprint, generate, peek, timeout)
+
+@csrf_exempt
+async def get_ingredients_async(request):
+    """
+    Async variant of get_ingredients for ASGI deployments
+
+    Same request and response format as /recipes/generate/, but the worker is
+    not blocked while Gemini generates, so one process can hold many requests.
+    """
+    deadline = Deadline(settings.RECIPE_GENERATE_ASYNC_DEADLINE)
+    if request.method != 'POST':
+        return JsonResponse(
+            {'detail': f'Method "{request.method}" not allowed.'},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+
+    user = await authenticate_request(request)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    reservation = None
+    try:
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Request body must be valid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+        array_of_ingredients = payload.get('ingredients', []) if isinstance(payload, dict) else []
+        sorted_ingredients, validation_error = validate_ingredients(array_of_ingredients)
+        if validation_error:
+            return JsonResponse({'error': validation_error}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = ingredients_fingerprint(sorted_ingredients)
+        cached_recipe = await get_recipe_cache().aget_or_load(
+            fingerprint,
+            lambda: aload_recipe_from_history(sorted_ingredients)
+        )
+        from_cache = cached_recipe is not None
+
+        if from_cache:
+            recipe_data = cached_recipe_data(cached_recipe)
+            error_message = None
+            print(f"Using cached recipe: {cached_recipe['name']}")
+        else:
+            print("Generating new recipes from AI...")
+
+            reservation = await sync_to_async(MonthlyRecipeUsage.reserve)(user, 1, MONTHLY_RECIPE_LIMIT)
+            if reservation is None:
+                QUOTA_REJECTIONS.inc(endpoint='async')
+                return JsonResponse(
+                    {'error': f'You have a maximum of {MONTHLY_RECIPE_LIMIT} Recipes to be Generated each month'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            recipe_data, error_message = await agenerate_recipes(sorted_ingredients, fingerprint, deadline)
+
+        saved_recipes = await sync_to_async(save_recipes_for_user)(
+            user, recipe_data, sorted_ingredients, deadline, reservation
+        )
+
+        response_data = build_response_data(recipe_data, error_message, sorted_ingredients, saved_recipes, from_cache)
+        return JsonResponse(response_data, status=status.HTTP_200_OK)
+
+    except Exception:
+        if reservation is not None:
+            await sync_to_async(reservation.release)()
+        return JsonResponse(
+            {
+                'error': 'An error occurred while generating recipes',
+                'success': False
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
@@ -0,0 +1,240 @@
+from concurrent.futures import ThreadPoolExecutor
+from ..models import MonthlyRecipeUsage, Recipe, RecipeHistory
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.db import connection
+from ..utils.deadline import Deadline, statement_timeout
+from ..utils.ingredients import ingredients_fingerprint
+from ..utils.ingredient_index import get_ingredient_index
+from ..utils.metrics import QUOTA_REJECTIONS
+from ..utils.recipe_cache import get_recipe_cache
+from .get_recipe import (
+    MONTHLY_RECIPE_LIMIT,
+    build_response_data,
+    cached_recipe_data,
+    generate_recipes,
+    validate_ingredients,
+)
+
+def load_recipes_from_history(ingredient_sets):
+    """
+    Batch version of load_recipe_from_history
+
+    Exact matches come from one query, close enough matches from the
+    ingredient index and one more query.
+
+    Args:
+        ingredient_sets (dict): Fingerprint to sorted ingredients
+
+    Returns:
+        dict: Fingerprint to recipe dict, for the sets that have one
+    """
+    recipes = {
+        fingerprint: recipe.to_recipe_dict()
+        for fingerprint, recipe in Recipe.find_many_by_ingredients(ingredient_sets.values()).items()
+    }
+
+    index = get_ingredient_index()
+    similar_ids = {}
+    for fingerprint, sorted_ingredients in ingredient_sets.items():
+        if fingerprint not in recipes:
+            recipe_id, _ = index.best_match(sorted_ingredients, settings.RECIPE_SIMILARITY_THRESHOLD)
+            if recipe_id is not None:
+                similar_ids[fingerprint] = recipe_id
+
+    if similar_ids:
+        similar_recipes = Recipe.objects.in_bulk(similar_ids.values())
+        for fingerprint, recipe_id in similar_ids.items():
+            if recipe_id in similar_recipes:
+                recipes[fingerprint] = similar_recipes[recipe_id].to_recipe_dict()
+            else:
+                index.discard(recipe_id)
+    return recipes
+
+def resolve_cached_recipes(ingredient_sets):
+    """Look every set up in the cache tiers, then the database for all the misses at once"""
+    recipe_cache = get_recipe_cache()
+    recipes = {}
+    for fingerprint in ingredient_sets:
+        cached_recipe = recipe_cache.get(fingerprint)
+        if cached_recipe is not None:
+            recipes[fingerprint] = cached_recipe
+
+    missing = {fingerprint: ingredients for fingerprint, ingredients in ingredient_sets.items() if fingerprint not in recipes}
+    if missing:
+        for fingerprint, recipe in load_recipes_from_history(missing).items():
+            recipe_cache.set(fingerprint, recipe)
+            recipes[fingerprint] = recipe
+    return recipes
+
+def generate_missing_recipes(missing, deadline):
+    """
+    Generate the recipes of several ingredient sets concurrently
+
+    Returns:
+        dict: Fingerprint to (recipe_data, error_message)
+    """
+    def generate(fingerprint):
+        try:
+            return generate_recipes(missing[fingerprint], fingerprint, deadline)
+        finally:
+            # Pool threads get their own connection, don't leak it
+            connection.close()
+
+    workers = min(settings.RECIPE_BATCH_MAX_WORKERS, len(missing))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(missing, executor.map(generate, missing)))
+
+def bulk_save_recipes_for_user(user, served, deadline=None, reservation=None):
+    """
+    Batch version of save_recipes_for_user, new history entries are saved with one bulk_create
+
+    Args:
+        served (dict): Fingerprint to (recipe_data, sorted_ingredients)
+        reservation (UsageReservation): Optional, settled with the new history entries
+
+    Returns:
+        dict: Fingerprint to the IDs of the user's history entries for its recipes
+    """
+    recipe_names = {
+        recipe.get('name', 'Untitled Recipe')
+        for recipe_data, _ in served.values()
+        for recipe in (recipe_data or {}).get('recipes', [])
+    }
+
+    with statement_timeout(deadline):
+        # A user's history holds each recipe name once
+        saved_ids = dict(
+            RecipeHistory.objects.filter(user=user, recipe__recipe_name__in=recipe_names)
+            .values_list('recipe__recipe_name', 'id')
+        )
+        new_recipes = {}
+        for recipe_data, sorted_ingredients in served.values():
+            for recipe in (recipe_data or {}).get('recipes', []):
+                recipe_name = recipe.get('name', 'Untitled Recipe')
+                if recipe_name not in saved_ids and recipe_name not in new_recipes:
+                    new_recipes[recipe_name] = RecipeHistory.from_recipe_dict(
+                        recipe,
+                        user=user,
+                        main_ingredients=sorted_ingredients
+                    )
+        for recipe_history in RecipeHistory.bulk_save(list(new_recipes.values())):
+            saved_ids[recipe_history.recipe.recipe_name] = recipe_history.id
+
+    MonthlyRecipeUsage.record(user, len(new_recipes), reservation)
+    print(f"Saved {len(new_recipes)} new recipes for user in one batch")
+    return {
+        fingerprint: [
+            saved_ids[recipe.get('name', 'Untitled Recipe')]
+            for recipe in (recipe_data or {}).get('recipes', [])
+            if recipe.get('name', 'Untitled Recipe') in saved_ids
+        ]
+        for fingerprint, (recipe_data, _) in served.items()
+    }
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@csrf_exempt
+def get_ingredients_batch(request):
+    """
+    Generate recipes for several ingredient sets in one request
+
+    Each item of the response has the fields of recipes/generate/ plus its
+    index, or an error for an invalid ingredient set. The monthly limit is
+    checked once, against the number of sets that need a Gemini call.
+    """
+    deadline = Deadline(settings.RECIPE_GENERATE_BATCH_DEADLINE)
+    reservation = None
+    try:
+        ingredient_sets = request.data.get('ingredient_sets', [])
+        if not isinstance(ingredient_sets, list) or not ingredient_sets:
+            return Response(
+                {'error': 'ingredient_sets must be a non-empty array of ingredient arrays'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(ingredient_sets) > settings.RECIPE_BATCH_MAX_SIZE:
+            return Response(
+                {'error': f'A batch can contain at most {settings.RECIPE_BATCH_MAX_SIZE} ingredient sets'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Validate every item, identical sets are looked up and generated once
+        items = []
+        valid_sets = {}
+        for array_of_ingredients in ingredient_sets:
+            sorted_ingredients, validation_error = validate_ingredients(array_of_ingredients)
+            if validation_error:
+                items.append((None, None, validation_error))
+                continue
+            fingerprint = ingredients_fingerprint(sorted_ingredients)
+            valid_sets[fingerprint] = sorted_ingredients
+            items.append((fingerprint, sorted_ingredients, None))
+
+        cached_recipes = resolve_cached_recipes(valid_sets) if valid_sets else {}
+        missing = {fingerprint: ingredients for fingerprint, ingredients in valid_sets.items() if fingerprint not in cached_recipes}
+
+        if missing:
+            print(f"Generating {len(missing)} of {len(valid_sets)} recipes from AI...")
+            # One reservation for the whole batch
+            reservation = MonthlyRecipeUsage.reserve(request.user, len(missing), MONTHLY_RECIPE_LIMIT)
+            if reservation is None:
+                QUOTA_REJECTIONS.inc(endpoint='batch')
+                return Response(
+                    {
+                        'error': f'You have a maximum of {MONTHLY_RECIPE_LIMIT} Recipes to be Generated each month',
+                        'recipes_to_generate': len(missing),
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        outcomes = {fingerprint: (cached_recipe_data(recipe), None) for fingerprint, recipe in cached_recipes.items()}
+        outcomes.update(generate_missing_recipes(missing, deadline) if missing else {})
+
+        saved_recipes = bulk_save_recipes_for_user(
+            request.user,
+            {fingerprint: (outcomes[fingerprint][0], valid_sets[fingerprint]) for fingerprint in outcomes},
+            deadline,
+            reservation
+        )
+
+        results = []
+        for index, (fingerprint, sorted_ingredients, validation_error) in enumerate(items):
+            if validation_error:
+                results.append({'index': index, 'success': False, 'error': validation_error})
+                continue
+            recipe_data, error_message = outcomes[fingerprint]
+            item = build_response_data(
+                recipe_data,
+                error_message,
+                sorted_ingredients,
+                saved_recipes[fingerprint],
+                fingerprint in cached_recipes
+            )
+            item['index'] = index
+            results.append(item)
+
+        return Response(
+            {
+                'success': True,
+                'results': results,
+                'generated_count': len(missing),
+                'cached_count': len(cached_recipes),
+            },
+            status=status.HTTP_200_OK
+        )
+
+    except Exception:
+        if reservation is not None:
+            reservation.release()
+        return Response(
+            {
+                'error': 'An error occurred while generating recipes',
+                'success': False
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
@@ -0,0 +1,165 @@
+import json
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from ..models import MonthlyRecipeUsage
+from ..utils.ai_get_recipe import stream_recipe_from_gemini
+from ..utils.deadline import Deadline
+from ..utils.ingredients import ingredients_fingerprint
+from ..utils.llm_json import IncrementalJSONParser
+from ..utils.metrics import QUOTA_REJECTIONS
+from ..utils.recipe_cache import get_recipe_cache
+from .get_recipe import (
+    MONTHLY_RECIPE_LIMIT,
+    build_response_data,
+    cached_recipe_data,
+    load_recipe_from_history,
+    process_generated_recipes,
+    save_recipes_for_user,
+    validate_ingredients,
+)
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def completed_fields(partial_data, final=False):
+    """
+    Yield (recipe_index, field, value) for every recipe field that is fully received
+
+    The reply is written key by key, so every key of a recipe except the last
+    one is complete, unless the recipe is followed by more output or final is set.
+    """
+    recipes = partial_data.get('recipes') if isinstance(partial_data, dict) else None
+    if not isinstance(recipes, list):
+        return
+
+    for recipe_index, recipe in enumerate(recipes):
+        if not isinstance(recipe, dict):
+            continue
+        fields = list(recipe.items())
+        if not final and recipe_index == len(recipes) - 1 and list(partial_data)[-1] == 'recipes':
+            fields = fields[:-1]
+        for field, value in fields:
+            yield recipe_index, field, value
+
+def stream_generated_recipes(user, sorted_ingredients, fingerprint, deadline=None, reservation=None):
+    """
+    Stream recipe fields as Gemini writes them, then persist and send the full response
+
+    The reservation is settled with the saved recipes, or released when the
+    stream ends early, e.g. because the client went away.
+    """
+    try:
+        yield from _stream_generated_recipes(user, sorted_ingredients, fingerprint, deadline, reservation)
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+def _stream_generated_recipes(user, sorted_ingredients, fingerprint, deadline, reservation):
+    parser = IncrementalJSONParser()
+    sent_fields = set()
+
+    def new_fields(partial_data, final=False):
+        for recipe_index, field, value in completed_fields(partial_data, final):
+            if field == 'main_ingredients':
+                value = sorted_ingredients
+            if (recipe_index, field) not in sent_fields:
+                sent_fields.add((recipe_index, field))
+                yield sse_event('field', {'recipe': recipe_index, 'field': field, 'value': value})
+
+    # Send the headers right away so the client knows the request was accepted
+    yield sse_event('start', {'ingredients_used': sorted_ingredients})
+
+    for event, payload in stream_recipe_from_gemini(sorted_ingredients, deadline):
+        if event == 'delta':
+            yield from new_fields(parser.feed(payload).partial())
+
+        elif event == 'retry':
+            # The next API key starts over, drop what the client has so far
+            parser = IncrementalJSONParser()
+            sent_fields.clear()
+            yield sse_event('reset', {})
+
+        elif event == 'result':
+            recipe_data, error_message = payload
+            recipe_data = process_generated_recipes(recipe_data, error_message, sorted_ingredients, fingerprint)
+
+            # A fallback replaces whatever was streamed
+            if error_message and sent_fields:
+                sent_fields.clear()
+                yield sse_event('reset', {})
+            yield from new_fields(recipe_data, final=True)
+
+            saved_recipes = save_recipes_for_user(user, recipe_data, sorted_ingredients, deadline, reservation)
+            response_data = build_response_data(recipe_data, error_message, sorted_ingredients, saved_recipes, False)
+            yield sse_event('done', response_data)
+
+def cached_recipe_stream(user, recipe_data, sorted_ingredients):
+    """Stream a stored recipe as a single done event"""
+    saved_recipes = save_recipes_for_user(user, recipe_data, sorted_ingredients)
+    yield sse_event('done', build_response_data(recipe_data, None, sorted_ingredients, saved_recipes, True))
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@csrf_exempt
+def stream_ingredients(request):
+    """
+    Streaming variant of get_ingredients, sending Server-Sent Events
+
+    Events:
+        start: the request was accepted and the recipe is being generated
+        field: {recipe, field, value} as soon as a recipe field is complete
+        reset: fields sent so far are void, generation started over
+        done: the same body /recipes/generate/ returns, always last
+    """
+    deadline = Deadline(settings.RECIPE_GENERATE_STREAM_DEADLINE)
+    try:
+        array_of_ingredients = request.data.get('ingredients', [])
+
+        sorted_ingredients, validation_error = validate_ingredients(array_of_ingredients)
+        if validation_error:
+            return Response(
+                {'error': validation_error},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = ingredients_fingerprint(sorted_ingredients)
+        cached_recipe = get_recipe_cache().get_or_load(
+            fingerprint,
+            lambda: load_recipe_from_history(sorted_ingredients)
+        )
+
+        if cached_recipe is not None:
+            print(f"Using cached recipe: {cached_recipe['name']}")
+            events = cached_recipe_stream(request.user, cached_recipe_data(cached_recipe), sorted_ingredients)
+        else:
+            reservation = MonthlyRecipeUsage.reserve(request.user, 1, MONTHLY_RECIPE_LIMIT)
+            if reservation is None:
+                QUOTA_REJECTIONS.inc(endpoint='stream')
+                return Response(
+                    {'error': f'You have a maximum of {MONTHLY_RECIPE_LIMIT} Recipes to be Generated each month'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            print("Streaming new recipes from AI...")
+            events = stream_generated_recipes(request.user, sorted_ingredients, fingerprint, deadline, reservation)
+
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    except Exception:
+        return Response(
+            {
+                'error': 'An error occurred while generating recipes',
+                'success': False
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
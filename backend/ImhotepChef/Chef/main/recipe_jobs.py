@@ -0,0 +1,143 @@
+from ..models import MonthlyRecipeUsage, RecipeJob
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.urls import reverse
+from ..utils.deadline import Deadline
+from ..utils.ingredients import ingredients_fingerprint
+from ..utils.metrics import QUOTA_REJECTIONS
+from ..utils.recipe_cache import get_recipe_cache
+from .get_recipe import (
+    MONTHLY_RECIPE_LIMIT,
+    build_response_data,
+    cached_recipe_data,
+    generate_recipes,
+    load_recipe_from_history,
+    save_recipes_for_user,
+    validate_ingredients,
+)
+
+def process_recipe_job(job):
+    """
+    Run a claimed job: generate the recipe and save it to the user's history
+
+    A Gemini failure puts the job back in the queue while it has attempts
+    left. On the last attempt the fallback recipe is served, like the
+    generate endpoint does.
+    """
+    deadline = Deadline(settings.RECIPE_JOB_DEADLINE)
+    sorted_ingredients = job.ingredients
+    fingerprint = ingredients_fingerprint(sorted_ingredients)
+    try:
+        cached_recipe = get_recipe_cache().get_or_load(
+            fingerprint,
+            lambda: load_recipe_from_history(sorted_ingredients)
+        )
+        from_cache = cached_recipe is not None
+        if from_cache:
+            recipe_data, error_message = cached_recipe_data(cached_recipe), None
+        else:
+            recipe_data, error_message = generate_recipes(sorted_ingredients, fingerprint, deadline)
+            # Only retried while attempts are left, the last one serves the fallback
+            if error_message and job.attempts < job.max_attempts:
+                job.retry_later(error_message, settings.RECIPE_JOB_RETRY_DELAY)
+                print(f"Recipe job {job.id} attempt {job.attempts} failed, retrying: {error_message}")
+                return
+
+        # Settles the recipe reserved at enqueue
+        saved_recipes = save_recipes_for_user(
+            job.user, recipe_data, sorted_ingredients, deadline, job.usage_reservation()
+        )
+        job.finish(
+            RecipeJob.SUCCEEDED,
+            result=build_response_data(recipe_data, error_message, sorted_ingredients, saved_recipes, from_cache)
+        )
+        print(f"Recipe job {job.id} succeeded")
+
+    except Exception as job_error:
+        print(f"Recipe job {job.id} attempt {job.attempts} raised: {job_error}")
+        job.retry_later(f"An error occurred while generating recipes: {job_error}", settings.RECIPE_JOB_RETRY_DELAY)
+
+def job_status_response(request, job, response_status):
+    response_data = job.to_status_dict()
+    response_data['status_url'] = request.build_absolute_uri(reverse('recipe_job_status', args=[job.id]))
+    return Response(response_data, status=response_status)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@csrf_exempt
+def enqueue_recipe_job(request):
+    """
+    Queue a recipe generation and return its job ID right away
+
+    Recipes already in the cache or the database are served at once, as a
+    job that has already succeeded.
+    """
+    try:
+        array_of_ingredients = request.data.get('ingredients', [])
+
+        sorted_ingredients, validation_error = validate_ingredients(array_of_ingredients)
+        if validation_error:
+            return Response(
+                {'error': validation_error},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = ingredients_fingerprint(sorted_ingredients)
+        cached_recipe = get_recipe_cache().get_or_load(
+            fingerprint,
+            lambda: load_recipe_from_history(sorted_ingredients)
+        )
+        if cached_recipe is not None:
+            print(f"Using cached recipe: {cached_recipe['name']}")
+            recipe_data = cached_recipe_data(cached_recipe)
+            job = RecipeJob.objects.create(user=request.user, ingredients=sorted_ingredients, attempts=1)
+            saved_recipes = save_recipes_for_user(request.user, recipe_data, sorted_ingredients)
+            job.finish(
+                RecipeJob.SUCCEEDED,
+                result=build_response_data(recipe_data, None, sorted_ingredients, saved_recipes, True)
+            )
+            return job_status_response(request, job, status.HTTP_200_OK)
+
+        # The job holds its reserved recipe until it finishes, so queued jobs count against the limit too
+        reservation = MonthlyRecipeUsage.reserve(request.user, 1, MONTHLY_RECIPE_LIMIT)
+        if reservation is None:
+            QUOTA_REJECTIONS.inc(endpoint='jobs')
+            return Response(
+                {'error': f'You have a maximum of {MONTHLY_RECIPE_LIMIT} Recipes to be Generated each month'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            job = RecipeJob.objects.create(
+                user=request.user,
+                ingredients=sorted_ingredients,
+                max_attempts=settings.RECIPE_JOB_MAX_ATTEMPTS,
+                usage_month=reservation.month
+            )
+        except Exception:
+            reservation.release()
+            raise
+        print(f"Queued recipe job {job.id}")
+        return job_status_response(request, job, status.HTTP_202_ACCEPTED)
+
+    except Exception:
+        return Response(
+            {
+                'error': 'An error occurred while queueing the recipe generation',
+                'success': False
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_recipe_job(request, job_id):
+    """Status of one of the user's recipe jobs, with the generate response once it succeeded"""
+    job = RecipeJob.objects.filter(id=job_id, user=request.user).first()
+    if job is None:
+        return Response({'error': 'Recipe job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return job_status_response(request, job, status.HTTP_200_OK)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from Chef.models import Recipe
+from Chef.utils.ingredients import ingredients_fingerprint
+
+
+class Command(BaseCommand):
+    help = 'Fill Recipe.ingredients_fingerprint for rows that have none, or recompute every row with --all'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows updated per query')
+        parser.add_argument('--all', action='store_true', help='Recompute every row, not only empty fingerprints')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Recipe.objects.order_by('pk').only('pk', 'main_ingredients', 'ingredients_fingerprint')
+        if not options['all']:
+            queryset = queryset.filter(ingredients_fingerprint='')
+
+        updated = 0
+        batch = []
+        # bulk_update skips save(), so the fingerprint is computed here
+        for recipe in queryset.iterator(chunk_size=batch_size):
+            fingerprint = ingredients_fingerprint(recipe.main_ingredients or [])
+            if fingerprint == recipe.ingredients_fingerprint:
+                continue
+            recipe.ingredients_fingerprint = fingerprint
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                Recipe.objects.bulk_update(batch, ['ingredients_fingerprint'])
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            Recipe.objects.bulk_update(batch, ['ingredients_fingerprint'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} recipe fingerprints'))
@@ -0,0 +1,266 @@
+import contextlib
+import io
+import json
+import os
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from Chef.main.get_recipe import load_recipe_from_history
+from Chef.models import Recipe, RecipeHistory, User
+from Chef.utils import llm_backend
+from Chef.utils.config import Gemini_Config
+from Chef.utils.fake_llm import fake_recipe
+from Chef.utils.ingredients import canonical_ingredients, ingredients_fingerprint
+from Chef.utils.recipe_cache import get_recipe_cache
+
+SCENARIOS = ('cache_hit', 'cache_miss', 'fallback', 'history')
+# Generations per bench user, below the monthly limit
+GENERATIONS_PER_USER = 20
+# Ingredient sets served by the cache_hit scenario
+CACHED_SETS = 20
+
+
+def latency_summary(latencies):
+    """p50/p95/p99 and mean of a list of latencies, in milliseconds"""
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+    return {
+        'p50_ms': round(p50 * 1000, 2),
+        'p95_ms': round(p95 * 1000, 2),
+        'p99_ms': round(p99 * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test /recipes/generate/ and /user-data/recipe/history/ with JWT clients and the fake LLM backend, '
+        'reporting latency percentiles, throughput and SQL queries per scenario'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'Comma separated, from {", ".join(SCENARIOS)}')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency level')
+        parser.add_argument('--concurrency', default='8', help='Concurrent clients, a comma separated list runs every level')
+        parser.add_argument('--llm-latency', type=float, default=0.2, help='Median fake LLM latency in seconds')
+        parser.add_argument('--llm-distribution', default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+        parser.add_argument('--history-size', type=int, default=100, help='Recipes in each history user\'s history')
+        parser.add_argument('--output', default=os.path.join(settings.BASE_DIR, '.cache', 'bench', 'endpoints.jsonl'),
+                            help='JSON lines file the run is appended to, and compared with its previous run')
+        parser.add_argument('--label', default='', help='Free text stored with the run, e.g. a branch name')
+
+    def handle(self, *args, **options):
+        scenarios = [scenario.strip() for scenario in options['scenarios'].split(',') if scenario.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma separated list of integers')
+
+        self.run_id = uuid.uuid4().hex[:8]
+        self.fingerprints = set()
+        results = []
+        try:
+            self._seed(options)
+            # The test clients send requests to the 'testserver' host
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for scenario in scenarios:
+                    for concurrency in levels:
+                        result = self._run(scenario, concurrency, options)
+                        results.append(result)
+                        self._report(result)
+        finally:
+            self._cleanup()
+
+        record = {
+            'run_at': timezone.now().isoformat(),
+            'label': options['label'],
+            'database': connection.vendor,
+            'llm': {'backend': 'fake', 'latency': options['llm_latency'], 'distribution': options['llm_distribution']},
+            'results': results,
+        }
+        if options['output']:
+            self._compare(self._previous_run(options['output']), results)
+            os.makedirs(os.path.dirname(os.path.abspath(options['output'])), exist_ok=True)
+            with open(options['output'], 'a', encoding='utf-8') as output_file:
+                output_file.write(json.dumps(record) + os.linesep)
+            self.stdout.write(f'Results appended to {options["output"]}')
+
+    def _ingredients(self, scenario, i):
+        ingredients = canonical_ingredients([f'bench{self.run_id}{scenario}{i}x{j}' for j in range(3)])
+        self.fingerprints.add(ingredients_fingerprint(ingredients))
+        return ingredients
+
+    def _user(self, name):
+        user = User.objects.create(username=f'bench_{self.run_id}_{name}', email=f'bench_{self.run_id}_{name}@example.com')
+        return str(RefreshToken.for_user(user).access_token)
+
+    def _seed(self, options):
+        """Stored recipes for the cache_hit sets, and users with a long history"""
+        owner = User.objects.create(username=f'bench_{self.run_id}_owner', email=f'bench_{self.run_id}_owner@example.com')
+        RecipeHistory.bulk_save([
+            RecipeHistory.from_recipe_dict(fake_recipe(ingredients), user=owner, main_ingredients=ingredients)
+            for ingredients in (self._ingredients('hit', i) for i in range(CACHED_SETS))
+        ])
+
+        self.history_tokens = []
+        for i in range(4):
+            token = self._user(f'history{i}')
+            user = User.objects.get(username=f'bench_{self.run_id}_history{i}')
+            RecipeHistory.bulk_save([
+                RecipeHistory.from_recipe_dict(fake_recipe(ingredients), user=user, main_ingredients=ingredients)
+                for ingredients in (self._ingredients(f'history{i}', n) for n in range(options['history_size']))
+            ])
+            self.history_tokens.append(token)
+        self.history_pages = max(1, options['history_size'] // 5)
+
+    def _requests(self, scenario, concurrency, options):
+        """(method, path, payload, token) of every request of a scenario run"""
+        count = options['requests']
+        if scenario == 'history':
+            return [
+                ('get', f'/api/user-data/recipe/history/?page={i % self.history_pages + 1}', None,
+                 self.history_tokens[i % len(self.history_tokens)])
+                for i in range(count)
+            ]
+        if scenario == 'cache_hit':
+            tokens = [self._user(f'{scenario}{concurrency}_{i}') for i in range(concurrency)]
+            return [
+                ('post', '/api/recipes/generate/', {'ingredients': self._ingredients('hit', i % CACHED_SETS)}, tokens[i % len(tokens)])
+                for i in range(count)
+            ]
+        # Misses and fallbacks are charged to the user, spread them below the monthly limit
+        tokens = [self._user(f'{scenario}{concurrency}_{i}') for i in range(count // GENERATIONS_PER_USER + 1)]
+        return [
+            ('post', '/api/recipes/generate/', {'ingredients': self._ingredients(f'{scenario}{concurrency}_', i)},
+             tokens[i % len(tokens)])
+            for i in range(count)
+        ]
+
+    def _run(self, scenario, concurrency, options):
+        requests = self._requests(scenario, concurrency, options)
+        fake_settings = override_settings(
+            LLM_BACKEND='fake',
+            FAKE_LLM_LATENCY=options['llm_latency'],
+            FAKE_LLM_LATENCY_DISTRIBUTION=options['llm_distribution'],
+            # Every call fails in the fallback scenario
+            FAKE_LLM_ERROR_RATE=1.0 if scenario == 'fallback' else 0.0,
+            FAKE_LLM_RATE_LIMIT_RATE=0.0,
+            FAKE_LLM_TRUNCATE_RATE=0.0,
+        )
+
+        def send(request):
+            method, path, payload, token = request
+            client = Client()
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    if method == 'get':
+                        response = client.get(path, secure=True, headers={'authorization': f'Bearer {token}'})
+                    else:
+                        response = client.post(
+                            path,
+                            data=json.dumps(payload),
+                            content_type='application/json',
+                            secure=True,
+                            headers={'authorization': f'Bearer {token}'},
+                        )
+                    elapsed = time.perf_counter() - start
+                return elapsed, response.status_code, len(queries)
+            finally:
+                connection.close()
+
+        # A fresh backend and key pool per run, so open circuits don't carry over
+        with fake_settings, mock.patch.object(llm_backend, '_llm_backend', None), \
+                mock.patch.object(Gemini_Config, '_key_pool', None):
+            if scenario == 'cache_hit':
+                # Warm the cache tiers, the measured requests are all hits
+                for i in range(CACHED_SETS):
+                    ingredients = self._ingredients('hit', i)
+                    get_recipe_cache().get_or_load(
+                        ingredients_fingerprint(ingredients),
+                        lambda: load_recipe_from_history(ingredients)
+                    )
+            # The generate path logs every request, keep it out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    outcomes = list(pool.map(send, requests))
+                wall_time = time.perf_counter() - start
+
+        latencies = [latency for latency, _, _ in outcomes]
+        query_counts = [query_count for _, _, query_count in outcomes]
+        return {
+            'scenario': scenario,
+            'concurrency': concurrency,
+            'requests': len(outcomes),
+            'errors': sum(1 for _, status_code, _ in outcomes if status_code != 200),
+            'wall_time_s': round(wall_time, 3),
+            'throughput_rps': round(len(outcomes) / wall_time, 2),
+            **latency_summary(latencies),
+            'queries_mean': round(statistics.fmean(query_counts), 2),
+            'queries_max': max(query_counts),
+        }
+
+    def _report(self, result):
+        self.stdout.write(
+            f'{result["scenario"]:>10} x{result["concurrency"]:<3}: {result["requests"]} requests, '
+            f'{result["throughput_rps"]:.1f} req/s, p50 {result["p50_ms"]:.1f}ms, p95 {result["p95_ms"]:.1f}ms, '
+            f'p99 {result["p99_ms"]:.1f}ms, {result["queries_mean"]:.1f} queries/request '
+            f'(max {result["queries_max"]}), errors {result["errors"]}'
+        )
+
+    def _previous_run(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as output_file:
+            lines = [line for line in output_file if line.strip()]
+        try:
+            return json.loads(lines[-1]) if lines else None
+        except ValueError:
+            return None
+
+    def _compare(self, previous, results):
+        """Print the change of p95 latency and throughput since the previous run"""
+        if not previous:
+            return
+        before = {(result['scenario'], result['concurrency']): result for result in previous.get('results', [])}
+        label = f' ({previous["label"]})' if previous.get('label') else ''
+        self.stdout.write(f'Compared with the run of {previous.get("run_at")}{label}:')
+        for result in results:
+            old = before.get((result['scenario'], result['concurrency']))
+            if not old:
+                continue
+            self.stdout.write(
+                f'{result["scenario"]:>10} x{result["concurrency"]:<3}: '
+                f'p95 {old["p95_ms"]:.1f} -> {result["p95_ms"]:.1f}ms ({self._change(old["p95_ms"], result["p95_ms"])}), '
+                f'throughput {old["throughput_rps"]:.1f} -> {result["throughput_rps"]:.1f} req/s '
+                f'({self._change(old["throughput_rps"], result["throughput_rps"])}), '
+                f'queries {old["queries_mean"]:.1f} -> {result["queries_mean"]:.1f}'
+            )
+
+    @staticmethod
+    def _change(old, new):
+        return f'{(new - old) / old:+.0%}' if old else 'n/a'
+
+    def _cleanup(self):
+        """Delete the bench users and every recipe and cache entry of the bench ingredient sets"""
+        User.objects.filter(username__startswith=f'bench_{self.run_id}_').delete()
+        Recipe.objects.filter(ingredients_fingerprint__in=self.fingerprints).delete()
+        recipe_cache = get_recipe_cache()
+        for fingerprint in self.fingerprints:
+            recipe_cache.delete(fingerprint)
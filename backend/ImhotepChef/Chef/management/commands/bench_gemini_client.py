@@ -0,0 +1,58 @@
+import statistics
+import time
+from unittest import mock
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from django.core.management.base import BaseCommand
+from Chef.utils.recipe_prompt import build_recipe_prompt
+from Chef.utils.config import Gemini_Config
+
+FAKE_RESPONSE = glm.GenerateContentResponse(
+    candidates=[glm.Candidate(
+        content=glm.Content(role='model', parts=[glm.Part(text='{"recipes": []}')]),
+        finish_reason=glm.Candidate.FinishReason.STOP,
+    )]
+)
+
+
+def legacy_generate(api_key, prompt):
+    """The call path before the model registry: global configure, new model, throwaway chat"""
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(
+        model_name="gemini-2.0-flash",
+        generation_config={"temperature": 0.7, "top_p": 0.95, "top_k": 64, "max_output_tokens": 8192},
+    )
+    chat_session = model.start_chat(history=[])
+    return chat_session.send_message(prompt).text
+
+
+def registry_generate(api_key, prompt):
+    return Gemini_Config.get_model(api_key).generate_content(prompt).text
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-call client setup overhead of Gemini calls, with the network call stubbed out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200)
+        parser.add_argument('--keys', type=int, default=2, help='Distinct API keys to alternate between')
+
+    def handle(self, *args, **options):
+        keys = [f'bench-key-{index}' for index in range(options['keys'])]
+        prompt = build_recipe_prompt(['egg', 'onion', 'tomato'])
+
+        # Only the RPC is stubbed, client and channel setup run for real
+        with mock.patch.object(glm.GenerativeServiceClient, 'generate_content', return_value=FAKE_RESPONSE):
+            for name, generate in (('legacy', legacy_generate), ('registry', registry_generate)):
+                timings = []
+                for call in range(options['calls']):
+                    api_key = keys[call % len(keys)]
+                    start = time.perf_counter()
+                    generate(api_key, prompt)
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f'{name:>8}: mean {statistics.mean(timings):.3f}ms, '
+                    f'p50 {statistics.median(timings):.3f}ms, '
+                    f'p95 {statistics.quantiles(timings, n=20)[-1]:.3f}ms per call '
+                    f'(first call {timings[0]:.3f}ms)'
+                )
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from Chef.models import User
+from Chef.utils.config import Gemini_Config
+
+FAKE_RESPONSE = json.dumps({
+    'recipes': [{
+        'name': 'Benchmark Stew',
+        'description': 'Generated by the latency-injected fake model',
+        'difficulty': 'Easy',
+        'prep_time': '5 minutes',
+        'cook_time': '20 minutes',
+        'total_time': '25 minutes',
+        'servings': 2,
+        'main_ingredients': [],
+        'additional_ingredients': [],
+        'instructions': ['Cook everything'],
+        'tips': [],
+        'nutrition': {'calories': 300},
+    }],
+    'success': True,
+    'message': 'Recipe generated successfully',
+})
+
+
+class FakeResponse:
+    text = FAKE_RESPONSE
+
+
+class FakeModel:
+    """Stands in for the Gemini model, sleeping for the injected latency"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.latency)
+        return FakeResponse()
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self.latency)
+        return FakeResponse()
+
+
+class Command(BaseCommand):
+    help = 'Compare sync and async /recipes/generate/ throughput against a latency-injected fake Gemini model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Cache-miss requests per mode')
+        parser.add_argument('--latency', type=float, default=2.0, help='Injected Gemini latency in seconds')
+        parser.add_argument('--sync-workers', type=int, default=8, help='Concurrent sync workers (threads)')
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        requests = options['requests']
+        # Stay below the monthly limit for every user
+        users = [
+            User.objects.create(username=f'bench_{run_id}_{i}', email=f'bench_{run_id}_{i}@example.com')
+            for i in range(requests // 20 + 1)
+        ]
+        tokens = [str(RefreshToken.for_user(user).access_token) for user in users]
+
+        try:
+            # The test clients send requests to the 'testserver' host
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), \
+                    mock.patch.object(Gemini_Config, 'API_KEYS', ['fake-key']), \
+                    mock.patch.object(Gemini_Config, 'get_model', return_value=FakeModel(options['latency'])):
+                self._report('sync', *self._run_sync(run_id, tokens, requests, options['sync_workers']))
+                self._report('async', *asyncio.run(self._run_async(run_id, tokens, requests)))
+        finally:
+            User.objects.filter(username__startswith=f'bench_{run_id}_').delete()
+
+    def _payload(self, run_id, mode, i):
+        # Unique ingredient sets keep every request a cache miss
+        return {'ingredients': [f'{mode}{run_id}a{i}', f'{mode}{run_id}b{i}', f'{mode}{run_id}c{i}']}
+
+    def _run_sync(self, run_id, tokens, requests, workers):
+        def send(i):
+            client = Client()
+            start = time.perf_counter()
+            response = client.post(
+                '/api/recipes/generate/',
+                data=json.dumps(self._payload(run_id, 'sync', i)),
+                content_type='application/json',
+                secure=True,
+                headers={'authorization': f'Bearer {tokens[i % len(tokens)]}'},
+            )
+            elapsed = time.perf_counter() - start
+            connection.close()
+            return elapsed, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(send, range(requests)))
+        return time.perf_counter() - start, results
+
+    async def _run_async(self, run_id, tokens, requests):
+        client = AsyncClient()
+
+        async def send(i):
+            start = time.perf_counter()
+            response = await client.post(
+                '/api/recipes/generate/async/',
+                data=self._payload(run_id, 'async', i),
+                content_type='application/json',
+                secure=True,
+                headers={'authorization': f'Bearer {tokens[i % len(tokens)]}'},
+            )
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(send(i) for i in range(requests)))
+        return time.perf_counter() - start, results
+
+    def _report(self, mode, wall_time, results):
+        latencies = [latency for latency, _ in results]
+        errors = sum(1 for _, status_code in results if status_code != 200)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        self.stdout.write(
+            f'{mode:>6}: {len(results)} requests in {wall_time:.2f}s, '
+            f'{len(results) / wall_time:.1f} req/s, p50 {statistics.median(latencies):.2f}s, '
+            f'p95 {p95:.2f}s, errors {errors}'
+        )
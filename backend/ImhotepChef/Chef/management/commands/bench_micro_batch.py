@@ -0,0 +1,130 @@
+import contextlib
+import io
+import json
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.core.management.base import BaseCommand
+from Chef.utils import ai_get_recipe
+from Chef.utils.config import Gemini_Config
+
+_REQUEST_LINE_RE = re.compile(r'^(\d+)\. ', re.MULTILINE)
+
+
+def fake_recipe(number):
+    return {
+        'name': f'Benchmark Stew {number}',
+        'description': 'Generated by the rate-limited fake model',
+        'difficulty': 'Easy',
+        'prep_time': '5 minutes',
+        'cook_time': '20 minutes',
+        'total_time': '25 minutes',
+        'servings': 2,
+        'main_ingredients': [],
+        'additional_ingredients': [],
+        'instructions': ['Cook everything'],
+        'tips': [],
+        'nutrition': {'calories': 300},
+    }
+
+
+class RateLimiter:
+    """
+    Requests per minute as a steady rate, callers wait for a free slot
+
+    Slots are spread evenly over the minute, so a short run is bound by the
+    quota the same way a long one is.
+    """
+
+    def __init__(self, rpm):
+        self.interval = 60 / rpm
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        time.sleep(slot - now)
+
+
+class FakeModel:
+    """
+    Stands in for the Gemini model under a requests-per-minute quota
+
+    Every call takes a quota slot, then a fixed overhead plus a time per
+    recipe in the reply. Batch prompts get one result per numbered request.
+    """
+
+    def __init__(self, rpm, overhead, per_recipe):
+        self.limiter = RateLimiter(rpm)
+        self.overhead = overhead
+        self.per_recipe = per_recipe
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        self.limiter.acquire()
+        with self._lock:
+            self.calls += 1
+        numbers = [int(number) for number in _REQUEST_LINE_RE.findall(prompt)]
+        time.sleep(self.overhead + self.per_recipe * max(len(numbers), 1))
+        if numbers:
+            text = json.dumps({'results': [{'request': number, 'recipe': fake_recipe(number)} for number in numbers]})
+        else:
+            text = json.dumps({'recipes': [fake_recipe(0)], 'success': True, 'message': 'Recipe generated successfully'})
+        return mock.Mock(text=text, usage_metadata=None)
+
+
+class Command(BaseCommand):
+    help = 'Compare recipe throughput under a Gemini requests-per-minute limit with and without micro-batching'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Cache-miss requests per mode')
+        parser.add_argument('--clients', type=int, default=64, help='Concurrent requests')
+        parser.add_argument('--rpm', type=int, default=600, help='Gemini requests per minute')
+        parser.add_argument('--overhead', type=float, default=0.5, help='Fixed seconds per Gemini call')
+        parser.add_argument('--per-recipe', type=float, default=0.3, help='Extra seconds per recipe in a reply')
+        parser.add_argument('--window', type=float, default=Gemini_Config.MICRO_BATCH_WINDOW)
+        parser.add_argument('--max-size', type=int, default=Gemini_Config.MICRO_BATCH_MAX_SIZE)
+
+    def handle(self, *args, **options):
+        for batching in (False, True):
+            model = FakeModel(options['rpm'], options['overhead'], options['per_recipe'])
+            with mock.patch.object(Gemini_Config, 'API_KEYS', ['fake-key']), \
+                    mock.patch.object(Gemini_Config, 'get_model', return_value=model), \
+                    mock.patch.object(Gemini_Config, 'MICRO_BATCH_ENABLED', batching), \
+                    mock.patch.object(Gemini_Config, 'MICRO_BATCH_WINDOW', options['window']), \
+                    mock.patch.object(Gemini_Config, 'MICRO_BATCH_MAX_SIZE', options['max_size']), \
+                    mock.patch.object(ai_get_recipe, '_recipe_batcher', None):
+                wall_time, results = self._run(options['requests'], options['clients'])
+                batch_stats = ai_get_recipe.get_recipe_batcher().stats() if batching else None
+            self._report('batched' if batching else 'single', wall_time, results, model.calls, batch_stats)
+
+    def _run(self, requests, clients):
+        def send(i):
+            start = time.perf_counter()
+            recipe_data, error_message = ai_get_recipe.get_recipe_from_gemini([f'a{i}', f'b{i}', f'c{i}'])
+            return time.perf_counter() - start, error_message is None
+
+        # The generation layer logs every call, keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                results = list(pool.map(send, range(requests)))
+            wall_time = time.perf_counter() - start
+        return wall_time, results
+
+    def _report(self, mode, wall_time, results, calls, batch_stats):
+        latencies = [latency for latency, _ in results]
+        recipes = sum(1 for _, ok in results if ok)
+        batch_size = f', mean batch {batch_stats["mean_batch_size"]:.1f}' if batch_stats else ''
+        self.stdout.write(
+            f'{mode:>8}: {recipes}/{len(results)} recipes in {wall_time:.2f}s, '
+            f'{recipes / wall_time * 60:.0f} recipes/min from {calls} Gemini calls{batch_size}, '
+            f'p50 {statistics.median(latencies):.2f}s, p95 {statistics.quantiles(latencies, n=20)[-1]:.2f}s'
+        )
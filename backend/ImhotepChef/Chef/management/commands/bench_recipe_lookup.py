@@ -0,0 +1,79 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from Chef.models import Recipe
+from Chef.utils.ingredients import canonical_ingredients, ingredients_fingerprint
+
+INGREDIENT_POOL = [
+    'apple', 'bacon', 'basil', 'beef', 'bell pepper', 'broccoli', 'butter', 'carrot', 'cheese', 'chicken',
+    'chickpeas', 'cilantro', 'corn', 'cream', 'cucumber', 'egg', 'eggplant', 'flour', 'garlic', 'ginger',
+    'honey', 'lemon', 'lentils', 'lettuce', 'lime', 'milk', 'mushroom', 'noodles', 'oats', 'olive oil',
+    'onion', 'parsley', 'pasta', 'peas', 'pork', 'potato', 'rice', 'salmon', 'shrimp', 'spinach',
+    'sugar', 'tofu', 'tomato', 'tuna', 'yogurt', 'zucchini',
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the recipe cache lookup (JSON equality vs indexed fingerprint) against table size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated table sizes')
+        parser.add_argument('--lookups', type=int, default=200, help='Lookups timed per size and strategy')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(options['seed'])
+
+        self.stdout.write(f"{'rows':>10} {'strategy':>12} {'p50 ms':>10} {'p95 ms':>10}")
+        # Everything runs inside one transaction that is rolled back at the end
+        with transaction.atomic():
+            sampled_sets = []
+            row_count = 0
+            for size in sizes:
+                row_count += self._insert_rows(size - row_count, rng, sampled_sets)
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'ANALYZE {Recipe._meta.db_table}')
+
+                probes = [rng.choice(sampled_sets) for _ in range(options['lookups'])]
+                for name, lookup in (('json_equal', self._legacy_lookup), ('fingerprint', Recipe.find_by_ingredients)):
+                    timings = []
+                    for ingredients in probes:
+                        start = time.perf_counter()
+                        lookup(ingredients)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    p95 = statistics.quantiles(timings, n=20)[-1]
+                    self.stdout.write(f'{row_count:>10} {name:>12} {statistics.median(timings):>10.3f} {p95:>10.3f}')
+            transaction.set_rollback(True)
+
+    def _insert_rows(self, count, rng, sampled_sets, batch_size=5000):
+        """Insert random recipes; bulk_create skips save() so the keys are set here"""
+        inserted = 0
+        while inserted < count:
+            batch = []
+            for _ in range(min(batch_size, count - inserted)):
+                ingredients = canonical_ingredients(rng.sample(INGREDIENT_POOL, rng.randint(3, 6)))
+                batch.append(Recipe(
+                    recipe_name='Benchmark Recipe',
+                    recipe_description='',
+                    recipe_difficulty='Easy',
+                    servings=2,
+                    main_ingredients=ingredients,
+                    ingredients_fingerprint=ingredients_fingerprint(ingredients),
+                    # Random, so repeated ingredient sets are still separate rows
+                    content_hash=f'{rng.getrandbits(256):064x}',
+                ))
+            Recipe.objects.bulk_create(batch)
+            sampled_sets.extend(recipe.main_ingredients for recipe in batch[::50])
+            inserted += len(batch)
+        return inserted
+
+    def _legacy_lookup(self, ingredients):
+        """The previous lookup: unindexed JSON equality, queried three times"""
+        existing_recipes = Recipe.objects.filter(main_ingredients=ingredients).order_by('-created_at')
+        if existing_recipes.exists():
+            existing_recipes.first()
+        return existing_recipes.exists()
@@ -0,0 +1,172 @@
+import json
+import random
+import re
+import statistics
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from Chef.utils.llm_json import IncrementalJSONParser, parse_json, validate_recipe_data
+
+BASE_RECIPES = [
+    {
+        'name': 'Tomato Omelette',
+        'description': 'Fluffy eggs folded over a quick "tomato" and onion sauté',
+        'difficulty': 'Easy',
+        'prep_time': '5 minutes',
+        'cook_time': '10 minutes',
+        'total_time': '15 minutes',
+        'servings': 2,
+        'main_ingredients': ['egg', 'onion', 'tomato'],
+        'additional_ingredients': [{'name': 'butter', 'amount': '1 tbsp', 'optional': False}],
+        'instructions': ['Whisk the eggs with a pinch of salt', 'Soften the onion, add the tomato', 'Pour in the eggs, fold and serve'],
+        'tips': ['Use ripe tomatoes'],
+        'nutrition': {'calories': 250, 'protein': '14g', 'carbs': '8g', 'fat': '17g'},
+    },
+    {
+        'name': 'Chicken & Rice Bowl',
+        'description': 'Seared chicken over garlic rice, with a 50/50 soy-lime glaze',
+        'difficulty': 'Medium',
+        'prep_time': '15 minutes',
+        'cook_time': '25 minutes',
+        'total_time': '40 minutes',
+        'servings': 4,
+        'main_ingredients': ['chicken', 'garlic', 'rice'],
+        'additional_ingredients': [
+            {'name': 'soy sauce', 'amount': '3 tbsp', 'optional': False},
+            {'name': 'lime', 'amount': '1', 'optional': True},
+        ],
+        'instructions': [
+            'Rinse the rice and cook it with the garlic',
+            'Season the chicken and sear it for 6 minutes a side',
+            'Reduce the soy sauce and lime juice to a glaze',
+            'Slice the chicken, glaze it and serve over the rice',
+        ],
+        'tips': ['Rest the chicken before slicing', 'Day old rice works too'],
+        'nutrition': {'calories': 540, 'protein': '38g', 'carbs': '61g', 'fat': '12g'},
+    },
+]
+
+
+def _reply(recipe, indent=4):
+    return json.dumps({'recipes': [recipe], 'success': True, 'message': 'Recipe generated successfully'}, indent=indent, ensure_ascii=False)
+
+
+def _truncate(text, rng):
+    # Cut somewhere after the first instruction, so a valid recipe can be recovered
+    start = text.index('"instructions"')
+    start = text.index('",', start) + 2
+    return text[:rng.randint(start, len(text) - 2)]
+
+
+DEFECTS = {
+    'clean': lambda text, rng: text,
+    'code_fence': lambda text, rng: f'```json\n{text}\n```',
+    'prose': lambda text, rng: f'Here is a recipe you can make:\n\n{text}\n\nEnjoy your meal!',
+    'trailing_commas': lambda text, rng: re.sub(r'(["\d\]}])(\s*[}\]])', r'\1,\2', text),
+    'smart_quotes': lambda text, rng: text.replace('"name"', '“name”').replace('"servings"', '“servings”'),
+    'raw_newlines': lambda text, rng: text.replace('Whisk the eggs', 'Whisk\nthe eggs').replace('Rinse the rice', 'Rinse\nthe rice'),
+    'python_literals': lambda text, rng: text.replace('true', 'True').replace('false', 'False'),
+    'missing_commas': lambda text, rng: re.sub(r'",(\s*)"', r'"\1"', text),
+    'truncated': _truncate,
+    'fenced_truncated': lambda text, rng: '```json\n' + _truncate(text, rng),
+}
+
+
+def build_reply_corpus(seed=0, variants=5):
+    """
+    Defective Gemini replies with the recipe name each one should yield
+
+    Returns:
+        list: (defect, reply_text, expected_name) tuples
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for recipe in BASE_RECIPES:
+        for indent in (None, 4):
+            text = _reply(recipe, indent)
+            for defect, apply in DEFECTS.items():
+                # Only truncation is random, the other defects give the same reply every time
+                for _ in range(variants if 'truncated' in defect else 1):
+                    corpus.append((defect, apply(text, rng), recipe['name']))
+    return corpus
+
+
+def baseline_parse(response_text):
+    """The parser this module replaced: strip code fences and json.loads"""
+    return json.loads(response_text.replace('```json', '').replace('```', '').strip())
+
+
+def repairing_parse(response_text):
+    recipe_data, _ = parse_json(response_text)
+    return recipe_data
+
+
+def parse_streamed(response_text, chunk_size=40):
+    """Feed the reply in chunks, reading the partial result after each one like the SSE view"""
+    parser = IncrementalJSONParser()
+    for start in range(0, len(response_text), chunk_size):
+        parser.feed(response_text[start:start + chunk_size]).partial()
+    return parser.finish()
+
+
+def recovers(parse, response_text, expected_name):
+    try:
+        recipe_data = validate_recipe_data(parse(response_text))
+    except ValueError:
+        return False
+    return recipe_data['recipes'][0]['name'] == expected_name
+
+
+class Command(BaseCommand):
+    help = 'Report the repair success rate and parse time of the Gemini reply parser on a corpus of defective replies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--variants', type=int, default=20, help='Random cut points per truncated reply')
+        parser.add_argument('--repeat', type=int, default=20, help='Timing runs per reply')
+
+    def handle(self, *args, **options):
+        corpus = build_reply_corpus(options['seed'], options['variants'])
+        parsers = {'baseline': baseline_parse, 'repairing': repairing_parse, 'streamed': parse_streamed}
+
+        recovered = defaultdict(lambda: defaultdict(int))
+        totals = defaultdict(int)
+        for defect, text, expected_name in corpus:
+            totals[defect] += 1
+            for name, parse in parsers.items():
+                recovered[name][defect] += recovers(parse, text, expected_name)
+
+        self.stdout.write(f'{len(corpus)} replies')
+        self.stdout.write(f'{"defect":<18}{"replies":>8}' + ''.join(f'{name:>11}' for name in parsers))
+        for defect in DEFECTS:
+            self.stdout.write(
+                f'{defect:<18}{totals[defect]:>8}'
+                + ''.join(f'{recovered[name][defect] / totals[defect]:>11.0%}' for name in parsers)
+            )
+        self.stdout.write(
+            f'{"total":<18}{len(corpus):>8}'
+            + ''.join(f'{sum(recovered[name].values()) / len(corpus):>11.0%}' for name in parsers)
+        )
+
+        # The valid replies every parser can read compare the same work, the
+        # defective ones show the cost of the repair path
+        valid = [text for defect, text, _ in corpus if defect in ('clean', 'code_fence')]
+        defective = [text for defect, text, _ in corpus if defect not in ('clean', 'code_fence')]
+        for name, parse in parsers.items():
+            self._report_timing(f'{name} (valid)', parse, valid, options['repeat'])
+        self._report_timing('repairing (defective)', repairing_parse, defective, options['repeat'])
+
+    def _report_timing(self, label, parse, replies, repeat):
+        timings = []
+        for text in replies:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    parse(text)
+                except ValueError:
+                    pass
+                timings.append((time.perf_counter() - start) * 1e6)
+        self.stdout.write(
+            f'{label:>22}: mean {statistics.mean(timings):.0f}us, '
+            f'p95 {statistics.quantiles(timings, n=20)[-1]:.0f}us per reply'
+        )
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import transaction
+from Chef.models import Recipe, RecipeHistory
+from Chef.utils.ingredients import canonical_ingredients
+from Chef.utils.recipe_cache import get_recipe_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-key Recipe.main_ingredients, fingerprints and content hashes to the canonical ingredient form. '
+        'Recipes that end up identical are merged into the oldest one, and the recipe cache is cleared'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows updated per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would change')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        scanned = 0
+        changed = []
+        # (fingerprint, content_hash) to the oldest recipe with those keys, and newer copies to it
+        keepers = {}
+        merged = {}
+        # bulk_update skips save(), so the keys are computed here
+        for recipe in Recipe.objects.order_by('pk').iterator(chunk_size=batch_size):
+            scanned += 1
+            old_keys = (recipe.main_ingredients, recipe.ingredients_fingerprint, recipe.content_hash)
+            recipe.main_ingredients = canonical_ingredients(recipe.main_ingredients or [])
+            recipe.content_hash = ''
+            keys = recipe.set_keys()
+
+            if keys in keepers:
+                merged[recipe.pk] = keepers[keys]
+            else:
+                keepers[keys] = recipe.pk
+                if (recipe.main_ingredients, recipe.ingredients_fingerprint, recipe.content_hash) != old_keys:
+                    changed.append(recipe)
+
+        if not dry_run:
+            with transaction.atomic():
+                self._merge(merged)
+                Recipe.objects.bulk_update(
+                    changed,
+                    ['main_ingredients', 'ingredients_fingerprint', 'content_hash'],
+                    batch_size=batch_size
+                )
+            # Cached recipes and pools are keyed by the old fingerprints
+            get_recipe_cache().clear()
+
+        verb = 'Would update' if dry_run else 'Updated'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {len(changed)} and merged {len(merged)} of {scanned} recipes'
+        ))
+        if not dry_run and (changed or merged):
+            self.stdout.write(
+                'Cleared the recipe cache. Running web processes keep their ingredient index and '
+                f'up to {settings.RECIPE_CACHE_LOCAL_TTL}s of local cache until they are restarted'
+            )
+
+    def _merge(self, merged):
+        """Point the history entries of merged recipes to the recipe they duplicate, then delete them"""
+        by_keeper = {}
+        for recipe_id, keeper_id in merged.items():
+            by_keeper.setdefault(keeper_id, []).append(recipe_id)
+        for keeper_id, recipe_ids in by_keeper.items():
+            RecipeHistory.objects.filter(recipe_id__in=recipe_ids).update(recipe_id=keeper_id)
+        merged_ids = list(merged)
+        for start in range(0, len(merged_ids), 1000):
+            Recipe.objects.filter(pk__in=merged_ids[start:start + 1000]).delete()
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Chef.models import Recipe, RecipeHistory
+
+# Values the legacy body columns are emptied to
+CLEARED_FIELDS = {
+    'recipe_name': '',
+    'recipe_description': '',
+    'recipe_difficulty': '',
+    'prep_time': '',
+    'cook_time': '',
+    'total_time': '',
+    'servings': None,
+    'main_ingredients': list,
+    'additional_ingredients': list,
+    'instructions': list,
+    'tips': list,
+    'nutrition': dict,
+    'ingredients_fingerprint': '',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the recipe bodies of RecipeHistory rows saved before recipes were shared to the Recipe table, '
+        'one Recipe per distinct body, and empty their legacy columns. Safe to run again'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='History rows collapsed per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        collapsed = 0
+        recipe_ids = set()
+        while True:
+            with transaction.atomic():
+                # Collapsed rows leave the filter, so the next batch starts over from the first legacy row
+                batch = list(
+                    RecipeHistory.objects.filter(recipe__isnull=True)
+                    .select_for_update()
+                    .order_by('pk')[:batch_size]
+                )
+                if not batch:
+                    break
+
+                recipes = Recipe.intern_many([entry.get_recipe() for entry in batch])
+                for entry, recipe in zip(batch, recipes):
+                    entry.recipe = recipe
+                    for field, cleared in CLEARED_FIELDS.items():
+                        setattr(entry, field, cleared() if callable(cleared) else cleared)
+                    recipe_ids.add(recipe.id)
+                RecipeHistory.objects.bulk_update(batch, ['recipe', *CLEARED_FIELDS])
+                collapsed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Collapsed {collapsed} history rows into {len(recipe_ids)} shared recipes'
+        ))
@@ -0,0 +1,127 @@
+import json
+import statistics
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from Chef.utils.llm_json import parse_json, validate_recipe_data
+from Chef.utils.recipe_prompt import PROMPT_TEMPLATES, build_recipe_prompt, estimate_tokens, output_token_cap
+
+SAMPLE_INGREDIENTS = ['egg', 'onion', 'tomato', 'garlic', 'rice', 'chicken', 'spinach', 'lemon',
+                      'butter', 'potato', 'carrot', 'cheese', 'pepper', 'mushroom', 'basil']
+
+
+def parse_outcome(response_text):
+    """
+    How a recorded reply parses
+
+    Returns:
+        tuple: (parsed, truncated), truncated when the reply was cut off
+    """
+    try:
+        recipe_data, repairs = parse_json(response_text)
+        validate_recipe_data(recipe_data)
+    except ValueError:
+        return False, False
+    return True, 'truncated' in repairs
+
+
+def summarize(records):
+    """Token, latency and parse figures of the recorded calls of one template"""
+    latencies = [record['latency'] for record in records if record.get('latency') is not None]
+    parsed = truncated = hit_cap = 0
+    for record in records:
+        ok, cut_off = parse_outcome(record['response_text'])
+        parsed += ok
+        truncated += cut_off
+        cap = record.get('max_output_tokens')
+        hit_cap += bool(cap) and record['output_tokens'] >= cap
+    return {
+        'calls': len(records),
+        'input_tokens': statistics.mean(record['input_tokens'] for record in records),
+        'output_tokens': statistics.mean(record['output_tokens'] for record in records),
+        'latency_mean': statistics.mean(latencies) if latencies else None,
+        'latency_p95': statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else None,
+        'parse_rate': parsed / len(records),
+        'truncated': truncated,
+        'hit_cap': hit_cap,
+    }
+
+
+def summarize_requests(records):
+    """Attempts and parse failures per recipe request of one mode"""
+    attempts = sum(record['attempts'] for record in records)
+    return {
+        'requests': len(records),
+        'attempts_per_request': attempts / len(records),
+        'parse_failure_rate': sum(record['parse_failures'] for record in records) / attempts if attempts else 0.0,
+        'success_rate': sum(record['succeeded'] for record in records) / len(records),
+    }
+
+
+def mode_label(record):
+    """Template name, +schema for calls made with structured output"""
+    return record.get('template', 'unknown') + ('+schema' if record.get('structured') else '')
+
+
+class Command(BaseCommand):
+    help = 'Compare the recipe prompt templates and output modes on tokens, latency, parse success and attempts, offline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--responses',
+            help='JSON lines file of recorded calls (GEMINI_RECORD_RESPONSES_PATH). '
+                 'Without it only the prompt sizes are compared'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Prompt size per template (estimated tokens) and output cap')
+        counts = (3, 8, 15)
+        self.stdout.write(f'{"ingredients":<12}' + ''.join(f'{name:>12}' for name in PROMPT_TEMPLATES) + f'{"cap":>8}')
+        for count in counts:
+            ingredients = SAMPLE_INGREDIENTS[:count]
+            self.stdout.write(
+                f'{count:<12}'
+                + ''.join(f'{estimate_tokens(build_recipe_prompt(ingredients, name)):>12}' for name in PROMPT_TEMPLATES)
+                + f'{output_token_cap(ingredients):>8}'
+            )
+
+        if options['responses']:
+            self._compare_recorded(options['responses'])
+
+    def _compare_recorded(self, path):
+        calls = defaultdict(list)
+        requests = defaultdict(list)
+        try:
+            with open(path, encoding='utf-8') as response_file:
+                for line in response_file:
+                    if line.strip():
+                        record = json.loads(line)
+                        recorded = requests if record.get('kind') == 'request' else calls
+                        recorded[mode_label(record)].append(record)
+        except (OSError, json.JSONDecodeError) as read_error:
+            raise CommandError(f'Could not read {path}: {read_error}')
+        if not calls and not requests:
+            raise CommandError(f'{path} has no recorded calls')
+
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"mode":<20}{"calls":>7}{"tokens in":>11}{"tokens out":>12}'
+            f'{"latency":>10}{"p95":>8}{"parsed":>8}{"truncated":>11}{"at cap":>8}'
+        )
+        for name, records in sorted(calls.items()):
+            summary = summarize(records)
+            latency = f'{summary["latency_mean"]:.2f}s' if summary['latency_mean'] is not None else '-'
+            p95 = f'{summary["latency_p95"]:.2f}s' if summary['latency_p95'] is not None else '-'
+            self.stdout.write(
+                f'{name:<20}{summary["calls"]:>7}{summary["input_tokens"]:>11.0f}{summary["output_tokens"]:>12.0f}'
+                f'{latency:>10}{p95:>8}{summary["parse_rate"]:>8.0%}{summary["truncated"]:>11}{summary["hit_cap"]:>8}'
+            )
+
+        if requests:
+            self.stdout.write('')
+            self.stdout.write(f'{"mode":<20}{"requests":>9}{"attempts/request":>18}{"parse failures":>16}{"succeeded":>11}')
+            for name, records in sorted(requests.items()):
+                summary = summarize_requests(records)
+                self.stdout.write(
+                    f'{name:<20}{summary["requests"]:>9}{summary["attempts_per_request"]:>18.2f}'
+                    f'{summary["parse_failure_rate"]:>16.1%}{summary["success_rate"]:>11.0%}'
+                )
@@ -0,0 +1,209 @@
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import combinations
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from Chef.main.get_recipe import generate_recipes
+from Chef.models import Recipe, RecipeHistory
+from Chef.utils.ai_get_recipe import FALLBACK_RECIPE_NAME
+from Chef.utils.deadline import Deadline
+from Chef.utils.ingredient_index import get_ingredient_index
+from Chef.utils.ingredients import canonical_ingredients, ingredients_fingerprint
+from Chef.utils.recipe_cache import get_recipe_cache
+
+# Near-variants are less likely to be asked for than the combination they come from
+VARIANT_DISCOUNT = 0.5
+
+
+def mine_combinations(ingredient_lists, sizes=(3, 4), min_support=2, max_ingredients=8, variants_per_combination=3):
+    """
+    Rank ingredient combinations worth pre-generating
+
+    Frequent combinations are the ingredient subsets shared by at least
+    min_support recipes. Near-variants swap one ingredient of a frequent
+    combination for one that often appears with all the others.
+
+    Args:
+        ingredient_lists (iterable): Canonical ingredient lists, e.g. Recipe.main_ingredients
+        max_ingredients (int): Only the first ingredients of long lists are combined
+
+    Returns:
+        list: (ingredients, score) tuples, best first, ingredients sorted
+    """
+    combination_counts = Counter()
+    pair_counts = Counter()
+    for ingredients in ingredient_lists:
+        ingredients = sorted(set(ingredients))[:max_ingredients]
+        pair_counts.update(combinations(ingredients, 2))
+        for size in sizes:
+            combination_counts.update(combinations(ingredients, size))
+
+    scores = {
+        combination: count
+        for combination, count in combination_counts.items()
+        if count >= min_support
+    }
+
+    companions = {}
+    for (first, second), count in pair_counts.items():
+        if count >= min_support:
+            companions.setdefault(first, set()).add(second)
+            companions.setdefault(second, set()).add(first)
+
+    for combination, count in sorted(scores.items(), key=lambda item: -item[1]):
+        added = 0
+        for kept in combinations(combination, len(combination) - 1):
+            shared = set.intersection(*(companions.get(ingredient, set()) for ingredient in kept)) - set(combination)
+            for ingredient in sorted(shared, key=lambda ingredient: -pair_counts[tuple(sorted((ingredient, kept[0])))]):
+                variant = tuple(sorted(kept + (ingredient,)))
+                if variant not in scores:
+                    scores[variant] = count * VARIANT_DISCOUNT
+                    added += 1
+                break
+            if added >= variants_per_combination:
+                break
+
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class PrewarmState:
+    """Fingerprints already handled by earlier runs, saved after every recipe so a stopped run can resume"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.failed = set()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as state_file:
+                    state = json.load(state_file)
+            except (OSError, ValueError) as state_error:
+                raise CommandError(f'Could not read the state file {path}: {state_error}')
+            self.done = set(state.get('done', []))
+            self.failed = set(state.get('failed', []))
+
+    def record(self, fingerprint, succeeded):
+        (self.done if succeeded else self.failed).add(fingerprint)
+        if succeeded:
+            self.failed.discard(fingerprint)
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Write and rename, so an interrupted write never loses the previous state
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as state_file:
+            json.dump({'done': sorted(self.done), 'failed': sorted(self.failed)}, state_file)
+        os.replace(temporary_path, self.path)
+
+
+class Command(BaseCommand):
+    help = 'Pre-generate recipes for popular ingredient combinations that are not cached yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=int, default=50, help='Most Gemini generations to spend')
+        parser.add_argument('--concurrency', type=int, default=2, help='Generations running at once')
+        parser.add_argument('--deadline', type=float, default=1800, help='Stop starting generations after this many seconds')
+        parser.add_argument('--sample', type=int, default=5000, help='Newest history rows to mine')
+        parser.add_argument('--min-support', type=int, default=2, help='Recipes a combination must appear in')
+        parser.add_argument('--state', default=os.path.join(settings.BASE_DIR, '.cache', 'prewarm_state.json'),
+                            help='Progress file for resuming, empty to disable')
+        parser.add_argument('--retry-failed', action='store_true', help='Try again combinations that failed in earlier runs')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the combinations that would be generated')
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        run_deadline = Deadline(options['deadline'])
+        state = PrewarmState(options['state'])
+
+        ingredient_lists = [
+            canonical_ingredients(main_ingredients or [])
+            for main_ingredients in RecipeHistory.objects.exclude(recipe__recipe_name=FALLBACK_RECIPE_NAME)
+            .order_by('-id').values_list('recipe__main_ingredients', flat=True)[:options['sample']]
+        ]
+        ranked = mine_combinations(ingredient_lists, min_support=options['min_support'])
+        candidates, skipped = self._uncached(ranked, state, options['retry_failed'])
+        candidates = candidates[:options['budget']]
+
+        self.stdout.write(
+            f'{len(ranked)} combinations mined from {len(ingredient_lists)} recipes, '
+            f'{skipped} already served or handled, {len(candidates)} to generate'
+        )
+        if options['dry_run']:
+            for ingredients, score in candidates:
+                self.stdout.write(f'{score:>8.1f}  {", ".join(ingredients)}')
+            return
+
+        added = failed = started = 0
+        pending = iter(candidates)
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            running = set()
+            while True:
+                # Keep the pool full until the candidates or the run deadline are exhausted
+                while len(running) < options['concurrency'] and run_deadline.allows_attempt():
+                    candidate = next(pending, None)
+                    if candidate is None:
+                        break
+                    running.add(executor.submit(self._generate, list(candidate[0]), run_deadline))
+                    started += 1
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    fingerprint, succeeded = future.result()
+                    state.record(fingerprint, succeeded)
+                    added += succeeded
+                    failed += not succeeded
+
+        stopped = f', stopped at the deadline with {len(candidates) - started} left' if started < len(candidates) else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {added} cache entries, {failed} failed, {added + failed} of {options["budget"]} '
+            f'generations used in {time.monotonic() - started_at:.0f}s{stopped}'
+        ))
+
+    def _uncached(self, ranked, state, retry_failed):
+        """Drop combinations a request would already be served from the cache, the database or a similar recipe"""
+        recipe_cache = get_recipe_cache()
+        index = get_ingredient_index()
+        in_history = Recipe.find_many_by_ingredients(ingredients for ingredients, _ in ranked)
+
+        candidates, skipped = [], 0
+        for ingredients, score in ranked:
+            fingerprint = ingredients_fingerprint(ingredients)
+            handled = fingerprint in state.done or (fingerprint in state.failed and not retry_failed)
+            served = (
+                fingerprint in in_history
+                or recipe_cache.get(fingerprint) is not None
+                or index.best_match(list(ingredients), settings.RECIPE_SIMILARITY_THRESHOLD)[0] is not None
+            )
+            if handled or served:
+                skipped += 1
+            else:
+                candidates.append((ingredients, score))
+        return candidates, skipped
+
+    def _generate(self, sorted_ingredients, run_deadline):
+        """Generate and store one combination, the recipe is cached by generate_recipes"""
+        fingerprint = ingredients_fingerprint(sorted_ingredients)
+        try:
+            deadline = Deadline(min(settings.RECIPE_GENERATE_DEADLINE, run_deadline.remaining()))
+            recipe_data, error_message = generate_recipes(sorted_ingredients, fingerprint, deadline)
+            if error_message:
+                print(f"Pre-warm failed for {', '.join(sorted_ingredients)}: {error_message}")
+                return fingerprint, False
+
+            # Stored without a history entry, no user was served it yet
+            Recipe.intern_many([
+                Recipe.from_recipe_dict(recipe, main_ingredients=sorted_ingredients)
+                for recipe in recipe_data['recipes']
+            ])
+            print(f"Pre-warmed {', '.join(sorted_ingredients)}")
+            return fingerprint, True
+        except Exception as prewarm_error:
+            print(f"Pre-warm failed for {', '.join(sorted_ingredients)}: {prewarm_error}")
+            return fingerprint, False
+        finally:
+            connection.close()
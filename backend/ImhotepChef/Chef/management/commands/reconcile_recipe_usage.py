@@ -0,0 +1,77 @@
+import datetime
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from Chef.models import MonthlyRecipeUsage, RecipeHistory, RecipeJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the monthly recipe usage counters from RecipeHistory, plus the recipes reserved by '
+        'unfinished jobs. Generations running while it runs may end up off by their reservation'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=2, help='Months to rebuild, counting back from the current one')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Counters written per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the counters that are off')
+
+    def handle(self, *args, **options):
+        if options['months'] < 1:
+            raise CommandError('--months must be at least 1')
+        first_month = MonthlyRecipeUsage.current_month()
+        for _ in range(options['months'] - 1):
+            first_month = (first_month - timedelta(days=1)).replace(day=1)
+        since = datetime.datetime.combine(first_month, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+        # Months in UTC, like MonthlyRecipeUsage.current_month
+        expected = {}
+        saved = (
+            RecipeHistory.objects.filter(created_at__gte=since)
+            .annotate(month=TruncMonth('created_at', tzinfo=datetime.timezone.utc))
+            .values_list('user_id', 'month')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for user_id, month, count in saved:
+            key = (user_id, month.date())
+            expected[key] = expected.get(key, 0) + count
+        reserved = (
+            RecipeJob.objects.filter(usage_month__gte=first_month)
+            .values_list('user_id', 'usage_month')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for user_id, month, count in reserved:
+            expected[(user_id, month)] = expected.get((user_id, month), 0) + count
+
+        current = {
+            (user_id, month): count
+            for user_id, month, count in MonthlyRecipeUsage.objects.filter(month__gte=first_month)
+            .values_list('user_id', 'month', 'recipe_count')
+        }
+
+        drifted = []
+        for key in sorted(set(expected) | set(current)):
+            if expected.get(key, 0) != current.get(key, 0):
+                drifted.append(MonthlyRecipeUsage(user_id=key[0], month=key[1], recipe_count=expected.get(key, 0)))
+                if options['dry_run'] or options['verbosity'] > 1:
+                    self.stdout.write(
+                        f'User {key[0]} {key[1]:%Y-%m}: counter {current.get(key, 0)}, history {expected.get(key, 0)}'
+                    )
+
+        if not options['dry_run']:
+            MonthlyRecipeUsage.objects.bulk_create(
+                drifted,
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['user', 'month'],
+                update_fields=['recipe_count'],
+            )
+
+        action = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {len(set(expected) | set(current))} counters since {first_month:%Y-%m}, '
+            f'{action} {len(drifted)}'
+        ))
@@ -0,0 +1,78 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from Chef.models import RecipeHistory
+from Chef.utils.ingredient_index import IngredientIndex
+from Chef.utils.ingredients import canonical_ingredients, ingredients_fingerprint
+
+
+class Command(BaseCommand):
+    help = 'Replay a generate workload and report the share of Gemini calls avoided by similar recipe reuse'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            help='JSON lines file, one ingredient list per line. Defaults to replaying RecipeHistory in creation order'
+        )
+        parser.add_argument('--threshold', type=float, default=settings.RECIPE_SIMILARITY_THRESHOLD)
+        parser.add_argument('--limit', type=int, default=None, help='Replay at most this many requests')
+
+    def handle(self, *args, **options):
+        threshold = options['threshold']
+        exact_only_seen = set()
+        seen = set()
+        index = IngredientIndex()
+        total = exact_only_calls = exact_hits = similar_hits = llm_calls = 0
+
+        for ingredients in self._workload(options['file'], options['limit']):
+            ingredients = canonical_ingredients(ingredients or [])
+            if not ingredients:
+                continue
+            fingerprint = ingredients_fingerprint(ingredients)
+            total += 1
+
+            # Baseline: only exact ingredient-set matches are reused
+            if fingerprint not in exact_only_seen:
+                exact_only_calls += 1
+                exact_only_seen.add(fingerprint)
+
+            if fingerprint in seen:
+                exact_hits += 1
+                continue
+            seen.add(fingerprint)
+
+            recipe_id, _ = index.best_match(ingredients, threshold)
+            if recipe_id is not None:
+                similar_hits += 1
+            else:
+                llm_calls += 1
+                index.add(total, ingredients, fingerprint)
+
+        if not total:
+            raise CommandError('The workload is empty')
+
+        avoided = exact_only_calls - llm_calls
+        share = avoided / exact_only_calls if exact_only_calls else 0.0
+        self.stdout.write(f'Requests replayed:            {total}')
+        self.stdout.write(f'Exact cache hits:             {exact_hits}')
+        self.stdout.write(f'Similar recipe hits:          {similar_hits} (threshold {threshold})')
+        self.stdout.write(f'Gemini calls, exact only:     {exact_only_calls}')
+        self.stdout.write(f'Gemini calls, with index:     {llm_calls}')
+        self.stdout.write(self.style.SUCCESS(f'Gemini calls avoided:         {avoided} ({share:.1%})'))
+
+    def _workload(self, path, limit):
+        count = 0
+        if path:
+            with open(path) as workload_file:
+                for line in workload_file:
+                    if limit is not None and count >= limit:
+                        return
+                    if line.strip():
+                        count += 1
+                        yield json.loads(line)
+            return
+
+        rows = RecipeHistory.objects.order_by('created_at').values_list('recipe__main_ingredients', flat=True)
+        if limit is not None:
+            rows = rows[:limit]
+        yield from rows.iterator(chunk_size=2000)
@@ -0,0 +1,78 @@
+import os
+import signal
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from Chef.main.recipe_jobs import process_recipe_job
+from Chef.models import RecipeJob
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker threads that process queued recipe jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.RECIPE_WORKER_THREADS)
+        parser.add_argument('--poll-interval', type=float, default=settings.RECIPE_WORKER_POLL_INTERVAL,
+                            help='Seconds to wait before polling an empty queue again')
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='Seconds between queue depth reports, 0 to disable')
+        parser.add_argument('--once', action='store_true', help='Process the jobs that are due, then exit')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self._stop)
+
+        name = f'{socket.gethostname()}:{os.getpid()}'
+        threads = [
+            threading.Thread(target=self._work, args=(f'{name}:{index}', options), daemon=True)
+            for index in range(options['threads'])
+        ]
+        self.stdout.write(f'Recipe worker {name} started with {len(threads)} threads')
+        self._report_stats()
+        for thread in threads:
+            thread.start()
+
+        last_report = time.monotonic()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+            if options['stats_interval'] and time.monotonic() - last_report >= options['stats_interval']:
+                self._report_stats()
+                last_report = time.monotonic()
+        self.stdout.write(f'Recipe worker {name} stopped')
+
+    def _stop(self, signum, frame):
+        # Running jobs finish first, their lease covers the job deadline
+        self.stdout.write('Stopping after the running jobs')
+        self.stopping.set()
+
+    def _work(self, worker_id, options):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    jobs = RecipeJob.claim(worker_id, settings.RECIPE_JOB_LEASE)
+                except Exception as claim_error:
+                    # e.g. the database restarting, keep the thread alive and poll again
+                    print(f"Recipe worker {worker_id} could not claim jobs: {claim_error}")
+                    if options['once']:
+                        return
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+                if not jobs:
+                    if options['once']:
+                        return
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+                for job in jobs:
+                    process_recipe_job(job)
+        finally:
+            connection.close()
+
+    def _report_stats(self):
+        stats = RecipeJob.queue_stats()
+        self.stdout.write('Recipe queue: ' + ', '.join(f'{name} {value}' for name, value in stats.items()))
@@ -0,0 +1,47 @@
+import time
+from django.db import connection
+from .utils.metrics import DB_QUERIES_PER_REQUEST, DB_QUERY_TIME_PER_REQUEST, HTTP_REQUEST_DURATION
+
+
+class QueryTimer:
+    """Database execute wrapper counting the queries of one request and the time they take"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started_at
+
+
+class MetricsMiddleware:
+    """
+    Record the latency and SQL queries of every request, per view
+
+    Views are labelled with their URL name, so the metrics don't grow with
+    ids in the path. Queries are counted on the request's thread, the ORM
+    calls of async views run in worker threads and are not counted, and
+    the time of a streamed response only covers building its first part.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryTimer()
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started_at
+
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else 'unmatched'
+        HTTP_REQUEST_DURATION.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        DB_QUERIES_PER_REQUEST.observe(queries.count, view=view)
+        DB_QUERY_TIME_PER_REQUEST.observe(queries.duration, view=view)
+        return response
@@ -1,8 +1,13 @@
-from django.db import models
+import hashlib
+import json
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from datetime import timedelta
+from .utils.ingredients import ingredients_fingerprint
+from .utils.ingredient_index import index_recipe
 
 class User(AbstractUser):
     """
@@ -12,10 +17,12 @@ class User(AbstractUser):
     email_verify = models.BooleanField(default=False, verbose_name="Email Verified")
     
     def get_recipes_last_month_count(self):
-        """Calculate the number of recipes created by this user in the current calendar month"""
-        now = timezone.now()
-        current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        return self.user_recipe_history.filter(created_at__gte=current_month_start).count()
+        """Get the number of recipes saved to this user's history in the current calendar month"""
+        return MonthlyRecipeUsage.count_for(self)
+    
+    async def aget_recipes_last_month_count(self):
+        """Async version of get_recipes_last_month_count"""
+        return await MonthlyRecipeUsage.acount_for(self)
     
     def __str__(self):
         return f"{self.username} ({self.email})"
@@ -24,15 +31,26 @@ class User(AbstractUser):
         verbose_name = "User"
         verbose_name_plural = "Users"
 
-class RecipeHistory(models.Model):
+class Recipe(models.Model):
+    """
+    A recipe body, stored once per ingredient set and content
+
+    Rows are content-addressed by the ingredient fingerprint and a hash of
+    the recipe fields, so a recipe served to many users, or generated again
+    word for word, is kept once. Users reach it through RecipeHistory.
+    """
 
     RECIPE_DIFFICULTY_CHOICES = (
         ('Easy', 'Easy'),
         ('Medium', 'Medium'),
         ('Hard', 'Hard')
     )
+    # Fields of the recipe body, hashed into content_hash
+    CONTENT_FIELDS = (
+        'recipe_name', 'recipe_description', 'recipe_difficulty', 'prep_time', 'cook_time', 'total_time',
+        'servings', 'main_ingredients', 'additional_ingredients', 'instructions', 'tips', 'nutrition',
+    )
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_recipe_history')
     recipe_name = models.CharField(max_length=200)
     recipe_description = models.TextField()
     recipe_difficulty = models.CharField(max_length=6, choices=RECIPE_DIFFICULTY_CHOICES)
@@ -45,12 +63,500 @@ class RecipeHistory(models.Model):
     instructions = models.JSONField(default=list)
     tips = models.JSONField(default=list)
     nutrition = models.JSONField(default=dict)
+    ingredients_fingerprint = models.CharField(max_length=64, editable=False)
+    content_hash = models.CharField(max_length=64, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    
+
+    def set_keys(self):
+        """Compute the ingredient fingerprint, and the content hash of a recipe that has none yet"""
+        self.ingredients_fingerprint = ingredients_fingerprint(self.main_ingredients or [])
+        if not self.content_hash:
+            content = json.dumps(
+                {field: getattr(self, field) for field in self.CONTENT_FIELDS},
+                sort_keys=True,
+                separators=(',', ':'),
+                ensure_ascii=False
+            )
+            self.content_hash = hashlib.sha256(content.encode()).hexdigest()
+        return self.ingredients_fingerprint, self.content_hash
+
+    def save(self, *args, **kwargs):
+        """Keep the keys and the ingredient index in sync with the content"""
+        self.set_keys()
+        super().save(*args, **kwargs)
+        index_recipe(self)
+
+    @classmethod
+    def intern(cls, recipe):
+        """Get the stored copy of an unsaved recipe, saving it if it is new"""
+        return cls.intern_many([recipe])[0]
+
+    @classmethod
+    def intern_many(cls, recipes):
+        """
+        Get the stored copy of each unsaved recipe, the new ones are saved with one bulk_create
+
+        Returns:
+            list: Saved recipes, in the order of recipes
+        """
+        keys = [recipe.set_keys() for recipe in recipes]
+
+        def stored():
+            rows = cls.objects.filter(
+                ingredients_fingerprint__in={fingerprint for fingerprint, _ in keys},
+                content_hash__in={content_hash for _, content_hash in keys}
+            )
+            return {(row.ingredients_fingerprint, row.content_hash): row for row in rows}
+
+        existing = stored()
+        new_recipes = {}
+        for key, recipe in zip(keys, recipes):
+            if key not in existing:
+                new_recipes.setdefault(key, recipe)
+        if new_recipes:
+            # Concurrent requests may store the same recipe, the unique constraint keeps one
+            cls.objects.bulk_create(new_recipes.values(), ignore_conflicts=True)
+            existing = stored()
+            for key in new_recipes:
+                index_recipe(existing[key])
+        return [existing[key] for key in keys]
+
+    @classmethod
+    def servable(cls):
+        """Recipes worth serving again, without the fallback recipe served when generation failed"""
+        from .utils.ai_get_recipe import FALLBACK_RECIPE_NAME
+
+        return cls.objects.exclude(recipe_name=FALLBACK_RECIPE_NAME)
+
+    @classmethod
+    def find_by_ingredients(cls, ingredients):
+        """Get the newest recipe generated for this ingredient set, or None"""
+        return cls.servable().filter(
+            ingredients_fingerprint=ingredients_fingerprint(ingredients)
+        ).order_by('-created_at').first()
+
+    @classmethod
+    async def afind_by_ingredients(cls, ingredients):
+        """Async version of find_by_ingredients"""
+        return await cls.servable().filter(
+            ingredients_fingerprint=ingredients_fingerprint(ingredients)
+        ).order_by('-created_at').afirst()
+
+    @classmethod
+    def find_many_by_ingredients(cls, ingredient_sets):
+        """
+        Get the newest recipe for each of several ingredient sets, in one query
+
+        Returns:
+            dict: Fingerprint to recipe, for the sets that have one
+        """
+        fingerprints = {ingredients_fingerprint(ingredients) for ingredients in ingredient_sets}
+        # Newest row per fingerprint as a subquery, ids grow with created_at
+        newest_ids = (
+            cls.servable().filter(ingredients_fingerprint__in=fingerprints)
+            .values('ingredients_fingerprint')
+            .annotate(newest_id=models.Max('id'))
+            .values('newest_id')
+        )
+        return {recipe.ingredients_fingerprint: recipe for recipe in cls.objects.filter(id__in=newest_ids)}
+
+    @classmethod
+    def variant_pool(cls, ingredients, limit):
+        """
+        Get the different recipes stored for an ingredient set, newest first
+
+        Returns:
+            list: Up to limit recipes, one per recipe name
+        """
+        # Newest row per recipe name as a subquery, ids grow with created_at
+        newest_ids = (
+            cls.servable().filter(ingredients_fingerprint=ingredients_fingerprint(ingredients))
+            .values('recipe_name')
+            .annotate(newest_id=models.Max('id'))
+            .values('newest_id')
+        )
+        return list(cls.objects.filter(id__in=newest_ids).order_by('-id')[:limit])
+
+    @classmethod
+    def from_recipe_dict(cls, recipe, main_ingredients=None):
+        """Build an unsaved recipe from the API/AI recipe format"""
+        return cls(
+            recipe_name=recipe.get('name', 'Untitled Recipe'),
+            recipe_description=recipe.get('description', ''),
+            recipe_difficulty=recipe.get('difficulty', 'Easy'),
+            prep_time=recipe.get('prep_time', ''),
+            cook_time=recipe.get('cook_time', ''),
+            total_time=recipe.get('total_time', ''),
+            servings=recipe.get('servings', 1),
+            main_ingredients=recipe.get('main_ingredients', main_ingredients or []),
+            additional_ingredients=recipe.get('additional_ingredients', []),
+            instructions=recipe.get('instructions', []),
+            tips=recipe.get('tips', []),
+            nutrition=recipe.get('nutrition', {})
+        )
+
+    def to_recipe_dict(self):
+        """Convert the stored recipe back to the format returned by the recipe API"""
+        return {
+            'name': self.recipe_name,
+            'description': self.recipe_description,
+            'difficulty': self.recipe_difficulty,
+            'prep_time': self.prep_time,
+            'cook_time': self.cook_time,
+            'total_time': self.total_time,
+            'servings': self.servings,
+            'main_ingredients': self.main_ingredients,
+            'additional_ingredients': self.additional_ingredients,
+            'instructions': self.instructions,
+            'tips': self.tips,
+            'nutrition': self.nutrition
+        }
+
     def __str__(self):
-        return f"{self.recipe_name} - {self.user.username}"
-    
+        return self.recipe_name
+
+    class Meta:
+        verbose_name = "Recipe"
+        verbose_name_plural = "Recipes"
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['ingredients_fingerprint', 'content_hash'], name='recipe_content_unique'),
+        ]
+        indexes = [
+            # Newest recipe per ingredient set in a single index probe
+            models.Index(fields=['ingredients_fingerprint', '-created_at'], name='recipe_content_fp_idx'),
+        ]
+
+class RecipeHistory(models.Model):
+    """
+    A recipe served to a user, the body is shared with every other user it was served to
+
+    Rows saved before recipes were shared hold their own copy of the body in
+    the legacy columns, until collapse_recipe_history moves it to Recipe.
+    """
+
+    RECIPE_DIFFICULTY_CHOICES = Recipe.RECIPE_DIFFICULTY_CHOICES
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_recipe_history')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, null=True, blank=True, related_name='history_entries')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Legacy copy of the recipe body, empty once the row is collapsed. Kept until every
+    # database has run collapse_recipe_history, then dropped
+    recipe_name = models.CharField(max_length=200, blank=True, default='')
+    recipe_description = models.TextField(blank=True, default='')
+    recipe_difficulty = models.CharField(max_length=6, choices=RECIPE_DIFFICULTY_CHOICES, blank=True, default='')
+    prep_time = models.CharField(max_length=50, blank=True, default='')
+    cook_time = models.CharField(max_length=50, blank=True, default='')
+    total_time = models.CharField(max_length=50, blank=True, default='')
+    servings = models.IntegerField(null=True, blank=True)
+    main_ingredients = models.JSONField(default=list, blank=True)
+    additional_ingredients = models.JSONField(default=list, blank=True)
+    instructions = models.JSONField(default=list, blank=True)
+    tips = models.JSONField(default=list, blank=True)
+    nutrition = models.JSONField(default=dict, blank=True)
+    ingredients_fingerprint = models.CharField(max_length=64, blank=True, default='', editable=False)
+
+    def save(self, *args, **kwargs):
+        """Store a new recipe body once, shared by every user it is served to"""
+        if self.recipe is not None and self.recipe.pk is None:
+            self.recipe = Recipe.intern(self.recipe)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bulk_save(cls, entries):
+        """bulk_create that stores the new recipe bodies like save(), with one bulk_create for them"""
+        unsaved = [entry for entry in entries if entry.recipe is not None and entry.recipe.pk is None]
+        for entry, recipe in zip(unsaved, Recipe.intern_many([entry.recipe for entry in unsaved])):
+            entry.recipe = recipe
+        return cls.objects.bulk_create(entries)
+
+    @classmethod
+    def from_recipe_dict(cls, recipe, user=None, main_ingredients=None):
+        """Build an unsaved history entry with an unsaved recipe, from the API/AI recipe format"""
+        return cls(user=user, recipe=Recipe.from_recipe_dict(recipe, main_ingredients))
+
+    def get_recipe(self):
+        """The recipe body, read from the legacy columns while the row is not collapsed"""
+        if self.recipe is not None:
+            return self.recipe
+        return Recipe(**{field: getattr(self, field) for field in Recipe.CONTENT_FIELDS})
+
+    def to_recipe_dict(self):
+        """Convert the served recipe to the format returned by the recipe API"""
+        return self.get_recipe().to_recipe_dict()
+
+    def __str__(self):
+        return f"{self.get_recipe().recipe_name} - {self.user.username}"
+
     class Meta:
         verbose_name = "Recipe History"
         verbose_name_plural = "Recipe Histories"
         ordering = ['-created_at']
+
+class MonthlyRecipeUsage(models.Model):
+    """
+    Recipes saved to a user's history per calendar month (UTC), read for the monthly limit
+
+    Views that save recipes for a user keep it in step with RecipeHistory,
+    the reconcile_recipe_usage command rebuilds it from there. A generation
+    reserves its recipes before Gemini is called, in one conditional
+    UPDATE, so concurrent requests can't go over the limit, and settles the
+    reservation with the recipes actually saved.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_recipe_usage')
+    month = models.DateField()
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def current_month():
+        """First day of the current month"""
+        return timezone.now().date().replace(day=1)
+
+    @classmethod
+    def count_for(cls, user, month=None):
+        return cls.objects.filter(
+            user=user,
+            month=month or cls.current_month()
+        ).values_list('recipe_count', flat=True).first() or 0
+
+    @classmethod
+    async def acount_for(cls, user, month=None):
+        """Async version of count_for"""
+        return await cls.objects.filter(
+            user=user,
+            month=month or cls.current_month()
+        ).values_list('recipe_count', flat=True).afirst() or 0
+
+    @classmethod
+    def add(cls, user, amount, month=None, limit=None):
+        """
+        Atomically add to a user's count
+
+        Args:
+            amount (int): Negative to give recipes back, the count stops at 0
+            limit (int): Optional, nothing is added when the count would go over it
+
+        Returns:
+            bool: Whether the amount was added
+        """
+        month = month or cls.current_month()
+
+        def update():
+            usage = cls.objects.filter(user=user, month=month)
+            if limit is not None:
+                usage = usage.filter(recipe_count__lte=limit - amount)
+            return usage.update(recipe_count=Greatest(models.F('recipe_count') + amount, 0)) == 1
+
+        if amount == 0 or update():
+            return True
+        if amount < 0 or (limit is not None and amount > limit):
+            return False
+        # First recipe of the month, the unique constraint lets only one of concurrent creates through
+        cls.objects.bulk_create([cls(user=user, month=month)], ignore_conflicts=True)
+        return update()
+
+    @classmethod
+    def reserve(cls, user, amount=1, limit=None):
+        """
+        Reserve recipes of the monthly limit before generating them
+
+        Returns:
+            UsageReservation or None: None when the limit would be exceeded
+        """
+        month = cls.current_month()
+        if not cls.add(user, amount, month, limit):
+            return None
+        return UsageReservation(user, month, amount)
+
+    @classmethod
+    def record(cls, user, saved, reservation=None):
+        """Count recipes saved to a user's history, in place of what was reserved for them"""
+        if reservation is not None:
+            reservation.settle(saved)
+        elif saved:
+            cls.add(user, saved)
+
+    def __str__(self):
+        return f"{self.user.username} {self.month:%Y-%m}: {self.recipe_count}"
+
+    class Meta:
+        verbose_name = "Monthly Recipe Usage"
+        verbose_name_plural = "Monthly Recipe Usage"
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='monthly_recipe_usage_unique'),
+        ]
+
+class UsageReservation:
+    """Recipes reserved by MonthlyRecipeUsage.reserve, settled once with the recipes actually saved"""
+
+    def __init__(self, user, month, amount):
+        self.user = user
+        self.month = month
+        self.amount = amount
+        self.settled = False
+
+    def settle(self, saved):
+        if self.settled:
+            return
+        self.settled = True
+        MonthlyRecipeUsage.add(self.user, saved - self.amount, self.month)
+
+    def release(self):
+        """Give the reserved recipes back, e.g. when the request failed"""
+        self.settle(0)
+
+class RecipeJob(models.Model):
+    """
+    A queued recipe generation, run by the run_recipe_worker command
+
+    Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, so each job
+    is handed to one worker without blocking the others. A claimed job is
+    leased until locked_until; when a worker dies, the lease expires and
+    the job is claimed again.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recipe_jobs')
+    ingredients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    # Month of the recipe reserved when the job was queued, until the job settles it
+    usage_month = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def claim(cls, worker_id, lease, limit=1):
+        """
+        Lease up to limit runnable jobs to a worker
+
+        Runnable jobs are queued ones that are due, and running ones whose
+        lease expired. An expired job with no attempts left is failed
+        instead.
+
+        Args:
+            worker_id (str): Name of the claiming worker
+            lease (float): Seconds the worker has to finish a job
+
+        Returns:
+            list: The claimed jobs
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(
+                    models.Q(status=cls.QUEUED, run_after__lte=now)
+                    | models.Q(status=cls.RUNNING, locked_until__lt=now)
+                )
+                .order_by('run_after', 'id')[:limit]
+            )
+            claimed = []
+            for job in jobs:
+                if job.attempts >= job.max_attempts:
+                    job.finish(cls.FAILED, error='The worker running this job stopped responding')
+                    continue
+                job.status = cls.RUNNING
+                job.attempts += 1
+                job.locked_until = now + timedelta(seconds=lease)
+                job.locked_by = worker_id
+                job.save(update_fields=['status', 'attempts', 'locked_until', 'locked_by'])
+                claimed.append(job)
+        return claimed
+
+    def usage_reservation(self):
+        """The recipe reserved when the job was queued, None once it is settled"""
+        if self.usage_month is None:
+            return None
+        return UsageReservation(self.user, self.usage_month, 1)
+
+    def finish(self, status, result=None, error=''):
+        """Store the outcome of the job and release its lease, and its reserved recipe when it failed"""
+        if status == self.FAILED and self.usage_month is not None:
+            self.usage_reservation().release()
+        self.status = status
+        self.result = result
+        self.error = error
+        self.locked_until = None
+        self.usage_month = None
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'result', 'error', 'locked_until', 'usage_month', 'finished_at'])
+
+    def retry_later(self, error, delay):
+        """
+        Put the job back in the queue after delay seconds, doubled for every attempt
+
+        Returns:
+            bool: False when the job has no attempts left and was failed instead
+        """
+        if self.attempts >= self.max_attempts:
+            self.finish(self.FAILED, error=error)
+            return False
+        self.status = self.QUEUED
+        self.error = error
+        self.locked_until = None
+        self.run_after = timezone.now() + timedelta(seconds=delay * 2 ** (self.attempts - 1))
+        self.save(update_fields=['status', 'error', 'locked_until', 'run_after'])
+        return True
+
+    @classmethod
+    def queue_stats(cls):
+        """Queue depth metrics: jobs per status, due and delayed jobs, expired leases, oldest due job age"""
+        now = timezone.now()
+        counts = dict(cls.objects.values_list('status').annotate(count=models.Count('id')).order_by())
+        oldest_due = cls.objects.filter(status=cls.QUEUED, run_after__lte=now).aggregate(
+            oldest=models.Min('run_after')
+        )['oldest']
+        return {
+            'queued': counts.get(cls.QUEUED, 0),
+            'due': cls.objects.filter(status=cls.QUEUED, run_after__lte=now).count(),
+            'running': counts.get(cls.RUNNING, 0),
+            'expired_leases': cls.objects.filter(status=cls.RUNNING, locked_until__lt=now).count(),
+            'succeeded': counts.get(cls.SUCCEEDED, 0),
+            'failed': counts.get(cls.FAILED, 0),
+            'oldest_due_age': round((now - oldest_due).total_seconds(), 1) if oldest_due else 0.0,
+        }
+
+    def to_status_dict(self):
+        """The job as returned by the job status endpoint"""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'ingredients': self.ingredients,
+            'result': self.result,
+            'error': self.error or None,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __str__(self):
+        return f"Recipe job {self.id} ({self.status}) - {self.user.username}"
+
+    class Meta:
+        verbose_name = "Recipe Job"
+        verbose_name_plural = "Recipe Jobs"
+        ordering = ['-created_at']
+        indexes = [
+            # The claim query: due jobs in run_after order
+            models.Index(fields=['status', 'run_after'], name='recipe_job_claim_idx'),
+        ]
@@ -1,3 +1,1607 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+import google.generativeai as genai
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import MonthlyRecipeUsage, Recipe, User, RecipeHistory, RecipeJob
+from .main.get_recipe_batch import resolve_cached_recipes
+from .main.recipe_jobs import process_recipe_job
+from .management.commands.bench_recipe_parser import build_reply_corpus
+from .management.commands.prewarm_recipe_cache import mine_combinations
+from .utils import ingredient_index
+from .utils import ai_get_recipe, llm_backend
+from .utils.ai_get_recipe import (
+    DEADLINE_EXCEEDED_MESSAGE,
+    FALLBACK_RECIPE_NAME,
+    get_recipe_from_gemini,
+    split_batch_response,
+    stream_recipe_from_gemini,
+)
+from .utils.config import Gemini_Config
+from .utils.deadline import Deadline
+from .utils.fake_llm import FakeBackend
+from .utils.hedging import HedgePolicy, HedgePool, hedged_call
+from .utils.ingredient_index import IngredientIndex, get_ingredient_index
+from .utils.key_pool import KeyPool
+from .utils.metrics import REGISTRY, MetricsRegistry, record_key_metrics
+from .utils.micro_batch import MicroBatcher
+from .utils.llm_json import IncrementalJSONParser, RecipeSchemaError, parse_json, recipe_response_schema, validate_recipe_data
+from .utils.ingredients import canonical_ingredient, canonical_ingredients, ingredients_fingerprint
+from .utils.recipe_prompt import build_batch_recipe_prompt, build_recipe_prompt, estimate_tokens, output_token_cap, token_usage
+from .utils.recipe_cache import LRUCache, RecipeCache, get_recipe_cache
+from .utils.single_flight import SingleFlight, cache_add_is_atomic
 
-# Create your tests here.
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'recipes': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-recipes'},
+}
+
+
+def make_recipe_data(name='Tomato Omelette'):
+    return {
+        'recipes': [{
+            'name': name,
+            'description': 'Eggs with tomato and onion',
+            'difficulty': 'Easy',
+            'prep_time': '5 minutes',
+            'cook_time': '10 minutes',
+            'total_time': '15 minutes',
+            'servings': 2,
+            'main_ingredients': ['egg', 'onion', 'tomato'],
+            'additional_ingredients': [],
+            'instructions': ['Whisk the eggs', 'Cook everything together'],
+            'tips': [],
+            'nutrition': {'calories': 250},
+        }],
+        'success': True,
+        'message': 'Recipe generated successfully'
+    }
+
+
+class StubGemini:
+    """Stands in for get_recipe_from_gemini, counting upstream calls"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, ingredients, deadline=None, variants=1):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return make_recipe_data(), None
+
+
+class StreamingModel:
+    """Stands in for a Gemini model, streaming a recipe reply in small chunks"""
+
+    def __init__(self, chunk_size=40):
+        self.chunk_size = chunk_size
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        text = json.dumps(make_recipe_data())
+        return [
+            mock.Mock(text=text[start:start + self.chunk_size])
+            for start in range(0, len(text), self.chunk_size)
+        ]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expires_entries_after_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(max_size=10, ttl=5, clock=clock)
+        cache.set('a', 1)
+        clock.now = 6
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(cache.misses, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecipeCacheTests(TestCase):
+    def setUp(self):
+        self.cache = RecipeCache(local_size=10, local_ttl=60, shared_ttl=60, alias='recipes')
+        self.cache.shared.clear()
+
+    def test_read_through_loads_once(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {'name': 'Omelette'}
+
+        self.assertEqual(self.cache.get_or_load('fp', loader), {'name': 'Omelette'})
+        self.assertEqual(self.cache.get_or_load('fp', loader), {'name': 'Omelette'})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.stats()['local_hits'], 1)
+
+    def test_shared_tier_fills_local_tier(self):
+        other_process = RecipeCache(local_size=10, local_ttl=60, shared_ttl=60, alias='recipes')
+        other_process.set('fp', {'name': 'Omelette'})
+
+        self.assertEqual(self.cache.get('fp'), {'name': 'Omelette'})
+        self.assertEqual(self.cache.shared_hits, 1)
+        self.assertEqual(len(self.cache.local), 1)
+
+    def test_misses_are_not_cached(self):
+        self.assertIsNone(self.cache.get_or_load('fp', lambda: None))
+        self.assertIsNone(self.cache.get_or_load('fp', lambda: None))
+        self.assertEqual(self.cache.loads, 2)
+
+
+class IngredientCanonicalizationTests(TestCase):
+    def test_folds_plurals_synonyms_and_quantities(self):
+        cases = {
+            'tomatoes': 'tomato',
+            'Tomato ': 'tomato',
+            '2 Roma Tomatoes': 'tomato',
+            'eggs': 'egg',
+            'a pinch of salt': 'salt',
+            '1 1/2 cups all-purpose flour': 'flour',
+            'Scallions': 'green onion',
+            'berries': 'berry',
+            'asparagus': 'asparagus',
+            'apple': 'apple',
+        }
+        for name, expected in cases.items():
+            self.assertEqual(canonical_ingredient(name), expected, name)
+
+    def test_words_the_suffix_rules_would_change_keep_their_meaning(self):
+        cases = {
+            'pies': 'pie',
+            'apple pies': 'apple pie',
+            'fries': 'fries',
+            'french fries': 'french fries',
+            'cookies': 'cookie',
+            'quiches': 'quiche',
+            'sloes': 'sloe',
+            'tapas': 'tapas',
+            'cherries': 'cherry',
+            'peaches': 'peach',
+            'potatoes': 'potato',
+        }
+        for name, expected in cases.items():
+            self.assertEqual(canonical_ingredient(name), expected, name)
+        self.assertNotEqual(ingredients_fingerprint(['pies', 'egg', 'milk']), ingredients_fingerprint(['py', 'egg', 'milk']))
+
+    def test_is_idempotent(self):
+        canonical = canonical_ingredients(['Roma tomatoes', 'eggs', 'spring onions', 'garbanzo beans', 'EVOO'])
+        self.assertEqual(canonical_ingredients(canonical), canonical)
+        self.assertEqual(canonical, ['chickpea', 'egg', 'green onion', 'olive oil', 'tomato'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CanonicalizeRecipeIngredientsTests(TestCase):
+    def test_rekeys_and_merges_recipes_that_become_identical(self):
+        user = User.objects.create(username='cook', email='cook@example.com')
+        # Saved before canonicalization: raw ingredients, keys computed from them
+        legacy = Recipe.from_recipe_dict(make_recipe_data()['recipes'][0], ['Tomatoes', 'eggs', 'onions'])
+        legacy.main_ingredients = ['Tomatoes', 'eggs', 'onions']
+        legacy.set_keys()
+        Recipe.objects.bulk_create([legacy])
+        legacy = Recipe.objects.get()
+        current = Recipe.intern(Recipe.from_recipe_dict(make_recipe_data()['recipes'][0]))
+        entry = RecipeHistory.objects.create(user=user, recipe=current)
+        get_recipe_cache().set(current.ingredients_fingerprint, current.to_recipe_dict())
+
+        output = io.StringIO()
+        call_command('canonicalize_recipe_ingredients', stdout=output)
+
+        self.assertIn('Updated 1 and merged 1 of 2 recipes', output.getvalue())
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.id, legacy.id)
+        self.assertEqual(recipe.main_ingredients, ['egg', 'onion', 'tomato'])
+        self.assertEqual(RecipeHistory.objects.get(id=entry.id).recipe_id, legacy.id)
+        # The same content is found again instead of being stored twice
+        self.assertEqual(Recipe.intern(Recipe.from_recipe_dict(make_recipe_data()['recipes'][0])).id, legacy.id)
+        self.assertEqual(Recipe.objects.count(), 1)
+        self.assertIsNone(get_recipe_cache().get(current.ingredients_fingerprint))
+
+
+class RecipeFingerprintTests(TestCase):
+    def test_fingerprint_ignores_order_case_and_duplicates(self):
+        self.assertEqual(
+            ingredients_fingerprint(['Tomato ', 'egg', 'onion']),
+            ingredients_fingerprint(['onion', 'egg', 'tomato', 'egg'])
+        )
+
+    def test_find_by_ingredients_returns_newest(self):
+        for name in ('Old', 'New'):
+            Recipe.objects.create(
+                recipe_name=name, recipe_description='', recipe_difficulty='Easy',
+                prep_time='', cook_time='', total_time='', servings=1,
+                main_ingredients=['egg', 'onion', 'tomato']
+            )
+
+        with self.assertNumQueries(1):
+            recipe = Recipe.find_by_ingredients(['tomato', 'onion', 'egg'])
+        self.assertEqual(recipe.recipe_name, 'New')
+
+
+class IngredientIndexTests(TestCase):
+    def setUp(self):
+        self.index = IngredientIndex()
+        self.index.add(1, ['egg', 'onion', 'tomato'])
+        self.index.add(2, ['chicken', 'rice', 'garlic', 'salt'])
+
+    def test_superset_request_matches_above_threshold(self):
+        recipe_id, similarity = self.index.best_match(['egg', 'onion', 'tomato', 'salt'], 0.75)
+        self.assertEqual(recipe_id, 1)
+        self.assertEqual(similarity, 0.75)
+
+    def test_no_match_below_threshold(self):
+        self.assertEqual(self.index.best_match(['egg', 'rice', 'salt'], 0.5), (None, 0.0))
+
+    def test_newer_recipe_replaces_same_ingredient_set(self):
+        self.index.add(3, ['tomato', 'egg', 'onion'])
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.best_match(['egg', 'onion', 'tomato'], 1.0), (3, 1.0))
+
+    def test_prefix_filter_matches_brute_force(self):
+        pool = ['egg', 'onion', 'tomato', 'salt', 'rice', 'garlic', 'beef', 'basil', 'cheese', 'milk']
+        index = IngredientIndex()
+        sets = {}
+        for recipe_id in range(1, 200):
+            ingredients = [pool[(recipe_id * step) % len(pool)] for step in (1, 3, 7, 9)]
+            sets[recipe_id] = frozenset(ingredients)
+            index.add(recipe_id, ingredients)
+        query = ['egg', 'salt', 'rice', 'basil']
+        for threshold in (0.3, 0.5, 0.7, 1.0):
+            _, similarity = index.best_match(query, threshold)
+            expected = max(
+                len(frozenset(query) & ingredients) / len(frozenset(query) | ingredients)
+                for recipe_id, ingredients in sets.items()
+                if index._by_fingerprint.get(ingredients_fingerprint(ingredients)) == recipe_id
+            )
+            self.assertEqual(similarity, expected if expected >= threshold else 0.0)
+
+    def test_requests_use_stale_index_while_another_refreshes(self):
+        index = IngredientIndex()
+        with mock.patch('Chef.utils.ingredient_index._ingredient_index', index):
+            index._refresh_lock.acquire()
+            try:
+                with self.assertNumQueries(0):
+                    self.assertIs(get_ingredient_index(), index)
+                self.assertIsNone(index.refreshed_at)
+            finally:
+                index._refresh_lock.release()
+
+            get_ingredient_index()
+        self.assertIsNotNone(index.refreshed_at)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SingleFlightTests(TestCase):
+    def test_threads_share_one_call(self):
+        flight = SingleFlight(alias='recipes', timeout=5)
+        stub = StubGemini(latency=0.2)
+        results = []
+
+        def worker():
+            results.append(flight.do('fp', lambda: stub(['egg'])))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(stub.calls, 1)
+        self.assertEqual(len(results), 8)
+
+    def test_other_process_waits_for_published_result(self):
+        # Two groups sharing one cache behave like two worker processes
+        first = SingleFlight(alias='recipes', timeout=5, poll_interval=0.01)
+        second = SingleFlight(alias='recipes', timeout=5, poll_interval=0.01)
+        published = {}
+        calls = []
+        started = threading.Event()
+
+        def slow_generate():
+            started.set()
+            time.sleep(0.2)
+            calls.append('first')
+            published['fp'] = 'recipe'
+            return 'recipe'
+
+        thread = threading.Thread(target=lambda: first.do('fp', slow_generate))
+        thread.start()
+        started.wait()
+        result = second.do('fp', lambda: calls.append('second') or 'duplicate', peek=lambda: published.get('fp'))
+        thread.join()
+
+        self.assertEqual(result, 'recipe')
+        self.assertEqual(calls, ['first'])
+
+    def test_file_based_cache_is_not_used_as_a_lock(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            'default': LOCMEM_CACHES['default'],
+            'recipes': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            flight = SingleFlight(alias='recipes', timeout=5)
+            lock_key = SingleFlight.LOCK_PREFIX + 'fp'
+            self.assertFalse(cache_add_is_atomic(flight.shared))
+            self.assertEqual(flight.do('fp', lambda: flight.shared.get(lock_key, 'unlocked')), 'unlocked')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'advisory locks need PostgreSQL')
+class SingleFlightAdvisoryLockTests(TransactionTestCase):
+    def test_connections_in_other_processes_wait_for_the_lock(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            'default': LOCMEM_CACHES['default'],
+            'recipes': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            # Each thread has its own database connection, like a worker process
+            first = SingleFlight(alias='recipes', timeout=5, poll_interval=0.01)
+            second = SingleFlight(alias='recipes', timeout=5, poll_interval=0.01)
+            published = {}
+            calls = []
+            started = threading.Event()
+
+            def slow_generate():
+                started.set()
+                time.sleep(0.2)
+                calls.append('first')
+                published['fp'] = 'recipe'
+                return 'recipe'
+
+            def leader():
+                try:
+                    first.do('fp', slow_generate)
+                finally:
+                    connection.close()
+
+            thread = threading.Thread(target=leader)
+            thread.start()
+            started.wait()
+            result = second.do('fp', lambda: calls.append('second') or 'duplicate', peek=lambda: published.get('fp'))
+            thread.join()
+
+        self.assertEqual(result, 'recipe')
+        self.assertEqual(calls, ['first'])
+
+
+class KeyPoolTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = KeyPool(['first', 'second'], failure_threshold=2, cooldown=10, clock=self.clock)
+
+    def test_prefers_fast_healthy_key(self):
+        for _ in range(5):
+            self.pool.record_success('first', 3.0)
+            self.pool.record_success('second', 0.2)
+        picks = [next(self.pool.candidates()) for _ in range(200)]
+        self.assertGreater(picks.count('second'), 150)
+
+    def test_rate_limit_opens_circuit_until_cooldown(self):
+        self.pool.record_failure('first', 0.1, rate_limited=True)
+        self.assertEqual(list(self.pool.candidates()), ['second'])
+
+        self.clock.now = 11
+        self.pool.record_failure('second', 0.1)
+        self.pool.record_failure('second', 0.1)
+        # Both circuits are open, the first key's cooldown is over so one call may probe it
+        self.assertEqual(list(self.pool.candidates()), ['first'])
+        self.assertEqual(self.pool.snapshot()[0]['state'], 'half_open')
+        self.assertEqual(list(self.pool.candidates()), [])
+
+        self.pool.record_success('first', 0.5)
+        self.assertEqual(self.pool.snapshot()[0]['state'], 'closed')
+
+    def test_failed_probe_doubles_cooldown(self):
+        events = []
+        self.pool.add_listener(lambda event, snapshot: events.append((event, snapshot['key'])))
+        self.pool.record_failure('first', 0.1, rate_limited=True)
+        self.clock.now = 10
+        self.pool.record_failure('second', 0.1, rate_limited=True)
+        self.clock.now = 11
+        self.assertEqual(list(self.pool.candidates()), ['first'])
+        self.pool.record_failure('first', 0.1)
+
+        self.assertEqual(self.pool.snapshot()[0]['cooldown_remaining'], 20)
+        self.assertIn(('circuit_half_open', 'key-1'), events)
+        self.assertEqual(events[-1], ('circuit_open', 'key-1'))
+
+    def test_gemini_call_skips_open_key(self):
+        model = mock.Mock()
+        model.generate_content.return_value.text = json.dumps(make_recipe_data())
+        pool = KeyPool(['dead', 'alive'], failure_threshold=1)
+        pool.record_failure('dead', 0.1)
+
+        with mock.patch.object(Gemini_Config, 'get_key_pool', return_value=pool), \
+                mock.patch.object(Gemini_Config, 'get_model', return_value=model) as get_model:
+            recipe_data, error_message = get_recipe_from_gemini(['egg', 'onion', 'tomato'])
+
+        self.assertIsNone(error_message)
+        get_model.assert_called_once_with('alive')
+
+
+class HedgedCallTests(TestCase):
+    def setUp(self):
+        self.pool = HedgePool(max_in_flight=2)
+        self.threads = []
+
+    def slow_first_key(self, key):
+        self.threads.append(threading.current_thread())
+        time.sleep(0.5 if key.startswith('slow') else 0.01)
+        if key.endswith('failing'):
+            raise TimeoutError()
+        return key
+
+    def test_fast_hedge_beats_slow_primary(self):
+        policy = HedgePolicy(min_delay=0.05, budget=1)
+        started = time.monotonic()
+        key, result = hedged_call(self.slow_first_key, 'slow', lambda: 'fast', policy, self.pool)
+
+        self.assertEqual((key, result), ('fast', 'fast'))
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(policy.snapshot()['hedges_fired'], 1)
+        self.assertEqual(policy.snapshot()['hedges_won'], 1)
+
+    def test_slow_primary_wins_when_hedge_fails(self):
+        policy = HedgePolicy(min_delay=0.05, budget=1)
+        key, result = hedged_call(self.slow_first_key, 'slow', lambda: 'fast-failing', policy, self.pool)
+
+        self.assertEqual((key, result), ('slow', 'slow'))
+        self.assertEqual(policy.snapshot()['hedges_won'], 0)
+
+    def test_fast_primary_is_not_hedged(self):
+        policy = HedgePolicy(min_delay=0.2, budget=1)
+        next_key = mock.Mock(return_value='other')
+        key, _ = hedged_call(self.slow_first_key, 'fast', next_key, policy, self.pool)
+
+        self.assertEqual(key, 'fast')
+        self.assertEqual(len(self.threads), 1)
+        next_key.assert_not_called()
+        self.assertEqual(policy.snapshot()['hedges_fired'], 0)
+
+    def test_full_pool_runs_on_calling_thread_without_hedge(self):
+        policy = HedgePolicy(min_delay=0.05, budget=1)
+        self.pool.submit(time.sleep, 0.3)
+        self.pool.submit(time.sleep, 0.3)
+        key, _ = hedged_call(self.slow_first_key, 'slow', lambda: 'fast', policy, self.pool)
+
+        self.assertEqual(key, 'slow')
+        self.assertEqual(self.threads, [threading.current_thread()])
+        self.assertEqual(policy.snapshot()['hedges_fired'], 0)
+
+    def test_budget_caps_hedges(self):
+        policy = HedgePolicy(min_delay=0.05, budget=0.5)
+        key, _ = hedged_call(self.slow_first_key, 'slow', lambda: 'fast', policy, self.pool)
+
+        self.assertEqual(key, 'slow')
+        self.assertEqual(policy.snapshot()['hedges_fired'], 0)
+        self.assertEqual(policy.snapshot()['hedges_skipped'], 1)
+
+    def test_delay_follows_latency_percentile(self):
+        policy = HedgePolicy(percentile=90, min_delay=0.1, min_samples=10)
+        for latency in range(1, 11):
+            policy.record_latency(latency)
+        self.assertEqual(policy.delay(), 10)
+
+
+class DeadlineTests(TestCase):
+    def test_attempts_get_remaining_budget_and_stop_when_spent(self):
+        clock = FakeClock()
+        deadline = Deadline(10, clock=clock)
+        model = mock.Mock()
+
+        def slow_timeout(prompt, request_options=None, **kwargs):
+            clock.now += request_options['timeout']
+            raise TimeoutError()
+
+        model.generate_content.side_effect = slow_timeout
+        pool = KeyPool(['first', 'second'])
+        clock.now = 3
+        with mock.patch.object(Gemini_Config, 'get_key_pool', return_value=pool), \
+                mock.patch.object(Gemini_Config, 'get_model', return_value=model):
+            recipe_data, error_message = get_recipe_from_gemini(['egg', 'onion', 'tomato'], deadline)
+
+        # The first attempt used up the remaining 7 seconds, the second key was never tried
+        model.generate_content.assert_called_once()
+        self.assertEqual(model.generate_content.call_args.kwargs['request_options'], {'timeout': 7})
+        self.assertEqual(error_message, DEADLINE_EXCEEDED_MESSAGE)
+        self.assertEqual(recipe_data['recipes'][0]['name'], FALLBACK_RECIPE_NAME)
+        self.assertEqual(sum(key['timeouts'] for key in pool.snapshot()), 1)
+        self.assertEqual(sum(key['failures'] for key in pool.snapshot()), 1)
+
+
+class GeminiModelRegistryTests(TestCase):
+    def test_one_model_per_key_without_global_configure(self):
+        with mock.patch('google.generativeai.configure') as configure, \
+                mock.patch.dict(Gemini_Config._models, clear=True):
+            first = Gemini_Config.get_model('key-a')
+            self.assertIs(Gemini_Config.get_model('key-a'), first)
+            second = Gemini_Config.get_model('key-b')
+
+        self.assertIsNot(first, second)
+        self.assertIsNot(first.client, second.client)
+        configure.assert_not_called()
+
+    def test_models_are_built_in_threads_without_an_event_loop(self):
+        models, errors = [], []
+
+        def worker():
+            try:
+                models.append(Gemini_Config.get_model('key-thread'))
+            except Exception as error:
+                errors.append(error)
+
+        with mock.patch.dict(Gemini_Config._models, clear=True):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(models), 1)
+
+    def test_async_client_is_made_per_event_loop(self):
+        with mock.patch.dict(Gemini_Config._models, clear=True):
+            model = Gemini_Config.get_model('key-a')
+
+        async def clients():
+            return model.async_client(), model.async_client()
+
+        first, again = asyncio.run(clients())
+        other, _ = asyncio.run(clients())
+        self.assertIs(first, again)
+        self.assertIsNot(first, other)
+
+    def test_request_merges_call_settings_over_the_model(self):
+        with mock.patch.dict(Gemini_Config._models, clear=True):
+            model = Gemini_Config.get_model('key-a')
+        request = model.build_request('Hello', {'max_output_tokens': 100})
+
+        self.assertEqual(request.model, 'models/gemini-2.0-flash')
+        self.assertEqual(request.contents[0].parts[0].text, 'Hello')
+        self.assertEqual(request.generation_config.max_output_tokens, 100)
+        self.assertAlmostEqual(request.generation_config.temperature, 0.7, places=5)
+        self.assertEqual(len(request.safety_settings), 4)
+
+
+class RecipePromptTests(TestCase):
+    def test_compact_prompt_is_smaller_and_names_ingredients(self):
+        ingredients = ['egg', 'onion', 'tomato']
+        compact = build_recipe_prompt(ingredients, 'compact')
+        full = build_recipe_prompt(ingredients, 'full')
+
+        self.assertIn('egg, onion, tomato', compact)
+        self.assertLess(estimate_tokens(compact), estimate_tokens(full) / 2)
+
+    def test_output_cap_grows_with_request_and_is_clamped(self):
+        few = output_token_cap(['egg'] * 3, ceiling=8192)
+        many = output_token_cap(['egg'] * 15, ceiling=8192)
+
+        self.assertLess(few, many)
+        self.assertLess(many, 8192)
+        self.assertEqual(output_token_cap(['egg'] * 15, ceiling=1500), 1500)
+
+    def test_token_usage_prefers_reported_counts(self):
+        usage = mock.Mock(prompt_token_count=120, candidates_token_count=640)
+        self.assertEqual(token_usage('prompt', 'reply', usage), (120, 640, False))
+        self.assertEqual(token_usage('a' * 40, 'b' * 8), (10, 2, True))
+
+    def test_call_sends_adaptive_output_cap(self):
+        model = mock.Mock()
+        model.generate_content.return_value.text = json.dumps(make_recipe_data())
+        ingredients = ['egg', 'onion', 'tomato']
+
+        with mock.patch.object(Gemini_Config, 'get_key_pool', return_value=KeyPool(['only'])), \
+                mock.patch.object(Gemini_Config, 'get_model', return_value=model):
+            get_recipe_from_gemini(ingredients)
+
+        self.assertEqual(
+            model.generate_content.call_args.kwargs['generation_config'],
+            {'max_output_tokens': output_token_cap(ingredients)}
+        )
+
+
+class StructuredOutputTests(TestCase):
+    def test_response_schema_follows_recipe_history(self):
+        # The library converts it to its Schema proto, which rejects unknown fields
+        generation_config = genai.types.generation_types.to_generation_config_dict(
+            {'response_mime_type': 'application/json', 'response_schema': recipe_response_schema()}
+        )
+        recipe = recipe_response_schema()['properties']['recipes']['items']
+
+        self.assertIn('response_schema', generation_config)
+        self.assertEqual(recipe['properties']['difficulty']['enum'], ['Easy', 'Medium', 'Hard'])
+        self.assertIn('200', recipe['properties']['name']['description'])
+        self.assertEqual(recipe['properties']['additional_ingredients']['items']['properties']['optional'], {'type': 'boolean'})
+
+    def test_model_requests_json_and_prompt_has_no_example(self):
+        with mock.patch.object(Gemini_Config, 'STRUCTURED_OUTPUT', True), \
+                mock.patch.object(Gemini_Config, 'PROMPT_TEMPLATE', ''), \
+                mock.patch.dict(Gemini_Config._models, clear=True):
+            model = Gemini_Config.get_model('key-a')
+            prompt = build_recipe_prompt(['egg', 'onion', 'tomato'])
+
+        self.assertEqual(model.generation_config['response_mime_type'], 'application/json')
+        self.assertNotIn('{', prompt)
+
+    def test_variants_are_asked_for_in_one_call(self):
+        model = mock.Mock()
+        model.generate_content.return_value = mock.Mock(text=json.dumps(make_recipe_data()), usage_metadata=None)
+        ingredients = ['egg', 'onion', 'tomato']
+
+        with mock.patch.object(Gemini_Config, 'STRUCTURED_OUTPUT', True), \
+                mock.patch.object(Gemini_Config, 'PROMPT_TEMPLATE', ''), \
+                mock.patch.object(Gemini_Config, 'get_key_pool', return_value=KeyPool(['only'])), \
+                mock.patch.object(Gemini_Config, 'get_model', return_value=model):
+            get_recipe_from_gemini(ingredients, variants=3)
+
+        call = model.generate_content.call_args
+        recipes = call.kwargs['generation_config']['response_schema']['properties']['recipes']
+        self.assertIn('3 different recipes', call.args[0])
+        self.assertEqual((recipes['min_items'], recipes['max_items']), (3, 3))
+        self.assertEqual(call.kwargs['generation_config']['max_output_tokens'], output_token_cap(ingredients, variants=3))
+
+    def test_request_outcome_records_attempts_and_parse_failures(self):
+        model = mock.Mock()
+        model.generate_content.side_effect = [
+            mock.Mock(text='Sorry, I cannot help with that', usage_metadata=None),
+            mock.Mock(text=json.dumps(make_recipe_data()), usage_metadata=None),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'responses.jsonl')
+            with mock.patch.object(Gemini_Config, 'RECORD_RESPONSES_PATH', path), \
+                    mock.patch.object(Gemini_Config, 'get_key_pool', return_value=KeyPool(['first', 'second'])), \
+                    mock.patch.object(Gemini_Config, 'get_model', return_value=model):
+                get_recipe_from_gemini(['egg', 'onion', 'tomato'])
+            with open(path) as response_file:
+                records = [json.loads(line) for line in response_file]
+
+        self.assertEqual([record['kind'] for record in records], ['call', 'call', 'request'])
+        self.assertEqual((records[-1]['attempts'], records[-1]['parse_failures']), (2, 1))
+        self.assertTrue(records[-1]['succeeded'])
+
+
+class MicroBatchTests(TestCase):
+    def run_concurrently(self, call, items):
+        results = {}
+
+        def submit(item):
+            results[item] = call(item)
+
+        threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_a_batch(self):
+        batches = []
+
+        def run_batch(items):
+            batches.append(list(items))
+            return [item * 10 if item != 3 else None for item in items]
+
+        batcher = MicroBatcher(run_batch, window=0.2, max_size=3)
+        results = self.run_concurrently(lambda item: batcher.submit(item, timeout=5), [1, 2, 3])
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(results, {1: 10, 2: 20, 3: None})
+
+    def test_failed_batch_returns_none_for_every_item(self):
+        def run_batch(items):
+            raise TimeoutError()
+
+        batcher = MicroBatcher(run_batch, window=0.2, max_size=2)
+        self.assertEqual(self.run_concurrently(lambda item: batcher.submit(item, timeout=5), ['a', 'b']), {'a': None, 'b': None})
+
+    def test_split_keeps_usable_recipes_in_request_order(self):
+        recipe = make_recipe_data()['recipes'][0]
+        reply = json.dumps({'results': [
+            {'request': 3, 'recipe': dict(recipe, name='Third')},
+            {'request': 1, 'recipe': dict(recipe, instructions=[])},
+            {'request': 9, 'recipe': recipe},
+        ]})
+
+        results = split_batch_response(reply, 3)
+
+        self.assertEqual([result and result['recipes'][0]['name'] for result in results], [None, None, 'Third'])
+        self.assertEqual(split_batch_response('Sorry, no recipes today', 2), [None, None])
+
+    def test_unparsed_requests_fall_back_to_their_own_call(self):
+        recipe = make_recipe_data()['recipes'][0]
+
+        def generate_content(prompt, **kwargs):
+            if 'numbered request' in prompt:
+                # The reply leaves out the second request
+                results = [{'request': number, 'recipe': dict(recipe, name=f'Batched {number}')} for number in (1, 3)]
+                return mock.Mock(text=json.dumps({'results': results}), usage_metadata=None)
+            return mock.Mock(text=json.dumps(make_recipe_data(name='Single')), usage_metadata=None)
+
+        model = mock.Mock()
+        model.generate_content.side_effect = generate_content
+        with mock.patch.object(Gemini_Config, 'MICRO_BATCH_ENABLED', True), \
+                mock.patch.object(ai_get_recipe, '_recipe_batcher', MicroBatcher(ai_get_recipe.request_recipe_batch, window=0.5, max_size=3)), \
+                mock.patch.object(Gemini_Config, 'get_key_pool', return_value=KeyPool(['only'])), \
+                mock.patch.object(Gemini_Config, 'get_model', return_value=model):
+            results = self.run_concurrently(
+                lambda ingredients: get_recipe_from_gemini(list(ingredients)),
+                [('egg', 'onion', 'tomato'), ('chicken', 'garlic', 'rice'), ('beef', 'potato', 'carrot')]
+            )
+
+        names = sorted(recipe_data['recipes'][0]['name'] for recipe_data, _ in results.values())
+        self.assertEqual(names, ['Batched 1', 'Batched 3', 'Single'])
+        self.assertEqual(model.generate_content.call_count, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GenerateRecipeTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        get_recipe_cache().shared.clear()
+        ingredient_index._ingredient_index = None
+        self.user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def generate(self, ingredients):
+        return self.client.post('/api/recipes/generate/', {'ingredients': ingredients}, format='json')
+
+    def test_rejects_oversized_requests(self):
+        self.assertEqual(self.generate([f'ingredient {i}' for i in range(21)]).status_code, 400)
+        self.assertEqual(self.generate(['egg', 'onion', 'x' * 61]).status_code, 400)
+
+    def test_similar_recipe_is_served_without_gemini(self):
+        RecipeHistory.from_recipe_dict(make_recipe_data()['recipes'][0], user=self.user).save()
+        stub = StubGemini()
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', stub):
+            response = self.generate(['egg', 'onion', 'tomato', 'salt'])
+
+        self.assertEqual(stub.calls, 0)
+        self.assertTrue(response.data['from_cache'])
+        self.assertEqual(response.data['recipes'][0]['name'], 'Tomato Omelette')
+
+    def test_similar_recipe_replaces_generic_fallback(self):
+        RecipeHistory.from_recipe_dict(make_recipe_data()['recipes'][0], user=self.user).save()
+        fallback = make_recipe_data(name='Simple Mixed Ingredients Dish')
+        fallback['success'] = False
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', return_value=(fallback, 'All API keys failed')):
+            response = self.generate(['egg', 'tomato', 'rice', 'beef'])
+
+        self.assertTrue(response.data['fallback_used'])
+        self.assertEqual(response.data['recipes'][0]['name'], 'Tomato Omelette')
+
+    def test_fallback_is_not_cached_and_gemini_is_retried(self):
+        fallback = make_recipe_data(name='Simple Mixed Ingredients Dish')
+        fallback['success'] = False
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', return_value=(fallback, 'All API keys failed')):
+            self.assertTrue(self.generate(['egg', 'onion', 'tomato']).data['fallback_used'])
+        self.assertIsNone(get_recipe_cache().get(ingredients_fingerprint(['egg', 'onion', 'tomato'])))
+
+        stub = StubGemini()
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', stub):
+            response = self.generate(['egg', 'onion', 'tomato'])
+
+        self.assertEqual(stub.calls, 1)
+        self.assertFalse(response.data['from_cache'])
+        self.assertEqual(response.data['recipes'][0]['name'], 'Tomato Omelette')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SharedRecipeTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        ingredient_index._ingredient_index = None
+        self.client = APIClient()
+
+    def history(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.get('/api/user-data/recipe/history/').data['user_recipe_history']
+
+    def test_users_served_the_same_recipe_share_one_row(self):
+        users = [User.objects.create(username=f'cook{i}', email=f'cook{i}@example.com') for i in range(3)]
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', return_value=(make_recipe_data(), None)) as gemini:
+            for user in users:
+                self.client.force_authenticate(user=user)
+                response = self.client.post('/api/recipes/generate/', {'ingredients': ['egg', 'onion', 'tomato']}, format='json')
+
+        self.assertEqual(gemini.call_count, 1)
+        self.assertEqual(Recipe.objects.count(), 1)
+        self.assertEqual(RecipeHistory.objects.count(), 3)
+        entry = RecipeHistory.objects.get(user=users[-1])
+        self.assertEqual(response.data['saved_recipe_ids'], [entry.id])
+        self.assertEqual(self.history(users[-1]), [{
+            'id': entry.id,
+            'recipe_name': 'Tomato Omelette',
+            'recipe_description': 'Eggs with tomato and onion',
+            'recipe_difficulty': 'Easy',
+            'prep_time': '5 minutes',
+            'cook_time': '10 minutes',
+            'total_time': '15 minutes',
+            'servings': 2,
+            'main_ingredients': ['egg', 'onion', 'tomato'],
+            'additional_ingredients': [],
+            'instructions': ['Whisk the eggs', 'Cook everything together'],
+            'tips': [],
+            'nutrition': {'calories': 250},
+            'created_at': entry.created_at.isoformat(),
+        }])
+
+    def test_same_ingredients_with_different_content_are_kept_apart(self):
+        first = Recipe.intern(Recipe.from_recipe_dict(make_recipe_data()['recipes'][0]))
+        again = Recipe.intern(Recipe.from_recipe_dict(make_recipe_data()['recipes'][0]))
+        other = Recipe.intern(Recipe.from_recipe_dict(make_recipe_data(name='Shakshuka')['recipes'][0]))
+
+        self.assertEqual(first.id, again.id)
+        self.assertNotEqual(first.id, other.id)
+        self.assertEqual(first.ingredients_fingerprint, other.ingredients_fingerprint)
+
+    def test_collapse_command_moves_legacy_bodies_to_shared_recipes(self):
+        users = [User.objects.create(username=f'cook{i}', email=f'cook{i}@example.com') for i in range(2)]
+        legacy = [
+            RecipeHistory.objects.create(
+                user=user, recipe_name=name, recipe_description='', recipe_difficulty='Easy',
+                prep_time='', cook_time='', total_time='', servings=1,
+                main_ingredients=['egg', 'onion', 'tomato']
+            )
+            for user in users for name in ('Omelette', 'Frittata')
+        ]
+        before = self.history(users[0])
+
+        output = io.StringIO()
+        call_command('collapse_recipe_history', '--batch-size', '3', stdout=output)
+
+        self.assertIn('Collapsed 4 history rows into 2 shared recipes', output.getvalue())
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertFalse(RecipeHistory.objects.filter(recipe__isnull=True).exists())
+        self.assertFalse(RecipeHistory.objects.exclude(recipe_name='').exists())
+        self.assertEqual(self.history(users[0]), before)
+        self.assertEqual(
+            RecipeHistory.objects.get(id=legacy[1].id).recipe_id,
+            RecipeHistory.objects.get(id=legacy[3].id).recipe_id
+        )
+
+
+class MonthlyRecipeUsageTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        ingredient_index._ingredient_index = None
+        self.user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def usage_count(self):
+        return self.client.get('/api/user-data/usage-count/').data['user_count']
+
+    def test_reservations_stop_at_the_limit(self):
+        MonthlyRecipeUsage.add(self.user, 29)
+
+        reservation = MonthlyRecipeUsage.reserve(self.user, 1, 30)
+        self.assertIsNotNone(reservation)
+        self.assertIsNone(MonthlyRecipeUsage.reserve(self.user, 1, 30))
+        reservation.release()
+        reservation.release()
+        self.assertEqual(self.user.get_recipes_last_month_count(), 29)
+        self.assertIsNone(MonthlyRecipeUsage.reserve(self.user, 2, 30))
+        self.assertIsNotNone(MonthlyRecipeUsage.reserve(self.user, 1, 30))
+
+    def test_generations_are_counted_and_failures_released(self):
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', StubGemini()):
+            self.assertEqual(
+                self.client.post('/api/recipes/generate/', {'ingredients': ['egg', 'onion', 'tomato']}, format='json').status_code,
+                200
+            )
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', side_effect=RuntimeError('boom')):
+            self.assertEqual(
+                self.client.post('/api/recipes/generate/', {'ingredients': ['rice', 'beans', 'corn']}, format='json').status_code,
+                500
+            )
+
+        self.assertEqual(self.usage_count(), 1)
+        with self.assertNumQueries(1):
+            self.user.get_recipes_last_month_count()
+
+    def test_reconcile_rebuilds_counters_from_history(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pass12345')
+        RecipeHistory.bulk_save([
+            RecipeHistory.from_recipe_dict(make_recipe_data(name=f'Recipe {index}')['recipes'][0], user=self.user)
+            for index in range(3)
+        ])
+        RecipeJob.objects.create(user=self.user, ingredients=['egg', 'onion', 'leek'], usage_month=MonthlyRecipeUsage.current_month())
+        MonthlyRecipeUsage.add(other, 5)
+        stdout = io.StringIO()
+
+        call_command('reconcile_recipe_usage', '--dry-run', stdout=stdout)
+        self.assertEqual(self.user.get_recipes_last_month_count(), 0)
+        call_command('reconcile_recipe_usage', stdout=stdout)
+
+        self.assertIn('would fix 2', stdout.getvalue())
+        self.assertEqual(self.user.get_recipes_last_month_count(), 4)
+        self.assertEqual(other.get_recipes_last_month_count(), 0)
+
+
+class UserAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='pass12345')
+        self.client.force_login(self.admin)
+
+    def add_users(self, count, start=0):
+        for index in range(start, start + count):
+            user = User.objects.create_user(username=f'user{index:02d}', email=f'user{index}@example.com')
+            RecipeHistory.from_recipe_dict(make_recipe_data()['recipes'][0], user=user).save()
+            MonthlyRecipeUsage.add(user, index)
+
+    def test_changelist_query_count_does_not_grow_with_users(self):
+        self.add_users(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/admin/Chef/user/').status_code, 200)
+
+        self.add_users(10, start=2)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get('/admin/Chef/user/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('recipehistory' in query['sql'].lower() for query in queries.captured_queries))
+
+    def test_changelist_sorts_by_monthly_count(self):
+        self.add_users(3)
+
+        # recipes_last_month is the sixth column
+        response = self.client.get('/admin/Chef/user/?o=-6')
+
+        self.assertEqual(response.status_code, 200)
+        users = list(response.context['cl'].result_list)
+        self.assertEqual([user.username for user in users[:3]], ['user02', 'user01', 'user00'])
+        self.assertEqual([user.recipe_count_last_month for user in users[:3]], [2, 1, 0])
+
+
+def make_variant_data(ingredients):
+    recipe_data = make_recipe_data()
+    recipe_data['recipes'] = [
+        dict(recipe_data['recipes'][0], name=f'{difficulty} {" ".join(ingredients)}', difficulty=difficulty)
+        for difficulty in ('Easy', 'Medium', 'Hard')
+    ]
+    return recipe_data
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RECIPE_VARIANTS_PER_CALL=3)
+class VariantPoolTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        get_recipe_cache().shared.clear()
+        ingredient_index._ingredient_index = None
+        self.client = APIClient()
+
+    def generate(self, username, **data):
+        user, _ = User.objects.get_or_create(username=username, defaults={'email': f'{username}@example.com'})
+        self.client.force_authenticate(user=user)
+        return self.client.post('/api/recipes/generate/', {'ingredients': ['egg', 'onion', 'tomato'], **data}, format='json')
+
+    def test_one_call_fills_a_pool_that_hits_rotate_through(self):
+        def fake_gemini(ingredients, deadline=None, variants=1):
+            self.assertEqual(variants, 3)
+            return make_variant_data(ingredients), None
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', side_effect=fake_gemini) as gemini:
+            first = self.generate('first')
+            served = [self.generate(f'cook{i}').data['recipes'][0]['name'] for i in range(3)]
+            hard = self.generate('picky', difficulty='Hard')
+
+        self.assertEqual(gemini.call_count, 1)
+        self.assertFalse(first.data['from_cache'])
+        self.assertEqual(len(first.data['recipes']), 1)
+        # Only the served variant counts toward the user's monthly limit
+        self.assertEqual(RecipeHistory.objects.filter(user__username='first').count(), 1)
+        self.assertEqual(Recipe.objects.count(), 3)
+        self.assertEqual(len(set(served)), 3)
+        self.assertTrue(hard.data['from_cache'])
+        self.assertEqual(hard.data['recipes'][0]['difficulty'], 'Hard')
+
+    def test_rejects_unknown_difficulty(self):
+        self.assertEqual(self.generate('cook', difficulty='Extreme').status_code, 400)
+
+
+class FakeBackendTests(TestCase):
+    def test_replies_are_valid_and_deterministic(self):
+        backend = FakeBackend(latency=0)
+        single = backend.generate('fake-key-1', build_recipe_prompt(['egg', 'onion', 'tomato'], 'full')).text
+        variants = json.loads(backend.generate('fake-key-1', build_recipe_prompt(['egg', 'onion', 'tomato'], variants=3)).text)
+        batch = backend.generate('fake-key-1', build_batch_recipe_prompt([['egg', 'onion', 'tomato'], ['rice', 'beans', 'corn']])).text
+
+        self.assertEqual(single, FakeBackend(latency=0).generate('fake-key-2', build_recipe_prompt(['egg', 'onion', 'tomato'], 'full')).text)
+        self.assertEqual(validate_recipe_data(json.loads(single))['recipes'][0]['main_ingredients'], ['egg', 'onion', 'tomato'])
+        self.assertEqual(len({recipe['name'] for recipe in validate_recipe_data(variants)['recipes']}), 3)
+        self.assertEqual([result['recipes'][0]['main_ingredients'][0] for result in split_batch_response(batch, 2)], ['egg', 'rice'])
+
+    def test_injects_failures_timeouts_and_truncation(self):
+        sleeps = []
+        prompt = build_recipe_prompt(['egg', 'onion', 'tomato'])
+
+        with self.assertRaises(llm_backend.LLMRateLimitError):
+            FakeBackend(latency=0, rate_limit_rate=1).generate('fake-key-1', prompt)
+        with self.assertRaises(llm_backend.LLMBackendError):
+            FakeBackend(latency=0, error_rate=1).generate('fake-key-1', prompt)
+        with self.assertRaises(TimeoutError):
+            FakeBackend(latency=5, distribution='fixed', sleep=sleeps.append).generate(
+                'fake-key-1', prompt, request_options={'timeout': 1}
+            )
+        self.assertEqual(sleeps, [1])
+        truncated = FakeBackend(latency=0, truncate_rate=1).generate('fake-key-1', prompt).text
+        self.assertLess(len(truncated), len(FakeBackend(latency=0).generate('fake-key-1', prompt).text))
+
+    def test_latency_follows_the_distribution_and_seed(self):
+        def latencies(**options):
+            sleeps = []
+            backend = FakeBackend(latency=0.2, sleep=sleeps.append, **options)
+            for _ in range(200):
+                backend.generate('fake-key-1', 'ingredients: egg, onion, tomato')
+            return sleeps
+
+        uniform = latencies(distribution='uniform', spread=0.5)
+        self.assertEqual(latencies(distribution='fixed'), [0.2] * 200)
+        self.assertTrue(all(0.1 <= latency <= 0.3 for latency in uniform))
+        self.assertEqual(uniform, latencies(distribution='uniform', spread=0.5))
+        self.assertNotEqual(uniform, latencies(distribution='uniform', spread=0.5, seed=1))
+
+    @override_settings(LLM_BACKEND='fake', FAKE_LLM_LATENCY=0, FAKE_LLM_ERROR_RATE=0, FAKE_LLM_RATE_LIMIT_RATE=0, FAKE_LLM_TRUNCATE_RATE=0)
+    def test_generate_path_runs_on_the_fake_without_keys(self):
+        llm_backend._llm_backend = None
+        try:
+            with mock.patch.object(Gemini_Config, 'API_KEYS', []):
+                recipe_data, error_message = get_recipe_from_gemini(['egg', 'onion', 'tomato'])
+                events = list(stream_recipe_from_gemini(['egg', 'onion', 'tomato']))
+        finally:
+            llm_backend._llm_backend = None
+
+        self.assertIsNone(error_message)
+        self.assertEqual(recipe_data['recipes'][0]['main_ingredients'], ['egg', 'onion', 'tomato'])
+        self.assertGreater(sum(1 for event, _ in events if event == 'delta'), 1)
+        self.assertEqual(events[-1][1][0]['recipes'][0]['name'], recipe_data['recipes'][0]['name'])
+
+
+class LLMJSONParserTests(TestCase):
+    def test_repairs_corpus_of_defective_replies(self):
+        for defect, text, expected_name in build_reply_corpus():
+            with self.subTest(defect=defect, text=text[-40:]):
+                recipe_data, _ = parse_json(text)
+                self.assertEqual(validate_recipe_data(recipe_data)['recipes'][0]['name'], expected_name)
+
+    def test_reports_repairs(self):
+        _, repairs = parse_json('Sure! {"recipes": [{“name”: "Soup", "tips": ["Salt",],}], "success": True}')
+        self.assertEqual(repairs, {'smart_quotes', 'trailing_comma', 'python_literals'})
+
+    def test_partial_keeps_only_complete_values(self):
+        parser = IncrementalJSONParser()
+        self.assertIsNone(parser.feed('Here is').partial())
+        parser.feed('```json\n{"recipes": [{"name": "Soup", "servings": 2, "instructions": ["Boil wat')
+        self.assertEqual(parser.partial(), {'recipes': [{'name': 'Soup', 'servings': 2, 'instructions': []}]})
+
+    def test_rejects_replies_without_usable_recipe(self):
+        with self.assertRaises(json.JSONDecodeError):
+            parse_json('I cannot help with that.')
+        with self.assertRaises(RecipeSchemaError):
+            validate_recipe_data({'recipes': [{'name': 'Soup', 'instructions': []}]})
+        with self.assertRaises(RecipeSchemaError):
+            validate_recipe_data({'recipes': [{'name': 'Soup', 'instructions': ['Boil'], 'difficulty': 'Easy/Medium'}]})
+
+    def test_null_optional_fields_get_storable_defaults(self):
+        recipe_data, _ = parse_json('{"recipes": [{"name": "Soup", "instructions": ["Boil"], "servings": null, "difficulty": null, "tips": null')
+        recipe = validate_recipe_data(recipe_data)['recipes'][0]
+
+        self.assertEqual((recipe['servings'], recipe['difficulty'], recipe['tips']), (1, 'Easy', []))
+        user = User.objects.create(username='cook', email='cook@example.com')
+        RecipeHistory.from_recipe_dict(recipe, user=user, main_ingredients=['egg', 'onion', 'tomato']).save()
+        self.assertEqual(Recipe.objects.get().servings, 1)
+
+    def test_usable_near_miss_values_are_converted(self):
+        recipe = validate_recipe_data({'recipes': [{
+            'name': 'Soup', 'instructions': ['Boil'], 'difficulty': ' medium', 'servings': '4', 'prep_time': 10,
+            'nutrition': {'calories': 200},
+        }]})['recipes'][0]
+        self.assertEqual((recipe['difficulty'], recipe['servings'], recipe['prep_time']), ('Medium', 4, '10'))
+        self.assertEqual(validate_recipe_data({'recipes': [{'name': 'Soup', 'instructions': ['Boil'], 'servings': 2.0}]})['recipes'][0]['servings'], 2)
+
+        for servings in ('a few', 2.5, True):
+            with self.assertRaises(RecipeSchemaError):
+                validate_recipe_data({'recipes': [{'name': 'Soup', 'instructions': ['Boil'], 'servings': servings}]})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GenerateRecipeStreamTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        get_recipe_cache().shared.clear()
+        ingredient_index._ingredient_index = None
+        self.user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_events(self, response):
+        body = b''.join(response.streaming_content).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            event_line, data_line = block.split('\n')
+            events.append((event_line[len('event: '):], json.loads(data_line[len('data: '):])))
+        return events
+
+    def test_streams_fields_then_persists_recipe(self):
+        with mock.patch.object(Gemini_Config, 'API_KEYS', ['key']), \
+                mock.patch.object(Gemini_Config, 'get_model', return_value=StreamingModel()):
+            response = self.client.post('/api/recipes/generate/stream/', {'ingredients': ['egg', 'onion', 'tomato']}, format='json')
+            events = self.read_events(response)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        names = [name for name, _ in events]
+        self.assertEqual(names[0], 'start')
+        self.assertEqual(names[-1], 'done')
+        fields = {data['field']: data['value'] for name, data in events if name == 'field'}
+        self.assertEqual(fields['name'], 'Tomato Omelette')
+        self.assertEqual(set(fields), set(make_recipe_data()['recipes'][0]))
+
+        done = events[-1][1]
+        self.assertTrue(done['success'])
+        self.assertFalse(done['from_cache'])
+        self.assertEqual(RecipeHistory.objects.get(id=done['saved_recipe_ids'][0]).recipe.recipe_name, 'Tomato Omelette')
+
+    def test_cached_recipe_is_sent_as_done_event(self):
+        RecipeHistory.from_recipe_dict(make_recipe_data()['recipes'][0], user=self.user, main_ingredients=['egg', 'onion', 'tomato']).save()
+
+        response = self.client.post('/api/recipes/generate/stream/', {'ingredients': ['egg', 'onion', 'tomato']}, format='json')
+        events = self.read_events(response)
+
+        self.assertEqual([name for name, _ in events], ['done'])
+        self.assertTrue(events[0][1]['from_cache'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GenerateRecipeAsyncTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        ingredient_index._ingredient_index = None
+        self.user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        self.headers = {'authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    async def test_generates_then_serves_from_cache(self):
+        client = AsyncClient()
+
+        async def fake_gemini(ingredients, deadline=None):
+            return make_recipe_data(), None
+
+        with mock.patch('Chef.main.get_recipe_async.aget_recipe_from_gemini', side_effect=fake_gemini) as gemini:
+            first = await client.post('/api/recipes/generate/async/', {'ingredients': ['egg', 'onion', 'tomato']},
+                                      content_type='application/json', headers=self.headers)
+            second = await client.post('/api/recipes/generate/async/', {'ingredients': ['Tomatoes', 'eggs', 'onion']},
+                                       content_type='application/json', headers=self.headers)
+
+        self.assertEqual(gemini.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertFalse(first.json()['from_cache'])
+        self.assertTrue(second.json()['from_cache'])
+        self.assertEqual(second.json()['recipes'][0]['name'], 'Tomato Omelette')
+
+    async def test_requires_authentication(self):
+        response = await AsyncClient().post('/api/recipes/generate/async/', {'ingredients': ['egg', 'onion', 'tomato']},
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GenerateRecipeConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        ingredient_index._ingredient_index = None
+
+    def test_identical_requests_make_one_upstream_call(self):
+        users = [
+            User.objects.create_user(username=f'cook{i}', email=f'cook{i}@example.com', password='pass12345')
+            for i in range(6)
+        ]
+        stub = StubGemini(latency=0.3)
+        responses = []
+
+        def send(user):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            responses.append(client.post(
+                '/api/recipes/generate/',
+                {'ingredients': ['Tomato', 'egg', 'onion']},
+                format='json'
+            ))
+            connection.close()
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', stub):
+            threads = [threading.Thread(target=send, args=(user,)) for user in users]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(stub.calls, 1)
+        self.assertEqual(len(responses), len(users))
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['recipes'][0]['name'], 'Tomato Omelette')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GenerateRecipeBatchTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        get_recipe_cache().shared.clear()
+        ingredient_index._ingredient_index = None
+        self.user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def generate(self, ingredient_sets):
+        return self.client.post('/api/recipes/generate/batch/', {'ingredient_sets': ingredient_sets}, format='json')
+
+    def test_mixed_batch_resolves_hits_generates_misses_and_reports_errors(self):
+        RecipeHistory.from_recipe_dict(make_recipe_data()['recipes'][0], user=self.user).save()
+
+        def fake_gemini(ingredients, deadline=None, variants=1):
+            return make_recipe_data(name=f"{' '.join(ingredients)} bowl"), None
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', side_effect=fake_gemini) as gemini:
+            response = self.generate([
+                ['egg', 'onion', 'tomato'],
+                ['chicken', 'garlic', 'rice'],
+                ['egg'],
+                ['Rice', 'garlic', 'chicken'],
+                ['beef', 'potato', 'carrot'],
+            ])
+
+        results = response.data['results']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(gemini.call_count, 2)
+        self.assertEqual((response.data['generated_count'], response.data['cached_count']), (2, 1))
+        self.assertTrue(results[0]['from_cache'])
+        self.assertEqual(results[1]['recipes'][0]['name'], 'chicken garlic rice bowl')
+        self.assertEqual(results[2], {'index': 2, 'success': False, 'error': 'The array of ingredients must contain at least 3 items'})
+        self.assertEqual(results[3]['saved_recipe_ids'], results[1]['saved_recipe_ids'])
+        self.assertEqual(RecipeHistory.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(
+            Recipe.objects.get(recipe_name='beef carrot potato bowl').ingredients_fingerprint,
+            ingredients_fingerprint(['beef', 'carrot', 'potato'])
+        )
+
+    def test_cache_hits_take_one_query(self):
+        for name, ingredients in (('Omelette', ['egg', 'onion', 'tomato']), ('Fried rice', ['egg', 'rice', 'soy sauce'])):
+            recipe = make_recipe_data(name=name)['recipes'][0]
+            recipe['main_ingredients'] = ingredients
+            RecipeHistory.from_recipe_dict(recipe, user=self.user).save()
+        # Keep the similarity lookup out of the count
+        with mock.patch('Chef.main.get_recipe_batch.get_ingredient_index'), self.assertNumQueries(1):
+            recipes = resolve_cached_recipes({
+                ingredients_fingerprint(ingredients): ingredients
+                for ingredients in (['egg', 'onion', 'tomato'], ['egg', 'rice', 'soy sauce'])
+            })
+        self.assertEqual(sorted(recipe['name'] for recipe in recipes.values()), ['Fried rice', 'Omelette'])
+
+    def test_quota_is_checked_against_misses(self):
+        MonthlyRecipeUsage.add(self.user, 29)
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', StubGemini()) as gemini:
+            response = self.generate([['egg', 'onion', 'tomato'], ['chicken', 'garlic', 'rice']])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['recipes_to_generate'], 2)
+        self.assertEqual(gemini.calls, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RECIPE_JOB_MAX_ATTEMPTS=2, RECIPE_JOB_RETRY_DELAY=0)
+class RecipeJobTests(TestCase):
+    def setUp(self):
+        get_recipe_cache().local.clear()
+        get_recipe_cache().shared.clear()
+        ingredient_index._ingredient_index = None
+        self.user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def enqueue(self, ingredients):
+        return self.client.post('/api/recipes/generate/jobs/', {'ingredients': ingredients}, format='json')
+
+    def run_due_jobs(self):
+        for job in RecipeJob.claim('test-worker', lease=60, limit=10):
+            process_recipe_job(job)
+
+    def test_job_is_queued_then_completed_by_a_worker(self):
+        response = self.enqueue(['egg', 'onion', 'tomato'])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], RecipeJob.QUEUED)
+        self.assertEqual(RecipeJob.queue_stats()['due'], 1)
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', StubGemini()):
+            self.run_due_jobs()
+
+        job_status = self.client.get(f"/api/recipes/generate/jobs/{response.data['job_id']}/")
+        self.assertEqual(job_status.data['status'], RecipeJob.SUCCEEDED)
+        self.assertEqual(job_status.data['result']['recipes'][0]['name'], 'Tomato Omelette')
+        self.assertEqual(len(job_status.data['result']['saved_recipe_ids']), 1)
+
+        other = APIClient()
+        other.force_authenticate(user=User.objects.create_user(username='other', email='other@example.com', password='pass12345'))
+        self.assertEqual(other.get(f"/api/recipes/generate/jobs/{response.data['job_id']}/").status_code, 404)
+
+    def test_failed_attempt_is_retried_then_falls_back(self):
+        fallback = make_recipe_data(name='Simple Mixed Ingredients Dish')
+        job_id = self.enqueue(['egg', 'tomato', 'rice']).data['job_id']
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', return_value=(fallback, 'All API keys failed')):
+            self.run_due_jobs()
+            job = RecipeJob.objects.get(id=job_id)
+            self.assertEqual((job.status, job.attempts, job.error), (RecipeJob.QUEUED, 1, 'All API keys failed'))
+            self.run_due_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecipeJob.SUCCEEDED)
+        self.assertTrue(job.result['fallback_used'])
+
+    def test_last_attempt_serves_fallback_without_failing_the_job(self):
+        fallback = make_recipe_data(name='Simple Mixed Ingredients Dish')
+        job_id = self.enqueue(['egg', 'tomato', 'rice']).data['job_id']
+        RecipeJob.objects.filter(id=job_id).update(max_attempts=1)
+        finish = RecipeJob.finish
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', return_value=(fallback, 'All API keys failed')), \
+                mock.patch.object(RecipeJob, 'finish', autospec=True, side_effect=finish) as finished:
+            self.run_due_jobs()
+
+        self.assertEqual([call.args[1] for call in finished.call_args_list], [RecipeJob.SUCCEEDED])
+        job = RecipeJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.attempts), (RecipeJob.SUCCEEDED, 1))
+        self.assertTrue(job.result['fallback_used'])
+        self.assertIsNone(job.usage_month)
+        self.assertEqual(MonthlyRecipeUsage.count_for(self.user), 1)
+
+    def test_expired_lease_is_claimed_again(self):
+        job = RecipeJob.objects.create(user=self.user, ingredients=['egg', 'onion', 'tomato'], max_attempts=2)
+        self.assertEqual(RecipeJob.claim('worker-a', lease=60), [job])
+        self.assertEqual(RecipeJob.claim('worker-b', lease=60), [])
+
+        RecipeJob.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(RecipeJob.queue_stats()['expired_leases'], 1)
+        [reclaimed] = RecipeJob.claim('worker-b', lease=60)
+        self.assertEqual((reclaimed.locked_by, reclaimed.attempts), ('worker-b', 2))
+
+        # Out of attempts, the next expiry fails the job
+        RecipeJob.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(RecipeJob.claim('worker-c', lease=60), [])
+        self.assertEqual(RecipeJob.objects.get(id=job.id).status, RecipeJob.FAILED)
+
+    def test_pending_jobs_count_against_monthly_limit(self):
+        for index in range(30):
+            self.assertEqual(self.enqueue(['egg', 'onion', f'extra {index}']).status_code, 202)
+        self.assertEqual(self.enqueue(['egg', 'onion', 'tomato']).status_code, 400)
+
+        # A job that fails for good gives its recipe back
+        job = RecipeJob.objects.filter(user=self.user).first()
+        job.attempts = job.max_attempts
+        job.retry_later('All API keys failed', 0)
+        self.assertEqual(self.user.get_recipes_last_month_count(), 29)
+        self.assertEqual(self.enqueue(['egg', 'onion', 'tomato']).status_code, 202)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecipeWorkerCommandTests(TransactionTestCase):
+    def test_worker_processes_due_jobs_and_exits(self):
+        get_recipe_cache().local.clear()
+        get_recipe_cache().shared.clear()
+        user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        jobs = [
+            RecipeJob.objects.create(user=user, ingredients=ingredients)
+            for ingredients in (['egg', 'onion', 'tomato'], ['chicken', 'garlic', 'rice'])
+        ]
+
+        with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', StubGemini()):
+            call_command('run_recipe_worker', '--once', '--threads', '1', '--poll-interval', '0', stdout=io.StringIO())
+
+        for job in jobs:
+            job.refresh_from_db()
+            self.assertEqual(job.status, RecipeJob.SUCCEEDED)
+
+
+class PrewarmMiningTests(TestCase):
+    def test_frequent_combinations_and_near_variants(self):
+        ranked = dict(mine_combinations([
+            ['chicken', 'garlic', 'rice'],
+            ['chicken', 'garlic', 'rice'],
+            ['chicken', 'lemon', 'onion'],
+            ['chicken', 'onion', 'thyme'],
+            ['garlic', 'onion', 'tomato'],
+            ['garlic', 'onion', 'pepper'],
+        ]))
+
+        self.assertEqual(ranked[('chicken', 'garlic', 'rice')], 2)
+        self.assertNotIn(('chicken', 'lemon', 'onion'), ranked)
+        # Onion goes with both chicken and garlic, so it stands in for rice
+        self.assertEqual(ranked[('chicken', 'garlic', 'onion')], 1.0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PrewarmCommandTests(TransactionTestCase):
+    def test_generates_uncached_combinations_and_resumes(self):
+        get_recipe_cache().local.clear()
+        get_recipe_cache().shared.clear()
+        ingredient_index._ingredient_index = None
+        user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        for extras in (['beans', 'corn'], ['lemon', 'thyme'], ['pepper', 'tomato']):
+            recipe = make_recipe_data()['recipes'][0]
+            recipe['main_ingredients'] = ['chicken', 'garlic', 'onion', 'rice'] + extras
+            RecipeHistory.from_recipe_dict(recipe, user=user).save()
+
+        def fake_gemini(ingredients, deadline=None, variants=1):
+            return make_recipe_data(name=f"{' '.join(ingredients)} dish"), None
+
+        with tempfile.TemporaryDirectory() as directory:
+            state = os.path.join(directory, 'state', 'prewarm.json')
+            with mock.patch('Chef.main.get_recipe.get_recipe_from_gemini', side_effect=fake_gemini) as gemini:
+                first = io.StringIO()
+                call_command('prewarm_recipe_cache', '--budget', '2', '--concurrency', '1', '--state', state, stdout=first)
+                first_calls = gemini.call_count
+                second = io.StringIO()
+                call_command('prewarm_recipe_cache', '--budget', '2', '--concurrency', '1', '--state', state, stdout=second)
+            self.assertTrue(os.path.exists(state))
+
+        self.assertIn('Added 2 cache entries, 0 failed', first.getvalue())
+        self.assertEqual(first_calls, 2)
+        # Stored without a history entry
+        generated = Recipe.objects.filter(history_entries__isnull=True)
+        self.assertEqual(generated.count(), gemini.call_count)
+        for recipe in generated:
+            self.assertIsNotNone(get_recipe_cache().get(recipe.ingredients_fingerprint))
+        # The second run picks up where the first one stopped
+        generated_sets = [tuple(call.args[0]) for call in gemini.call_args_list]
+        self.assertEqual(len(set(generated_sets)), len(generated_sets))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchEndpointsCommandTests(TransactionTestCase):
+    def test_reports_every_scenario_and_cleans_up(self):
+        get_recipe_cache().local.clear()
+        ingredient_index._ingredient_index = None
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'endpoints.jsonl')
+            for _ in range(2):
+                stdout = io.StringIO()
+                call_command(
+                    'bench_endpoints', '--requests', '3', '--concurrency', '1', '--llm-latency', '0',
+                    '--history-size', '10', '--output', output, stdout=stdout
+                )
+            with open(output) as output_file:
+                runs = [json.loads(line) for line in output_file]
+
+        results = {result['scenario']: result for result in runs[-1]['results']}
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(set(results), {'cache_hit', 'cache_miss', 'fallback', 'history'})
+        for result in results.values():
+            self.assertEqual((result['requests'], result['errors']), (3, 0))
+            self.assertGreater(result['queries_mean'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertIn('Compared with the run of', stdout.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+        self.assertFalse(RecipeHistory.objects.exists())
+        self.assertFalse(Recipe.objects.exists())
+
+
+def metric_value(text, sample):
+    """Value of one sample line of a scrape, 0 when it is missing"""
+    for line in text.splitlines():
+        if line.startswith(sample + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+
+class MetricsTests(TestCase):
+    def test_renders_counters_and_histograms(self):
+        registry = MetricsRegistry()
+        lookups = registry.counter('lookups_total', 'Lookups', ['tier'])
+        latency = registry.histogram('latency_seconds', 'Latency', ['view'], buckets=(0.1, 1))
+        lookups.inc(tier='local')
+        lookups.inc(2, tier='local')
+        latency.observe(0.05, view='a"b')
+        latency.observe(5, view='a"b')
+
+        text = registry.render()
+
+        self.assertIn('# TYPE lookups_total counter', text)
+        self.assertEqual(metric_value(text, 'lookups_total{tier="local"}'), 3)
+        self.assertEqual(metric_value(text, 'latency_seconds_bucket{view="a\\"b",le="0.1"}'), 1)
+        self.assertEqual(metric_value(text, 'latency_seconds_bucket{view="a\\"b",le="1.0"}'), 1)
+        self.assertEqual(metric_value(text, 'latency_seconds_bucket{view="a\\"b",le="+Inf"}'), 2)
+        self.assertEqual(metric_value(text, 'latency_seconds_sum{view="a\\"b"}'), 5.05)
+        with self.assertRaises(ValueError):
+            lookups.inc(view='local')
+
+    def test_multiprocess_files_are_added_up(self):
+        def registry():
+            registry = MetricsRegistry()
+            return registry, registry.counter('calls_total', 'Calls', ['key'])
+
+        first, first_calls = registry()
+        second, second_calls = registry()
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_MULTIPROC_DIR=directory):
+            first_calls.inc(key='key-1')
+            with mock.patch('os.getpid', return_value=1):
+                first.flush()
+            second_calls.inc(key='key-1')
+            second_calls.inc(key='key-2')
+            text = second.render()
+
+        self.assertEqual(metric_value(text, 'calls_total{key="key-1"}'), 2)
+        self.assertEqual(metric_value(text, 'calls_total{key="key-2"}'), 1)
+
+    def test_key_pool_calls_are_recorded_per_key(self):
+        pool = KeyPool(['a'])
+        pool.add_listener(record_key_metrics)
+        before = REGISTRY.render()
+
+        pool.record_success('a', 0.2)
+        pool.record_failure('a', 0.1, rate_limited=True)
+        after = REGISTRY.render()
+
+        for sample in (
+            'llm_call_duration_seconds_count{key="key-1",outcome="success"}',
+            'llm_call_errors_total{key="key-1",kind="rate_limited"}',
+            'llm_circuit_opens_total{key="key-1"}',
+        ):
+            self.assertEqual(metric_value(after, sample) - metric_value(before, sample), 1, sample)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_endpoint_is_disabled_without_a_token(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+        self.assertEqual(self.client.get('/api/metrics/', headers={'authorization': 'Bearer '}).status_code, 404)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_endpoint_exposes_request_and_quota_metrics(self):
+        get_recipe_cache().local.clear()
+        ingredient_index._ingredient_index = None
+        user = User.objects.create_user(username='cook', email='cook@example.com', password='pass12345')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        quota = 'recipe_quota_rejections_total{endpoint="generate"}'
+        requests = 'http_request_duration_seconds_count{view="generate_recipes",method="POST",status="400"}'
+        before = REGISTRY.render()
+
+        MonthlyRecipeUsage.add(user, 30)
+        response = client.post('/api/recipes/generate/', {'ingredients': ['okra', 'lentils', 'dill']}, format='json')
+        unauthorized = self.client.get('/api/metrics/')
+        scrape = self.client.get('/api/metrics/', headers={'authorization': 'Bearer scrape-token'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(unauthorized.status_code, 401)
+        self.assertEqual(scrape['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = scrape.content.decode()
+        self.assertEqual(metric_value(text, quota) - metric_value(before, quota), 1)
+        self.assertEqual(metric_value(text, requests) - metric_value(before, requests), 1)
+        self.assertIn('db_queries_per_request_count{view="generate_recipes"}', text)
@@ -6,7 +6,7 @@ from rest_framework_simplejwt.views import (
 )
 from . import views
 from .auth import register, login, logout, google_auth, forget_password, profile
-from .main import get_recipe, get_history
+from .main import get_recipe, get_recipe_async, get_recipe_batch, get_recipe_stream, get_history, recipe_jobs
 
 router = DefaultRouter()
 # Add your viewsets here when you create them
@@ -16,10 +16,17 @@ urlpatterns = [
     #User data endpoint
     path('user-data/', views.user_view, name='user_data'),
     path('user-data/usage-count/', views.get_user_usage_count, name='user_recipe_count'),
+    #Prometheus metrics endpoint
+    path('metrics/', views.metrics_view, name='metrics'),
     #User recipe history endpoint
     path('user-data/recipe/history/', get_history.get_user_history, name='get_user_history'),
     #Recipe endpoints
     path('recipes/generate/', get_recipe.get_ingredients, name='generate_recipes'),
+    path('recipes/generate/async/', get_recipe_async.get_ingredients_async, name='generate_recipes_async'),
+    path('recipes/generate/stream/', get_recipe_stream.stream_ingredients, name='generate_recipes_stream'),
+    path('recipes/generate/batch/', get_recipe_batch.get_ingredients_batch, name='generate_recipes_batch'),
+    path('recipes/generate/jobs/', recipe_jobs.enqueue_recipe_job, name='enqueue_recipe_job'),
+    path('recipes/generate/jobs/<int:job_id>/', recipe_jobs.get_recipe_job, name='recipe_job_status'),
     #JWT Authentication endpoints
     path('auth/login/', login.login_view, name='login'),
     path('auth/logout/', logout.logout_view, name='logout'),
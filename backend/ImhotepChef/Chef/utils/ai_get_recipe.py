@@ -1,123 +1,54 @@
-import json
+import threading
+import time
 from .config import Gemini_Config
+from .hedging import ahedged_call, hedged_call
+from .llm_backend import get_llm_backend
+from .llm_json import (
+    RecipeSchemaError,
+    parse_json,
+    recipe_batch_response_schema,
+    recipe_response_schema,
+    validate_recipe_data,
+)
+from .metrics import RECIPE_FALLBACKS
+from .micro_batch import MicroBatcher
+from .recipe_prompt import (
+    build_batch_recipe_prompt,
+    build_recipe_prompt,
+    log_request_outcome,
+    log_token_usage,
+    output_token_cap,
+)
 
-def get_recipe_from_gemini(array_of_ingredients):
-    """
-    Get recipe suggestions from Gemini AI based on provided ingredients
-    
-    Args:
-        array_of_ingredients (list): List of ingredients to create recipes from
-        
-    Returns:
-        tuple: (recipe_data, error_message)
+FALLBACK_RECIPE_NAME = "Simple Mixed Ingredients Dish"
+ALL_KEYS_FAILED_MESSAGE = "All API keys failed. Please check the Gemini API configuration."
+DEADLINE_EXCEEDED_MESSAGE = "The AI service did not answer in time."
+
+def parse_recipe_response(response_text):
     """
+    Parse the raw Gemini reply into recipe data
     
-    # Create the prompt for Gemini
-    ingredients_list = ", ".join(array_of_ingredients)
-    print(array_of_ingredients)
-    prompt = f'''
-You are a professional chef AI assistant. Create 1 detailed recipe suggestion using the following ingredients: {ingredients_list}
-
-Requirements:
-1. Use as many of the provided ingredients as possible (at least 3)
-2. Minimize additional ingredients - only add essential ones that are commonly found in most kitchens
-3. Focus on simple, practical cooking techniques
-4. Provide detailed cooking instructions
-5. Include preparation and cooking times
-6. Specify serving size
-7. Add difficulty level (Easy, Medium, Hard)
-
-Please respond with a valid JSON format following this exact structure:
-
-{{
-    "recipes": [
-        {{
-            "id": 1,
-            "name": "Recipe Name",
-            "description": "Brief description of the dish",
-            "difficulty": "Easy/Medium/Hard",
-            "prep_time": "15 minutes",
-            "cook_time": "30 minutes",
-            "total_time": "45 minutes",
-            "servings": 4,
-            "main_ingredients": ["ingredient1", "ingredient2", "ingredient3"],
-            "additional_ingredients": [
-                {{
-                    "name": "ingredient name",
-                    "amount": "1 cup",
-                    "optional": false
-                }}
-            ],
-            "instructions": [
-                "Step 1: Detailed instruction",
-                "Step 2: Detailed instruction",
-                "Step 3: Detailed instruction"
-            ],
-            "tips": [
-                "Helpful cooking tip 1",
-                "Helpful cooking tip 2"
-            ],
-            "nutrition": {{
-                "calories": 350,
-                "protein": "25g",
-                "carbs": "30g",
-                "fat": "15g"
-            }}
-        }}
-    ],
-    "success": true,
-    "message": "Recipe generated successfully"
-}}
-
-IMPORTANT: Keep additional ingredients to a minimum (maximum 5 items). Only include basic pantry staples like salt, pepper, oil, garlic, onion if absolutely necessary. Make sure the JSON is properly formatted and valid.
-'''
-
-    error_message = None
-    
-    # Try each API key in sequence
-    for key_index in range(len(Gemini_Config.API_KEYS)):
-        try:
-            print(f"Trying API key {key_index+1} of {len(Gemini_Config.API_KEYS)}...")
-            
-            # Set the current API key index in Gemini_Config
-            Gemini_Config._current_key_index = key_index
-            
-            # Get a new model instance with the current key
-            model = Gemini_Config.get_model()
-            chat_session = model.start_chat(history=[])
-            
-            # Send the request
-            response = chat_session.send_message(prompt)
-            response_text = response.text.replace('```json', '').replace('```', '').strip()
-            
-            # Parse the JSON response
-            recipe_data = json.loads(response_text)
-            
-            # Validate the response structure
-            if "recipes" in recipe_data and len(recipe_data["recipes"]) > 0:
-                print(f"Success with API key {key_index+1}")
-                return recipe_data, None
-            else:
-                raise ValueError("Invalid response structure from Gemini API")
-            
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error with API key {key_index+1}")
-            continue
-            
-        except Exception as e:
-            print(f"Error with API key {key_index+1}")
-            continue
-    
-    error_message = "All API keys failed. Please check the Gemini API configuration."
+    Prose around the JSON, trailing commas, smart quotes and truncated replies
+    are repaired instead of costing another API call.
     
-    print(f"All API keys failed")
+    Raises:
+        json.JSONDecodeError: No JSON could be recovered from the reply
+        ValueError: The reply has no usable recipes
+    """
+    recipe_data, repairs = parse_json(response_text)
+    if repairs:
+        print(f"Repaired Gemini reply: {', '.join(sorted(repairs))}")
     
-    # Return fallback data
+    # Validate the response structure
+    return validate_recipe_data(recipe_data)
+
+def build_fallback_data(array_of_ingredients):
+    """Generic recipe returned when every API key failed"""
     fallback_data = {
         "recipes": [
             {
                 "id": 1,
-                "name": "Simple Mixed Ingredients Dish",
+                "name": FALLBACK_RECIPE_NAME,
                 "description": f"A basic recipe using {', '.join(array_of_ingredients[:3])}",
                 "difficulty": "Easy",
                 "prep_time": "10 minutes",
@@ -153,4 +84,380 @@ IMPORTANT: Keep additional ingredients to a minimum (maximum 5 items). Only incl
         "message": "AI service unavailable. Showing fallback recipe."
     }
     
-    return fallback_data, error_message
+    return fallback_data
+
+def request_options(deadline):
+    """Per-call options giving the call only the time left in the request's budget"""
+    if deadline is None:
+        return None
+    return {'timeout': deadline.remaining()}
+
+def generation_config(max_output_tokens, response_schema=None):
+    """Per-call generation settings, merged over the model's"""
+    overrides = {}
+    if max_output_tokens is not None:
+        overrides['max_output_tokens'] = max_output_tokens
+    if response_schema is not None:
+        overrides['response_schema'] = response_schema
+    return overrides or None
+
+def out_of_time_result(array_of_ingredients, attempts=0, parse_failures=0):
+    print("Recipe deadline exceeded, using fallback")
+    RECIPE_FALLBACKS.inc(reason='deadline')
+    log_request_outcome(attempts, parse_failures, succeeded=False)
+    return build_fallback_data(array_of_ingredients), DEADLINE_EXCEEDED_MESSAGE
+
+def all_keys_failed_result(array_of_ingredients, attempts, parse_failures):
+    print("All API keys failed")
+    RECIPE_FALLBACKS.inc(reason='all_keys_failed')
+    log_request_outcome(attempts, parse_failures, succeeded=False)
+    return build_fallback_data(array_of_ingredients), ALL_KEYS_FAILED_MESSAGE
+
+def request_recipe_text(api_key, prompt, deadline=None, max_output_tokens=None, response_schema=None):
+    """
+    Send the prompt with one API key, recording the outcome in the key pool
+    
+    Args:
+        max_output_tokens (int): Optional, overrides the model's output token cap
+        response_schema (dict): Optional, overrides the model's response schema
+    
+    Returns:
+        str: The raw reply
+    """
+    key_pool = Gemini_Config.get_key_pool()
+    started_at = time.monotonic()
+    try:
+        response = get_llm_backend().generate(
+            api_key,
+            prompt,
+            generation_config=generation_config(max_output_tokens, response_schema),
+            request_options=request_options(deadline)
+        )
+        response_text = response.text
+    except Exception as e:
+        Gemini_Config.record_failure(api_key, time.monotonic() - started_at, e)
+        raise
+    
+    # The key answered, a bad reply says nothing about its health
+    latency = time.monotonic() - started_at
+    key_pool.record_success(api_key, latency)
+    Gemini_Config.get_hedge_policy().record_latency(latency)
+    log_token_usage(prompt, response_text, getattr(response, 'usage_metadata', None), latency, max_output_tokens)
+    return response_text
+
+async def arequest_recipe_text(api_key, prompt, deadline=None, max_output_tokens=None):
+    """Async version of request_recipe_text"""
+    key_pool = Gemini_Config.get_key_pool()
+    started_at = time.monotonic()
+    try:
+        response = await get_llm_backend().agenerate(
+            api_key,
+            prompt,
+            generation_config=generation_config(max_output_tokens),
+            request_options=request_options(deadline)
+        )
+        response_text = response.text
+    except Exception as e:
+        Gemini_Config.record_failure(api_key, time.monotonic() - started_at, e)
+        raise
+    
+    latency = time.monotonic() - started_at
+    key_pool.record_success(api_key, latency)
+    Gemini_Config.get_hedge_policy().record_latency(latency)
+    log_token_usage(prompt, response_text, getattr(response, 'usage_metadata', None), latency, max_output_tokens)
+    return response_text
+
+def split_batch_response(response_text, count):
+    """
+    Split the reply to a batch prompt into one recipe_data per request
+    
+    Returns:
+        list: recipe_data in request order, None for a request without a usable recipe
+    """
+    results = [None] * count
+    try:
+        batch_data, repairs = parse_json(response_text)
+    except ValueError:
+        print("JSON parsing error in batched Gemini reply")
+        return results
+    if repairs:
+        print(f"Repaired batched Gemini reply: {', '.join(sorted(repairs))}")
+    
+    entries = batch_data.get('results') if isinstance(batch_data, dict) else None
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        number = entry.get('request')
+        # bool is an int subclass, but not a request number
+        if not isinstance(number, int) or isinstance(number, bool) or not 1 <= number <= count or results[number - 1]:
+            continue
+        try:
+            results[number - 1] = validate_recipe_data({
+                'recipes': [entry.get('recipe')],
+                'success': True,
+                'message': 'Recipe generated successfully'
+            })
+        except RecipeSchemaError as schema_error:
+            print(f"Batched recipe {number} is unusable: {schema_error}")
+    return results
+
+def request_recipe_batch(items):
+    """
+    Generate the recipes of several requests with one Gemini call
+    
+    Used by the micro-batcher. One attempt on the healthiest key, requests
+    without a usable recipe go back to the usual per-request path, which
+    retries on the other keys.
+    
+    Args:
+        items (list): (array_of_ingredients, deadline) tuples
+    
+    Returns:
+        list: recipe_data in item order, None for a request that needs its own call
+    """
+    # A lone request is sent the usual way
+    if len(items) < 2:
+        return [None] * len(items)
+    
+    deadlines = [deadline for _, deadline in items if deadline is not None]
+    deadline = min(deadlines, key=lambda deadline: deadline.remaining()) if deadlines else None
+    if deadline is not None and not deadline.allows_attempt():
+        return [None] * len(items)
+    
+    key_pool = Gemini_Config.get_key_pool()
+    api_key = next(key_pool.candidates(), None)
+    if api_key is None:
+        return [None] * len(items)
+    
+    ingredient_sets = [array_of_ingredients for array_of_ingredients, _ in items]
+    max_output_tokens = min(
+        sum(output_token_cap(array_of_ingredients) for array_of_ingredients in ingredient_sets),
+        Gemini_Config.MAX_OUTPUT_TOKENS
+    )
+    response_schema = recipe_batch_response_schema(len(items)) if Gemini_Config.STRUCTURED_OUTPUT else None
+    print(f"Sending {len(items)} requests to Gemini {key_pool.label(api_key)} in one call")
+    response_text = request_recipe_text(
+        api_key,
+        build_batch_recipe_prompt(ingredient_sets),
+        deadline,
+        max_output_tokens,
+        response_schema
+    )
+    return split_batch_response(response_text, len(items))
+
+_recipe_batcher = None
+_recipe_batcher_lock = threading.Lock()
+
+def get_recipe_batcher():
+    """Get the process-wide micro-batcher of Gemini calls, its stats() has the batch sizes"""
+    global _recipe_batcher
+    if _recipe_batcher is None:
+        with _recipe_batcher_lock:
+            if _recipe_batcher is None:
+                _recipe_batcher = MicroBatcher(
+                    request_recipe_batch,
+                    window=Gemini_Config.MICRO_BATCH_WINDOW,
+                    max_size=Gemini_Config.MICRO_BATCH_MAX_SIZE
+                )
+    return _recipe_batcher
+
+def get_recipe_from_gemini(array_of_ingredients, deadline=None, variants=1):
+    """
+    Get recipe suggestions from Gemini AI based on provided ingredients
+    
+    With Gemini_Config.HEDGE_ENABLED, a slow call is hedged with a second
+    call on the next key and the first reply wins. With
+    Gemini_Config.MICRO_BATCH_ENABLED, a single recipe request first joins
+    a batch of concurrent requests sent as one call, and is only sent on
+    its own when that gave no recipe for it.
+    
+    Args:
+        array_of_ingredients (list): List of ingredients to create recipes from
+        deadline (Deadline): Optional, every attempt gets only the remaining time
+        variants (int): Different recipes to ask for in the one call
+        
+    Returns:
+        tuple: (recipe_data, error_message)
+    """
+    
+    if Gemini_Config.MICRO_BATCH_ENABLED and variants == 1:
+        timeout = deadline.remaining() if deadline is not None else None
+        recipe_data = get_recipe_batcher().submit((array_of_ingredients, deadline), timeout)
+        if recipe_data is not None:
+            log_request_outcome(1, 0, succeeded=True)
+            return recipe_data, None
+    
+    # Create the prompt for Gemini
+    print(array_of_ingredients)
+    prompt = build_recipe_prompt(array_of_ingredients, variants=variants)
+    max_output_tokens = output_token_cap(array_of_ingredients, variants=variants)
+    # The model's own schema asks for a single recipe
+    response_schema = recipe_response_schema(variants) if Gemini_Config.STRUCTURED_OUTPUT and variants > 1 else None
+    key_pool = Gemini_Config.get_key_pool()
+    candidates = key_pool.candidates()
+    attempts = parse_failures = 0
+    
+    # Try the healthiest API keys first
+    for api_key in candidates:
+        if deadline is not None and not deadline.allows_attempt():
+            return out_of_time_result(array_of_ingredients, attempts, parse_failures)
+        
+        attempts += 1
+        key_label = key_pool.label(api_key)
+        try:
+            print(f"Trying Gemini {key_label}...")
+            if Gemini_Config.HEDGE_ENABLED:
+                api_key, response_text = hedged_call(
+                    lambda key: request_recipe_text(key, prompt, deadline, max_output_tokens, response_schema),
+                    api_key,
+                    lambda: next(candidates, None),
+                    Gemini_Config.get_hedge_policy(),
+                    Gemini_Config.get_hedge_pool()
+                )
+                key_label = key_pool.label(api_key)
+            else:
+                response_text = request_recipe_text(api_key, prompt, deadline, max_output_tokens, response_schema)
+            
+        except Exception as e:
+            if Gemini_Config.is_timeout(e):
+                print(f"Timeout with Gemini {key_label}")
+            else:
+                print(f"Error with Gemini {key_label}")
+            continue
+        
+        try:
+            recipe_data = parse_recipe_response(response_text)
+            print(f"Success with Gemini {key_label}")
+            log_request_outcome(attempts, parse_failures, succeeded=True)
+            return recipe_data, None
+        except ValueError:
+            parse_failures += 1
+            print(f"JSON parsing error with Gemini {key_label}")
+    
+    if deadline is not None and not deadline.allows_attempt():
+        return out_of_time_result(array_of_ingredients, attempts, parse_failures)
+    return all_keys_failed_result(array_of_ingredients, attempts, parse_failures)
+
+async def aget_recipe_from_gemini(array_of_ingredients, deadline=None):
+    """
+    Async version of get_recipe_from_gemini
+    
+    Awaits Gemini through the library's async API, so the event loop can serve
+    other requests while the model is generating.
+    
+    Returns:
+        tuple: (recipe_data, error_message)
+    """
+    prompt = build_recipe_prompt(array_of_ingredients)
+    max_output_tokens = output_token_cap(array_of_ingredients)
+    key_pool = Gemini_Config.get_key_pool()
+    candidates = key_pool.candidates()
+    attempts = parse_failures = 0
+    
+    for api_key in candidates:
+        if deadline is not None and not deadline.allows_attempt():
+            return out_of_time_result(array_of_ingredients, attempts, parse_failures)
+        
+        attempts += 1
+        key_label = key_pool.label(api_key)
+        try:
+            print(f"Trying Gemini {key_label}...")
+            if Gemini_Config.HEDGE_ENABLED:
+                api_key, response_text = await ahedged_call(
+                    lambda key: arequest_recipe_text(key, prompt, deadline, max_output_tokens),
+                    api_key,
+                    lambda: next(candidates, None),
+                    Gemini_Config.get_hedge_policy()
+                )
+                key_label = key_pool.label(api_key)
+            else:
+                response_text = await arequest_recipe_text(api_key, prompt, deadline, max_output_tokens)
+            
+        except Exception as e:
+            if Gemini_Config.is_timeout(e):
+                print(f"Timeout with Gemini {key_label}")
+            else:
+                print(f"Error with Gemini {key_label}")
+            continue
+        
+        try:
+            recipe_data = parse_recipe_response(response_text)
+            print(f"Success with Gemini {key_label}")
+            log_request_outcome(attempts, parse_failures, succeeded=True)
+            return recipe_data, None
+        except ValueError:
+            parse_failures += 1
+            print(f"JSON parsing error with Gemini {key_label}")
+    
+    if deadline is not None and not deadline.allows_attempt():
+        return out_of_time_result(array_of_ingredients, attempts, parse_failures)
+    return all_keys_failed_result(array_of_ingredients, attempts, parse_failures)
+
+def stream_recipe_from_gemini(array_of_ingredients, deadline=None):
+    """
+    Streaming version of get_recipe_from_gemini
+    
+    Yields:
+        tuple: (event, payload), one of
+            ('delta', text): the next piece of the reply
+            ('retry', None): the reply failed, text received so far must be discarded
+            ('result', (recipe_data, error_message)): the final result, always last
+    """
+    prompt = build_recipe_prompt(array_of_ingredients)
+    max_output_tokens = output_token_cap(array_of_ingredients)
+    key_pool = Gemini_Config.get_key_pool()
+    attempts = parse_failures = 0
+    
+    for api_key in key_pool.candidates():
+        if deadline is not None and not deadline.allows_attempt():
+            yield 'result', out_of_time_result(array_of_ingredients, attempts, parse_failures)
+            return
+        
+        attempts += 1
+        key_label = key_pool.label(api_key)
+        started_at = time.monotonic()
+        response_text = ''
+        usage_metadata = None
+        try:
+            print(f"Trying Gemini {key_label}...")
+            response = get_llm_backend().stream(
+                api_key,
+                prompt,
+                generation_config=generation_config(max_output_tokens),
+                request_options=request_options(deadline)
+            )
+            for chunk in response:
+                # Usage is reported on the last chunk
+                usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+                if chunk.text:
+                    response_text += chunk.text
+                    yield 'delta', chunk.text
+            
+        except Exception as e:
+            Gemini_Config.record_failure(api_key, time.monotonic() - started_at, e)
+            if Gemini_Config.is_timeout(e):
+                print(f"Timeout with Gemini {key_label}")
+            else:
+                print(f"Error with Gemini {key_label}")
+        
+        else:
+            latency = time.monotonic() - started_at
+            key_pool.record_success(api_key, latency)
+            log_token_usage(prompt, response_text, usage_metadata, latency, max_output_tokens)
+            try:
+                recipe_data = parse_recipe_response(response_text)
+                print(f"Success with Gemini {key_label}")
+                log_request_outcome(attempts, parse_failures, succeeded=True)
+                yield 'result', (recipe_data, None)
+                return
+            except ValueError:
+                parse_failures += 1
+                print(f"JSON parsing error with Gemini {key_label}")
+        
+        if response_text:
+            yield 'retry', None
+    
+    if deadline is not None and not deadline.allows_attempt():
+        yield 'result', out_of_time_result(array_of_ingredients, attempts, parse_failures)
+        return
+    yield 'result', all_keys_failed_result(array_of_ingredients, attempts, parse_failures)
@@ -1,5 +1,15 @@
-import google.generativeai as genai
+import asyncio
+import threading
+import weakref
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import content_types, generation_types, safety_types
 from decouple import config
+from .hedging import HedgePolicy, HedgePool
+from .key_pool import KeyPool, log_circuit_changes
+from .llm_backend import LLMRateLimitError, get_llm_backend
+from .llm_json import recipe_response_schema
+from .metrics import record_key_metrics
 
 class Gemini_Config:
     # Load API keys from environment variables
@@ -11,24 +21,139 @@ class Gemini_Config:
     # Filter out empty keys
     API_KEYS = [key for key in API_KEYS if key]
     
-    # Current key index for rotation
-    _current_key_index = 0
+    # Circuit breaker for failing or rate-limited keys
+    KEY_FAILURE_THRESHOLD = config('GEMINI_KEY_FAILURE_THRESHOLD', default=3, cast=int)
+    KEY_COOLDOWN = config('GEMINI_KEY_COOLDOWN', default=30, cast=float)
+    KEY_MAX_COOLDOWN = config('GEMINI_KEY_MAX_COOLDOWN', default=600, cast=float)
+    KEY_EWMA_ALPHA = config('GEMINI_KEY_EWMA_ALPHA', default=0.3, cast=float)
+    
+    # Hedging: when a call is slower than HEDGE_PERCENTILE of recent calls (and at
+    # least HEDGE_MIN_DELAY seconds), send a second one on another key; the first reply
+    # wins. At most HEDGE_BUDGET extra calls per call, so quota use can't double, and
+    # HEDGE_MAX_IN_FLIGHT hedged calls running at once (beyond that calls aren't hedged)
+    HEDGE_ENABLED = config('GEMINI_HEDGE_ENABLED', default=False, cast=bool)
+    HEDGE_PERCENTILE = config('GEMINI_HEDGE_PERCENTILE', default=95, cast=float)
+    HEDGE_MIN_DELAY = config('GEMINI_HEDGE_MIN_DELAY', default=2, cast=float)
+    HEDGE_BUDGET = config('GEMINI_HEDGE_BUDGET', default=0.1, cast=float)
+    HEDGE_MAX_IN_FLIGHT = config('GEMINI_HEDGE_MAX_IN_FLIGHT', default=8, cast=int)
+    
+    # Micro-batching: concurrent cache misses arriving within MICRO_BATCH_WINDOW
+    # seconds share one multi-recipe call, up to MICRO_BATCH_MAX_SIZE requests
+    MICRO_BATCH_ENABLED = config('GEMINI_MICRO_BATCH_ENABLED', default=False, cast=bool)
+    MICRO_BATCH_WINDOW = config('GEMINI_MICRO_BATCH_WINDOW', default=0.05, cast=float)
+    MICRO_BATCH_MAX_SIZE = config('GEMINI_MICRO_BATCH_MAX_SIZE', default=4, cast=int)
+    
+    # Structured output: replies are constrained to the recipe JSON schema, so the
+    # prompt doesn't need to describe the format
+    STRUCTURED_OUTPUT = config('GEMINI_STRUCTURED_OUTPUT', default=True, cast=bool)
+    
+    # Prompt template (see recipe_prompt.PROMPT_TEMPLATES, empty picks one for the
+    # output mode) and the ceiling of the per-call output token cap. Set
+    # RECORD_RESPONSES_PATH to append every call to a JSONL file for
+    # compare_prompt_templates
+    PROMPT_TEMPLATE = config('GEMINI_PROMPT_TEMPLATE', default='')
+    MAX_OUTPUT_TOKENS = config('GEMINI_MAX_OUTPUT_TOKENS', default=8192, cast=int)
+    RECORD_RESPONSES_PATH = config('GEMINI_RECORD_RESPONSES_PATH', default='')
+    
+    _key_pool = None
+    _key_pool_lock = threading.Lock()
+    _hedge_policy = None
+    _hedge_pool = None
+    
+    @classmethod
+    def get_key_pool(cls):
+        """Get the process-wide key pool over the LLM backend's keys (API_KEYS for Gemini), rebuilt if they changed"""
+        keys = get_llm_backend().api_keys()
+        pool = cls._key_pool
+        if pool is None or pool.keys != keys:
+            with cls._key_pool_lock:
+                pool = cls._key_pool
+                if pool is None or pool.keys != keys:
+                    pool = KeyPool(
+                        keys,
+                        failure_threshold=cls.KEY_FAILURE_THRESHOLD,
+                        cooldown=cls.KEY_COOLDOWN,
+                        max_cooldown=cls.KEY_MAX_COOLDOWN,
+                        alpha=cls.KEY_EWMA_ALPHA,
+                    )
+                    pool.add_listener(log_circuit_changes)
+                    pool.add_listener(record_key_metrics)
+                    cls._key_pool = pool
+        return pool
+    
+    @classmethod
+    def get_hedge_policy(cls):
+        """Get the process-wide hedge policy, its snapshot() has the hedge metrics"""
+        if cls._hedge_policy is None:
+            with cls._key_pool_lock:
+                if cls._hedge_policy is None:
+                    cls._hedge_policy = HedgePolicy(
+                        percentile=cls.HEDGE_PERCENTILE,
+                        min_delay=cls.HEDGE_MIN_DELAY,
+                        budget=cls.HEDGE_BUDGET,
+                    )
+        return cls._hedge_policy
+    
+    @classmethod
+    def get_hedge_pool(cls):
+        """Get the process-wide thread pool hedged calls run on"""
+        if cls._hedge_pool is None:
+            with cls._key_pool_lock:
+                if cls._hedge_pool is None:
+                    cls._hedge_pool = HedgePool(max_in_flight=cls.HEDGE_MAX_IN_FLIGHT)
+        return cls._hedge_pool
+    
+    @staticmethod
+    def is_rate_limited(error):
+        """Whether an API error means the key ran out of quota (HTTP 429)"""
+        return isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests, LLMRateLimitError))
+    
+    @staticmethod
+    def is_timeout(error):
+        """Whether an API error means the call ran out of time"""
+        return isinstance(error, (google_exceptions.DeadlineExceeded, TimeoutError))
     
     @classmethod
-    def get_model(cls):
-        """Get a configured Gemini model with the current API key"""
-        if not cls.API_KEYS:
+    def record_failure(cls, api_key, latency, error):
+        """Record a failed call in the key pool, telling rate limits and timeouts apart"""
+        cls.get_key_pool().record_failure(
+            api_key,
+            latency,
+            rate_limited=cls.is_rate_limited(error),
+            timed_out=cls.is_timeout(error)
+        )
+    
+    # One model per API key, created once per process
+    _models = {}
+    _models_lock = threading.Lock()
+    
+    @classmethod
+    def get_model(cls, api_key):
+        """Get the Gemini model for an API key, reused across calls and threads"""
+        if not api_key:
             raise ValueError("No Gemini API keys configured")
         
-        current_key = cls.API_KEYS[cls._current_key_index]
-        genai.configure(api_key=current_key)
-        
+        model = cls._models.get(api_key)
+        if model is None:
+            with cls._models_lock:
+                model = cls._models.get(api_key)
+                if model is None:
+                    model = cls._build_model(api_key)
+                    cls._models[api_key] = model
+        return model
+    
+    @classmethod
+    def _build_model(cls, api_key):
+        """Build the model of an API key"""
         generation_config = {
             "temperature": 0.7,
             "top_p": 0.95,
             "top_k": 64,
-            "max_output_tokens": 8192,
+            "max_output_tokens": cls.MAX_OUTPUT_TOKENS,
         }
+        if cls.STRUCTURED_OUTPUT:
+            generation_config["response_mime_type"] = "application/json"
+            generation_config["response_schema"] = recipe_response_schema()
         
         safety_settings = [
             {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
@@ -37,10 +162,66 @@ class Gemini_Config:
             {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
         ]
         
-        model = genai.GenerativeModel(
+        return GeminiModel(
+            api_key,
             model_name="gemini-2.0-flash",
             generation_config=generation_config,
             safety_settings=safety_settings
         )
-        
-        return model
+
+class GeminiModel:
+    """
+    Gemini model bound to one API key, with the generate_content interface of genai.GenerativeModel
+    
+    genai.configure() sets one key for the whole process, so each model has its
+    own clients, made with the key in client_options. grpc-asyncio clients belong
+    to the event loop they are made in, so the async client is made on first use
+    in each loop, never when the model is built (that fails in threads without a loop).
+    """
+    
+    def __init__(self, api_key, model_name, generation_config=None, safety_settings=None):
+        self.model_name = model_name if "/" in model_name else f"models/{model_name}"
+        self.generation_config = generation_types.to_generation_config_dict(generation_config)
+        self.safety_settings = safety_types.to_easy_safety_dict(safety_settings)
+        self.client_options = {"api_key": api_key}
+        self.client = glm.GenerativeServiceClient(client_options=self.client_options)
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_clients_lock = threading.Lock()
+    
+    def async_client(self):
+        """The async client of the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = glm.GenerativeServiceAsyncClient(client_options=self.client_options)
+                self._async_clients[loop] = client
+        return client
+    
+    def build_request(self, prompt, generation_config=None):
+        """The request for a prompt, with the per-call generation settings merged over the model's"""
+        merged_config = dict(self.generation_config)
+        merged_config.update(generation_types.to_generation_config_dict(generation_config))
+        return glm.GenerateContentRequest(
+            model=self.model_name,
+            contents=content_types.to_contents(prompt),
+            generation_config=merged_config,
+            safety_settings=safety_types.normalize_safety_settings(self.safety_settings)
+        )
+    
+    def generate_content(self, prompt, stream=False, generation_config=None, request_options=None):
+        """Send a prompt, returns the response, or an iterable of chunks if stream is set"""
+        request = self.build_request(prompt, generation_config)
+        request_options = request_options or {}
+        if stream:
+            with generation_types.rewrite_stream_error():
+                iterator = self.client.stream_generate_content(request, **request_options)
+            return generation_types.GenerateContentResponse.from_iterator(iterator)
+        response = self.client.generate_content(request, **request_options)
+        return generation_types.GenerateContentResponse.from_response(response)
+    
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        """Async version of generate_content, without streaming"""
+        request = self.build_request(prompt, generation_config)
+        response = await self.async_client().generate_content(request, **(request_options or {}))
+        return generation_types.AsyncGenerateContentResponse.from_response(response)
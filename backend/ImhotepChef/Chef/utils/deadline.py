@@ -0,0 +1,52 @@
+import time
+from contextlib import contextmanager
+from django.db import connection, transaction
+
+# Not worth starting a Gemini call with less time than this left
+MIN_ATTEMPT_SECONDS = 1.0
+
+
+class Deadline:
+    """
+    Time budget of one request, carried through every step that can block
+
+    Each Gemini attempt, lock wait and database save gets only what is left,
+    so a slow upstream can't hold a worker past the endpoint's deadline.
+    """
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.seconds = seconds
+        self._clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self):
+        """Seconds left, never negative"""
+        return max(self.expires_at - self._clock(), 0.0)
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows_attempt(self):
+        """Whether there is enough time left for another upstream call"""
+        return self.remaining() >= MIN_ATTEMPT_SECONDS
+
+
+@contextmanager
+def statement_timeout(deadline, minimum=1.0):
+    """
+    Bound the queries in the block by the remaining budget (PostgreSQL only)
+
+    The block runs in a transaction, so the timeout only applies to it.
+    """
+    if deadline is None or connection.vendor != 'postgresql':
+        yield
+        return
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('statement_timeout', %s, true)",
+                [str(int(max(deadline.remaining(), minimum) * 1000))]
+            )
+        yield
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from django.conf import settings
+from .llm_backend import LLMBackend, LLMBackendError, LLMRateLimitError
+from .recipe_prompt import CHARS_PER_TOKEN, estimate_tokens
+
+_INGREDIENTS_RE = re.compile(r'ingredients: (.+)$', re.MULTILINE)
+_VARIANTS_RE = re.compile(r'Create (\d+) different recipes')
+_REQUEST_LINE_RE = re.compile(r'^(\d+)\. (.+)$', re.MULTILINE)
+
+_STYLES = ['Rustic', 'Herbed', 'Golden', 'Spiced', 'Creamy', 'Smoky', 'Zesty', 'Garden']
+_DISHES = ['Skillet', 'Stew', 'Bake', 'Stir-Fry', 'Bowl', 'Salad', 'Soup', 'Gratin']
+_DIFFICULTIES = ['Easy', 'Medium', 'Hard']
+_STAPLES = ['salt', 'black pepper', 'olive oil', 'garlic', 'butter']
+# Stream chunks are about this many characters, like a few model tokens
+_STREAM_CHUNK_SIZE = 64
+
+
+def fake_recipe(ingredients, number=0):
+    """
+    A valid recipe for the ingredients, the same for the same ingredients and number
+
+    Returns:
+        dict: Recipe in the format of the recipe API
+    """
+    ingredients = ingredients or ['mixed vegetables']
+    rng = random.Random(hashlib.sha256(','.join(ingredients).encode()).digest())
+    style, dish, difficulty = rng.randrange(len(_STYLES)), rng.randrange(len(_DISHES)), rng.randrange(3)
+    prep, cook = rng.choice([5, 10, 15, 20]), rng.choice([10, 20, 30, 45])
+    main = ingredients[0].title()
+    # Variants of one reply differ in name and difficulty
+    return {
+        'name': f"{_STYLES[(style + number) % len(_STYLES)]} {main} {_DISHES[(dish + number) % len(_DISHES)]}"[:200],
+        'description': f"A simple dish of {', '.join(ingredients)}.",
+        'difficulty': _DIFFICULTIES[(difficulty + number) % 3],
+        'prep_time': f'{prep} minutes',
+        'cook_time': f'{cook} minutes',
+        'total_time': f'{prep + cook} minutes',
+        'servings': rng.choice([2, 4, 6]),
+        'main_ingredients': list(ingredients),
+        'additional_ingredients': [
+            {'name': staple, 'amount': 'to taste', 'optional': False}
+            for staple in rng.sample(_STAPLES, 2)
+        ],
+        'instructions': [
+            f"Prepare the {', '.join(ingredients)}.",
+            f"Cook the {ingredients[0]} for {cook // 2} minutes.",
+            'Add the remaining ingredients and cook until done.',
+            'Season and serve.',
+        ],
+        'tips': ['Taste and adjust the seasoning before serving.'],
+        'nutrition': {
+            'calories': rng.randrange(250, 700, 10),
+            'protein': f'{rng.randrange(5, 40)}g',
+            'carbs': f'{rng.randrange(10, 80)}g',
+            'fat': f'{rng.randrange(5, 35)}g',
+        },
+    }
+
+
+def fake_reply(prompt):
+    """
+    The JSON reply a model would give to a recipe prompt of recipe_prompt
+
+    Batch prompts get one result per numbered request, single prompts as
+    many recipes as they ask for.
+    """
+    requests = _REQUEST_LINE_RE.findall(prompt) if 'numbered request' in prompt else []
+    if requests:
+        return json.dumps({'results': [
+            {'request': int(number), 'recipe': fake_recipe(ingredients.split(', '))}
+            for number, ingredients in requests
+        ]})
+
+    match = _INGREDIENTS_RE.search(prompt)
+    ingredients = match.group(1).strip().split(', ') if match else []
+    variants = _VARIANTS_RE.search(prompt)
+    count = int(variants.group(1)) if variants else 1
+    return json.dumps({
+        'recipes': [fake_recipe(ingredients, number) for number in range(count)],
+        'success': True,
+        'message': 'Recipe generated successfully'
+    })
+
+
+class FakeBackend(LLMBackend):
+    """
+    Local stand-in for Gemini, for load tests and development without keys
+
+    Replies are valid recipes for the ingredients in the prompt, the same
+    for the same prompt. Latency, failures and truncation are drawn from a
+    seeded random stream, so a run with the same seed and call order
+    repeats exactly.
+
+    Args:
+        latency (float): Typical call latency in seconds
+        distribution (str): 'fixed', 'uniform' (latency +/- spread of it) or
+            'lognormal' (median latency, sigma spread)
+        error_rate (float): Share of calls that fail with LLMBackendError
+        rate_limit_rate (float): Share of calls that fail with LLMRateLimitError
+        truncate_rate (float): Share of replies cut off part way
+        keys (int): Fake API keys handed to the key pool
+    """
+
+    name = 'fake'
+    DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+    def __init__(self, latency=0.5, distribution='lognormal', spread=0.5, error_rate=0.0,
+                 rate_limit_rate=0.0, truncate_rate=0.0, keys=2, seed=0, sleep=time.sleep):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution!r}, expected one of {', '.join(self.DISTRIBUTIONS)}")
+        self.latency = latency
+        self.distribution = distribution
+        self.spread = spread
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.truncate_rate = truncate_rate
+        self.keys = [f'fake-key-{number}' for number in range(1, keys + 1)]
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            latency=settings.FAKE_LLM_LATENCY,
+            distribution=settings.FAKE_LLM_LATENCY_DISTRIBUTION,
+            spread=settings.FAKE_LLM_LATENCY_SPREAD,
+            error_rate=settings.FAKE_LLM_ERROR_RATE,
+            rate_limit_rate=settings.FAKE_LLM_RATE_LIMIT_RATE,
+            truncate_rate=settings.FAKE_LLM_TRUNCATE_RATE,
+            keys=settings.FAKE_LLM_KEYS,
+            seed=settings.FAKE_LLM_SEED,
+        )
+
+    def api_keys(self):
+        return self.keys
+
+    def generate(self, api_key, prompt, generation_config=None, request_options=None):
+        outcome, latency, text = self._plan(prompt, generation_config, request_options)
+        self._sleep(latency)
+        return self._finish(outcome, prompt, text)
+
+    async def agenerate(self, api_key, prompt, generation_config=None, request_options=None):
+        outcome, latency, text = self._plan(prompt, generation_config, request_options)
+        await asyncio.sleep(latency)
+        return self._finish(outcome, prompt, text)
+
+    def stream(self, api_key, prompt, generation_config=None, request_options=None):
+        outcome, latency, text = self._plan(prompt, generation_config, request_options)
+        if outcome != 'ok':
+            self._sleep(latency)
+            self._finish(outcome, prompt, text)
+        return self._chunks(prompt, text, latency)
+
+    def _chunks(self, prompt, text, latency):
+        chunks = [text[start:start + _STREAM_CHUNK_SIZE] for start in range(0, len(text), _STREAM_CHUNK_SIZE)] or ['']
+        for index, chunk in enumerate(chunks):
+            self._sleep(latency / len(chunks))
+            # Usage is reported on the last chunk
+            usage = self._usage(prompt, text) if index == len(chunks) - 1 else None
+            yield SimpleNamespace(text=chunk, usage_metadata=usage)
+
+    def _plan(self, prompt, generation_config, request_options):
+        """Draw the outcome of a call: ('ok' | 'error' | 'rate_limited' | 'timeout', latency, reply text)"""
+        with self._lock:
+            self.calls += 1
+            latency = self._draw_latency()
+            failure = self._random.random()
+            truncated = self._random.random() < self.truncate_rate
+            cut = self._random.uniform(0.3, 0.9)
+
+        text = fake_reply(prompt)
+        max_output_tokens = (generation_config or {}).get('max_output_tokens')
+        if max_output_tokens and estimate_tokens(text) > max_output_tokens:
+            text = text[:max_output_tokens * CHARS_PER_TOKEN]
+        elif truncated:
+            text = text[:int(len(text) * cut)]
+
+        timeout = (request_options or {}).get('timeout')
+        if timeout is not None and latency > timeout:
+            return 'timeout', timeout, text
+        if failure < self.rate_limit_rate:
+            # Quota errors come back fast
+            return 'rate_limited', latency * 0.1, text
+        if failure < self.rate_limit_rate + self.error_rate:
+            return 'error', latency, text
+        return 'ok', latency, text
+
+    def _draw_latency(self):
+        if self.distribution == 'fixed':
+            return self.latency
+        if self.distribution == 'uniform':
+            return max(0.0, self._random.uniform(self.latency * (1 - self.spread), self.latency * (1 + self.spread)))
+        return self._random.lognormvariate(math.log(self.latency), self.spread) if self.latency > 0 else 0.0
+
+    def _finish(self, outcome, prompt, text):
+        if outcome == 'timeout':
+            raise TimeoutError('Fake LLM call timed out')
+        if outcome == 'rate_limited':
+            raise LLMRateLimitError('Fake LLM quota exhausted')
+        if outcome == 'error':
+            raise LLMBackendError('Fake LLM service unavailable')
+        return SimpleNamespace(text=text, usage_metadata=self._usage(prompt, text))
+
+    @staticmethod
+    def _usage(prompt, text):
+        return SimpleNamespace(prompt_token_count=estimate_tokens(prompt), candidates_token_count=estimate_tokens(text))
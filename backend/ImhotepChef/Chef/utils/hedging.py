@@ -0,0 +1,197 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class HedgePolicy:
+    """
+    When to send a backup (hedged) request, and how many may be sent
+
+    The hedge delay is a percentile of recent call latencies, so only calls
+    slower than e.g. 95% of the others are hedged. The budget is a token
+    bucket: every primary call earns `budget` tokens (up to `burst`) and a
+    hedge costs one, so hedges stay below that share of primary calls.
+    """
+
+    def __init__(self, percentile=95, min_delay=2.0, budget=0.1, burst=10, window=200, min_samples=20):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+
+    def record_latency(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self):
+        """Seconds to wait for the primary call before hedging"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.min_delay
+            latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def start_call(self):
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self._tokens + self.budget, self.burst)
+
+    def try_hedge(self):
+        """Take a hedge from the budget, False when it is spent"""
+        with self._lock:
+            if self._tokens < 1:
+                self.hedges_skipped += 1
+                return False
+            self._tokens -= 1
+            self.hedges_fired += 1
+            return True
+
+    def refund_hedge(self):
+        """Return a hedge taken by try_hedge that could not be sent"""
+        with self._lock:
+            self._tokens += 1
+            self.hedges_fired -= 1
+
+    def hedge_won(self):
+        with self._lock:
+            self.hedges_won += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'hedges_fired': self.hedges_fired,
+                'hedges_won': self.hedges_won,
+                'hedges_skipped': self.hedges_skipped,
+                'hedge_rate': self.hedges_fired / self.calls if self.calls else 0.0,
+                'hedge_win_rate': self.hedges_won / self.hedges_fired if self.hedges_fired else 0.0,
+                'budget_tokens': round(self._tokens, 2),
+            }
+
+
+class HedgePool:
+    """
+    Bounded thread pool the calls of hedged_call run on
+
+    At most max_in_flight calls (primary or hedge) run at once. A call that
+    finds the pool full is not hedged.
+    """
+
+    def __init__(self, max_in_flight=8):
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def submit(self, call, key):
+        """Run call(key) on the pool, None when max_in_flight calls are already running"""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return None
+            self._in_flight += 1
+        future = self._executor.submit(call, key)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+
+def hedged_call(call, primary_key, next_key, policy, pool):
+    """
+    Run call(primary_key), and call(next_key()) too if it is slow; the first success wins
+
+    Both calls run on the pool. A running thread can't be interrupted, so the
+    losing call is cancelled only if it hasn't started, and otherwise runs to
+    completion with its result dropped. When the pool is full the call runs
+    on the calling thread without a hedge.
+
+    Args:
+        call (callable): Takes an API key and returns the result
+        primary_key (str): Key for the first call
+        next_key (callable): Returns the key for the hedge, or None
+        policy (HedgePolicy): Hedge delay, budget and metrics
+        pool (HedgePool): Runs the calls
+
+    Returns:
+        tuple: (winning_key, result)
+
+    Raises:
+        The error of the first call to fail when every call failed
+    """
+    policy.start_call()
+    primary = pool.submit(call, primary_key)
+    if primary is None:
+        return primary_key, call(primary_key)
+
+    done, _ = wait([primary], timeout=policy.delay())
+    if done or not policy.try_hedge():
+        return primary_key, primary.result()
+
+    hedge_key = next_key()
+    hedge = pool.submit(call, hedge_key) if hedge_key is not None else None
+    if hedge is None:
+        policy.refund_hedge()
+        return primary_key, primary.result()
+
+    print("Gemini call is slow, sending a hedged request")
+    pending = {primary: primary_key, hedge: hedge_key}
+    first_error = None
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                if future.exception() is None:
+                    if future is hedge:
+                        policy.hedge_won()
+                    return key, future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def ahedged_call(call, primary_key, next_key, policy):
+    """Async version of hedged_call, call is a coroutine function and the loser is cancelled"""
+    policy.start_call()
+    primary = asyncio.ensure_future(call(primary_key))
+    done, _ = await asyncio.wait([primary], timeout=policy.delay())
+    if done or not policy.try_hedge():
+        return primary_key, await primary
+
+    hedge_key = next_key()
+    if hedge_key is None:
+        policy.refund_hedge()
+        return primary_key, await primary
+
+    print("Gemini call is slow, sending a hedged request")
+    hedge = asyncio.ensure_future(call(hedge_key))
+    pending = {primary: primary_key, hedge: hedge_key}
+    first_error = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                key = pending.pop(task)
+                if task.exception() is None:
+                    if task is hedge:
+                        policy.hedge_won()
+                    return key, task.result()
+                first_error = first_error or task.exception()
+        raise first_error
+    finally:
+        for task in pending:
+            task.cancel()
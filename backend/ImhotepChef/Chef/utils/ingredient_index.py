@@ -0,0 +1,184 @@
+import math
+import threading
+import time
+from django.conf import settings
+from .ingredients import canonical_ingredients, ingredients_fingerprint
+
+
+def jaccard_similarity(first, second):
+    """Share of ingredients two sets have in common, from 0.0 to 1.0"""
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+class IngredientIndex:
+    """
+    Inverted index from ingredient name to recipe IDs
+
+    Only the newest recipe of each distinct ingredient set is indexed, so
+    the posting lists grow with the number of ingredient combinations and
+    not with the number of history rows.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._recipes = {}
+        self._by_fingerprint = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.last_recipe_id = 0
+        self.refreshed_at = None
+
+    def __len__(self):
+        return len(self._recipes)
+
+    def add(self, recipe_id, ingredients, fingerprint=None):
+        """Index a recipe, replacing an older recipe with the same ingredient set"""
+        ingredient_set = frozenset(canonical_ingredients(ingredients))
+        if not ingredient_set:
+            return
+        fingerprint = fingerprint or ingredients_fingerprint(ingredient_set)
+
+        with self._lock:
+            previous_id = self._by_fingerprint.get(fingerprint)
+            if previous_id is not None:
+                if previous_id >= recipe_id:
+                    return
+                self._remove(previous_id)
+
+            self._by_fingerprint[fingerprint] = recipe_id
+            self._recipes[recipe_id] = ingredient_set
+            for ingredient in ingredient_set:
+                self._postings.setdefault(ingredient, set()).add(recipe_id)
+
+    def _remove(self, recipe_id):
+        for ingredient in self._recipes.pop(recipe_id, ()):
+            posting = self._postings.get(ingredient)
+            if posting is not None:
+                posting.discard(recipe_id)
+                if not posting:
+                    del self._postings[ingredient]
+
+    def discard(self, recipe_id):
+        """Drop a recipe that no longer exists"""
+        with self._lock:
+            ingredient_set = self._recipes.get(recipe_id)
+            if ingredient_set is None:
+                return
+            fingerprint = ingredients_fingerprint(ingredient_set)
+            if self._by_fingerprint.get(fingerprint) == recipe_id:
+                del self._by_fingerprint[fingerprint]
+            self._remove(recipe_id)
+
+    def best_match(self, ingredients, threshold):
+        """
+        Find the indexed recipe most similar to an ingredient set
+
+        Candidates come only from the posting lists of the rarest query
+        ingredients (prefix filtering): a recipe that misses all of them
+        cannot reach the threshold, so common ingredients like salt never
+        have their long posting lists scanned.
+
+        Args:
+            ingredients (list): Requested ingredients
+            threshold (float): Minimum Jaccard similarity, from 0.0 to 1.0
+
+        Returns:
+            tuple: (recipe_id, similarity), or (None, 0.0) if nothing reaches the threshold
+        """
+        query = frozenset(canonical_ingredients(ingredients))
+        if not query or threshold <= 0:
+            return None, 0.0
+
+        with self._lock:
+            by_rarity = sorted(query, key=lambda ingredient: len(self._postings.get(ingredient, ())))
+            prefix_length = len(query) - math.ceil(threshold * len(query) - 1e-9) + 1
+            candidates = set()
+            for ingredient in by_rarity[:prefix_length]:
+                candidates.update(self._postings.get(ingredient, ()))
+
+            best_id, best_score = None, 0.0
+            for recipe_id in candidates:
+                recipe_set = self._recipes[recipe_id]
+                # Size filter: the smaller set bounds the best achievable similarity
+                if min(len(recipe_set), len(query)) < threshold * max(len(recipe_set), len(query)):
+                    continue
+                score = jaccard_similarity(query, recipe_set)
+                if score > best_score or (score == best_score and best_id is not None and recipe_id > best_id):
+                    best_id, best_score = recipe_id, score
+
+        if best_score < threshold:
+            return None, 0.0
+        return best_id, best_score
+
+    def refresh(self, batch_size=2000):
+        """Load recipes saved since the last refresh, including those from other processes"""
+        from ..models import Recipe
+        from .ai_get_recipe import FALLBACK_RECIPE_NAME
+
+        rows = Recipe.objects.filter(
+            id__gt=self.last_recipe_id
+        ).exclude(
+            recipe_name=FALLBACK_RECIPE_NAME
+        ).order_by('id').values_list('id', 'main_ingredients', 'ingredients_fingerprint')
+
+        for recipe_id, main_ingredients, fingerprint in rows.iterator(chunk_size=batch_size):
+            self.add(recipe_id, main_ingredients or [], fingerprint)
+            self.last_recipe_id = recipe_id
+        self.refreshed_at = time.monotonic()
+
+    def is_stale(self, max_age):
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at >= max_age
+
+    def refresh_if_stale(self, max_age):
+        """
+        Refresh when the last refresh is older than max_age seconds
+
+        Only one thread refreshes at a time. The others don't wait for it and
+        keep using the index as it is, so a slow first load doesn't hold up
+        every concurrent request.
+
+        Returns:
+            bool: Whether this call refreshed the index
+        """
+        if not self.is_stale(max_age) or not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            if not self.is_stale(max_age):
+                return False
+            self.refresh()
+            return True
+        finally:
+            self._refresh_lock.release()
+
+
+_ingredient_index = None
+_ingredient_index_lock = threading.Lock()
+
+
+def get_ingredient_index():
+    """
+    Get the process-wide ingredient index, loading new recipes when it is stale
+
+    The refresh runs outside the process-wide lock. While one request loads
+    new recipes, the others get the index as it is, even empty before the
+    first load completes.
+    """
+    global _ingredient_index
+    if _ingredient_index is None:
+        with _ingredient_index_lock:
+            if _ingredient_index is None:
+                _ingredient_index = IngredientIndex()
+    index = _ingredient_index
+    index.refresh_if_stale(settings.INGREDIENT_INDEX_REFRESH_INTERVAL)
+    return index
+
+
+def index_recipe(recipe):
+    """Add a freshly saved recipe to the index if this process has already loaded it"""
+    from .ai_get_recipe import FALLBACK_RECIPE_NAME
+
+    if _ingredient_index is None or recipe.recipe_name == FALLBACK_RECIPE_NAME:
+        return
+    _ingredient_index.add(recipe.id, recipe.main_ingredients or [], recipe.ingredients_fingerprint)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import re
+from functools import lru_cache
+
+# Leading quantities and units, e.g. "2 cups", "1 1/2 lb", "3x", "200g", "a pinch of"
+_NUMBER = r'(?:\d+(?:[.,/]\d+)?(?:\s*-\s*\d+(?:[.,/]\d+)?)?|[¼-¾⅐-⅞]|a|an|some|few)'
+_UNIT = (
+    r'(?:x|kg|g|gr|grams?|mg|lbs?|pounds?|oz|ounces?|ml|l|liters?|litres?|cups?|tbsp|tablespoons?|tsp|teaspoons?|'
+    r'pinch(?:es)?|cloves?|cans?|pieces?|slices?|handfuls?|bunch(?:es)?|sticks?|dash(?:es)?)'
+)
+_QUANTITY_RE = re.compile(rf'^(?:{_NUMBER}(?:\s+|(?={_UNIT}\b)))+(?:{_UNIT}\.?\s+)?(?:of\s+)?')
+_PUNCTUATION_RE = re.compile(r"[^\w\s'-]+|_")
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Preparation words that do not change which ingredient is meant
+_DESCRIPTORS = frozenset({
+    'fresh', 'freshly', 'chopped', 'diced', 'sliced', 'grated', 'shredded', 'peeled', 'crushed', 'large', 'small',
+    'medium', 'ripe', 'raw', 'whole', 'organic', 'frozen', 'boneless', 'skinless', 'finely', 'roughly', 'cubed',
+})
+
+# Words that look plural but are not
+_PLURAL_EXCEPTIONS = frozenset({
+    'asparagus', 'couscous', 'hummus', 'molasses', 'swiss', 'brussels', 'greens', 'grits', 'citrus', 'octopus',
+    'bass', 'watercress', 'oats', 'fries', 'tapas', 'bitters', 'schnapps',
+})
+# Singulars whose plural only adds -s but ends like -ies, -oes or -ches, which the
+# suffix rules would cut short ("pies" -> "py", "quiches" -> "quich")
+_E_SINGULARS = frozenset({
+    'pie', 'cookie', 'brownie', 'smoothie', 'veggie', 'hoagie', 'calorie', 'quiche', 'brioche', 'ganache', 'sloe',
+})
+_IRREGULAR_PLURALS = {
+    'leaves': 'leaf',
+    'loaves': 'loaf',
+    'halves': 'half',
+    'knives': 'knife',
+    'geese': 'goose',
+    'mice': 'mouse',
+}
+
+# Alternative names mapped to the name used in cache keys (singular forms)
+_SYNONYMS = {
+    'roma tomato': 'tomato',
+    'plum tomato': 'tomato',
+    'vine tomato': 'tomato',
+    'cherry tomato': 'tomato',
+    'scallion': 'green onion',
+    'spring onion': 'green onion',
+    'coriander leaf': 'cilantro',
+    'garlic clove': 'garlic',
+    'garbanzo': 'chickpea',
+    'garbanzo bean': 'chickpea',
+    'aubergine': 'eggplant',
+    'courgette': 'zucchini',
+    'capsicum': 'bell pepper',
+    'sweet pepper': 'bell pepper',
+    'minced beef': 'ground beef',
+    'beef mince': 'ground beef',
+    'evoo': 'olive oil',
+    'extra virgin olive oil': 'olive oil',
+    'extra-virgin olive oil': 'olive oil',
+    'chicken breast': 'chicken',
+    'chicken thigh': 'chicken',
+    'egg white': 'egg',
+    'egg yolk': 'egg',
+    'hen egg': 'egg',
+    'rocket': 'arugula',
+    'prawn': 'shrimp',
+    'maize': 'corn',
+    'sweetcorn': 'corn',
+    'caster sugar': 'sugar',
+    'white sugar': 'sugar',
+    'granulated sugar': 'sugar',
+    'all-purpose flour': 'flour',
+    'all purpose flour': 'flour',
+    'plain flour': 'flour',
+    'white rice': 'rice',
+    'long grain rice': 'rice',
+    'spaghetti': 'pasta',
+    'penne': 'pasta',
+    'macaroni': 'pasta',
+}
+
+
+def _singular(word):
+    if word in _PLURAL_EXCEPTIONS or len(word) <= 3:
+        return word
+    if word in _IRREGULAR_PLURALS:
+        return _IRREGULAR_PLURALS[word]
+    if word.endswith('s') and word[:-1] in _E_SINGULARS:
+        return word[:-1]
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('oes'):
+        return word[:-2]
+    if word.endswith(('ches', 'shes', 'xes', 'sses', 'zes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=8192)
+def canonical_ingredient(name):
+    """
+    Canonical name of a single ingredient
+
+    "2 Roma Tomatoes", "tomatoes" and "Tomato " all become "tomato".
+
+    Args:
+        name (str): Ingredient name as typed by the user
+
+    Returns:
+        str: Canonical name, empty if nothing is left after cleaning
+    """
+    text = _WHITESPACE_RE.sub(' ', name.lower().replace('’', "'")).strip()
+    text = _QUANTITY_RE.sub('', text)
+    text = _PUNCTUATION_RE.sub(' ', text)
+    words = [word.strip("'-") for word in text.split()]
+    words = [word for word in words if word and word not in _DESCRIPTORS]
+    if not words:
+        return ''
+
+    phrase = ' '.join(words)
+    if phrase in _SYNONYMS:
+        return _SYNONYMS[phrase]
+
+    # Only the head noun carries the plural ("green onions" -> "green onion")
+    words[-1] = _singular(words[-1])
+    phrase = ' '.join(words)
+    return _SYNONYMS.get(phrase, phrase)
+
+
+def canonical_ingredients(ingredients):
+    """
+    Build the canonical form of an ingredient list
+
+    Args:
+        ingredients (list): Ingredient names as sent by the client
+
+    Returns:
+        list: Canonical, de-duplicated and sorted ingredient names
+    """
+    cleaned = set()
+    for ingredient in ingredients:
+        if isinstance(ingredient, str) and ingredient.strip():
+            canonical = canonical_ingredient(ingredient)
+            if canonical:
+                cleaned.add(canonical)
+    return sorted(cleaned)
+
+
+def ingredients_fingerprint(ingredients):
+    """
+    Get a stable fingerprint for an ingredient set
+
+    The fingerprint only depends on the canonical set, so the order, casing,
+    plurals, synonyms and duplicates of the input do not change it.
+
+    Args:
+        ingredients (list): Ingredient names
+
+    Returns:
+        str: 64 character sha256 hex digest
+    """
+    payload = json.dumps(canonical_ingredients(ingredients), separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,205 @@
+import random
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Latency assumed for a key that has not answered yet, in seconds
+_INITIAL_LATENCY = 1.0
+_MIN_WEIGHT = 1e-3
+
+
+class KeyHealth:
+    """Health of one API key, only touched while the pool lock is held"""
+
+    def __init__(self, label):
+        self.label = label
+        self.state = CLOSED
+        self.latency = _INITIAL_LATENCY
+        # Latency of the last recorded call, the EWMA smooths it out
+        self.last_latency = 0.0
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.open_until = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limits = 0
+        self.timeouts = 0
+
+    @property
+    def weight(self):
+        return max((1.0 - self.error_rate) / max(self.latency, 0.01), _MIN_WEIGHT)
+
+    def snapshot(self, now):
+        return {
+            'key': self.label,
+            'state': self.state,
+            'latency_ewma': round(self.latency, 4),
+            'last_latency': round(self.last_latency, 4),
+            'error_rate_ewma': round(self.error_rate, 4),
+            'consecutive_failures': self.consecutive_failures,
+            'cooldown_remaining': round(max(self.open_until - now, 0.0), 2) if self.state != CLOSED else 0.0,
+            'successes': self.successes,
+            'failures': self.failures,
+            'rate_limits': self.rate_limits,
+            'timeouts': self.timeouts,
+        }
+
+
+class KeyPool:
+    """
+    Thread-safe pool of API keys that routes calls by key health
+
+    Each key tracks an EWMA of its latency and error rate. Keys are tried
+    in a weighted random order that favours fast keys that are not failing,
+    so load spreads over the healthy keys instead of always hitting the
+    first one. A key whose circuit breaker is open is skipped: the breaker
+    opens after failure_threshold consecutive errors, or at once on a rate
+    limit, and stays open for a cooldown that doubles every time it
+    reopens. When the cooldown is over, one call probes the key and closes
+    the breaker again on success.
+
+    Listeners added with add_listener are called with (event, snapshot) on
+    every recorded call and breaker transition.
+    """
+
+    def __init__(self, keys, failure_threshold=3, cooldown=30.0, max_cooldown=600.0,
+                 alpha=0.3, clock=time.monotonic, rng=None):
+        self.keys = list(keys)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._health = {key: KeyHealth(f'key-{index + 1}') for index, key in enumerate(self.keys)}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """Call listener(event, snapshot) on calls and breaker transitions"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def label(self, key):
+        """Printable name of a key"""
+        return self._health[key].label
+
+    def candidates(self):
+        """
+        Yield the keys to try for one call, best first
+
+        Keys are picked lazily, so a key that fails during this call is
+        already weighted down when the next one is chosen.
+        """
+        tried = set()
+        while True:
+            key = self._choose(tried)
+            if key is None:
+                return
+            tried.add(key)
+            yield key
+
+    def _choose(self, tried):
+        events = []
+        with self._lock:
+            now = self._clock()
+            closed = [key for key in self.keys if key not in tried and self._health[key].state == CLOSED]
+            if closed:
+                # Weighted random order (Efraimidis-Spirakis): one sample per key, largest wins
+                return max(closed, key=lambda key: self._rng.random() ** (1.0 / self._health[key].weight))
+
+            # No healthy key left, let one call probe a key whose cooldown is over
+            for key in sorted(self.keys, key=lambda key: self._health[key].open_until):
+                health = self._health[key]
+                # open_until also covers a probe in flight
+                if key in tried or health.open_until > now:
+                    continue
+                health.state = HALF_OPEN
+                # A probe that never reports back frees the key after another cooldown
+                health.open_until = now + self.cooldown
+                events.append(('circuit_half_open', health.snapshot(now)))
+                break
+            else:
+                key = None
+        self._notify(events)
+        return key
+
+    def record_success(self, key, latency):
+        """Record a call that got an answer from the API"""
+        events = []
+        with self._lock:
+            health = self._health.get(key)
+            if health is None:
+                return
+            now = self._clock()
+            health.successes += 1
+            health.last_latency = latency
+            health.latency += self.alpha * (latency - health.latency)
+            health.error_rate += self.alpha * (0.0 - health.error_rate)
+            health.consecutive_failures = 0
+            if health.state != CLOSED:
+                health.state = CLOSED
+                health.times_opened = 0
+                events.append(('circuit_closed', health.snapshot(now)))
+            events.insert(0, ('success', health.snapshot(now)))
+        self._notify(events)
+
+    def record_failure(self, key, latency, rate_limited=False, timed_out=False):
+        """Record a call that failed, rate_limited for quota errors (HTTP 429), timed_out for timeouts"""
+        events = []
+        with self._lock:
+            health = self._health.get(key)
+            if health is None:
+                return
+            now = self._clock()
+            health.failures += 1
+            health.last_latency = latency
+            health.latency += self.alpha * (latency - health.latency)
+            health.error_rate += self.alpha * (1.0 - health.error_rate)
+            health.consecutive_failures += 1
+            if rate_limited:
+                health.rate_limits += 1
+            if timed_out:
+                health.timeouts += 1
+
+            should_open = (
+                rate_limited
+                or health.state == HALF_OPEN
+                or health.consecutive_failures >= self.failure_threshold
+            )
+            if should_open:
+                health.times_opened += 1
+                health.state = OPEN
+                health.open_until = now + min(self.cooldown * 2 ** (health.times_opened - 1), self.max_cooldown)
+            event = 'rate_limited' if rate_limited else 'timeout' if timed_out else 'failure'
+            events.append((event, health.snapshot(now)))
+            if should_open:
+                events.append(('circuit_open', health.snapshot(now)))
+        self._notify(events)
+
+    def snapshot(self):
+        """Current health of every key, labelled key-1, key-2, ... (keys are never exposed)"""
+        with self._lock:
+            now = self._clock()
+            return [self._health[key].snapshot(now) for key in self.keys]
+
+    def _notify(self, events):
+        for event, snapshot in events:
+            for listener in list(self._listeners):
+                try:
+                    listener(event, snapshot)
+                except Exception as listener_error:
+                    print(f"Key pool listener failed: {listener_error}")
+
+
+def log_circuit_changes(event, snapshot):
+    """Default listener, prints breaker transitions"""
+    if event.startswith('circuit_'):
+        print(f"Gemini {snapshot['key']} circuit {snapshot['state']} "
+              f"(error rate {snapshot['error_rate_ewma']:.0%}, cooldown {snapshot['cooldown_remaining']}s)")
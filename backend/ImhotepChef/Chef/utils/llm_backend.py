@@ -0,0 +1,112 @@
+import threading
+from django.conf import settings
+
+
+class LLMBackendError(Exception):
+    """A backend call failed on the provider's side, e.g. HTTP 500 or 503"""
+
+
+class LLMRateLimitError(LLMBackendError):
+    """The API key ran out of quota, e.g. HTTP 429"""
+
+
+class LLMBackend:
+    """
+    Interface of the LLM behind recipe generation, selected by settings.LLM_BACKEND
+
+    Calls take one of api_keys(), which go through the key pool, and the
+    per-call generation_config and request_options of google.generativeai.
+    Responses and stream chunks have .text and .usage_metadata (None or
+    prompt_token_count and candidates_token_count). Timeouts are raised as
+    TimeoutError or the provider's deadline error, quota errors as
+    LLMRateLimitError or the provider's 429 error.
+    """
+
+    name = ''
+
+    def api_keys(self):
+        """Credentials to spread calls over"""
+        raise NotImplementedError
+
+    def generate(self, api_key, prompt, generation_config=None, request_options=None):
+        """Send the prompt, returns the response"""
+        raise NotImplementedError
+
+    async def agenerate(self, api_key, prompt, generation_config=None, request_options=None):
+        """Async version of generate"""
+        raise NotImplementedError
+
+    def stream(self, api_key, prompt, generation_config=None, request_options=None):
+        """Send the prompt, returns an iterable of response chunks"""
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini through google.generativeai, with the models of Gemini_Config"""
+
+    name = 'gemini'
+
+    def api_keys(self):
+        from .config import Gemini_Config
+
+        return Gemini_Config.API_KEYS
+
+    def generate(self, api_key, prompt, generation_config=None, request_options=None):
+        from .config import Gemini_Config
+
+        # Single-shot generation on the key's reused model, no chat session
+        return Gemini_Config.get_model(api_key).generate_content(
+            prompt,
+            generation_config=generation_config,
+            request_options=request_options
+        )
+
+    async def agenerate(self, api_key, prompt, generation_config=None, request_options=None):
+        from .config import Gemini_Config
+
+        return await Gemini_Config.get_model(api_key).generate_content_async(
+            prompt,
+            generation_config=generation_config,
+            request_options=request_options
+        )
+
+    def stream(self, api_key, prompt, generation_config=None, request_options=None):
+        from .config import Gemini_Config
+
+        return Gemini_Config.get_model(api_key).generate_content(
+            prompt,
+            stream=True,
+            generation_config=generation_config,
+            request_options=request_options
+        )
+
+
+def _fake_backend():
+    from .fake_llm import FakeBackend
+
+    return FakeBackend.from_settings()
+
+
+LLM_BACKENDS = {
+    'gemini': GeminiBackend,
+    'fake': _fake_backend,
+}
+
+_llm_backend = None
+_llm_backend_lock = threading.Lock()
+
+
+def get_llm_backend():
+    """Get the process-wide backend named by settings.LLM_BACKEND, rebuilt if the setting changed"""
+    global _llm_backend
+    backend = _llm_backend
+    if backend is None or backend.name != settings.LLM_BACKEND:
+        with _llm_backend_lock:
+            backend = _llm_backend
+            if backend is None or backend.name != settings.LLM_BACKEND:
+                if settings.LLM_BACKEND not in LLM_BACKENDS:
+                    raise ValueError(
+                        f"Unknown LLM_BACKEND {settings.LLM_BACKEND!r}, expected one of {', '.join(LLM_BACKENDS)}"
+                    )
+                backend = _llm_backend = LLM_BACKENDS[settings.LLM_BACKEND]()
+    return backend
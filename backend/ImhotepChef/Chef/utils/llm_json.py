@@ -0,0 +1,472 @@
+import json
+import re
+
+# Quote characters models use in place of '"' around keys and strings
+_SMART_OPEN_QUOTES = {'“': '”', '„': '”', '«': '»'}
+_SMART_CLOSE_QUOTES = {'”', '»'}
+_CLOSERS = {'{': '}', '[': ']'}
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null', 'True': 'true', 'False': 'false', 'None': 'null'}
+_TOKEN_CHARS = set('0123456789+-.eEabcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+_VALID_ESCAPES = set('"\\/bfnrtu')
+# Characters that end a run of plain string content
+_STRING_SPECIAL_RE = re.compile('[\\\\"\x00-\x1f“”„«»]')
+_STRING_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+class RecipeSchemaError(ValueError):
+    """The reply is valid JSON but not a usable recipe"""
+
+
+class _Container:
+    __slots__ = ('closer', 'state', 'has_items')
+
+    def __init__(self, opener):
+        self.closer = _CLOSERS[opener]
+        # Objects go key -> colon -> value -> comma, arrays go value -> comma
+        self.state = 'key' if opener == '{' else 'value'
+        self.has_items = False
+
+    @property
+    def is_object(self):
+        return self.closer == '}'
+
+
+class IncrementalJSONParser:
+    """
+    Tolerant JSON parser for LLM replies, fed one chunk at a time
+
+    The reply is rewritten into valid JSON as it arrives: prose and code
+    fences around the object are skipped, smart quotes used as delimiters
+    become '"', trailing commas are dropped, missing commas are added, raw
+    newlines inside strings are escaped and Python literals are mapped to
+    JSON. A truncated reply is cut after its last complete value and the
+    open brackets are closed.
+
+    Every chunk is scanned once. partial() only re-parses when another value
+    has been completed since the last call.
+    """
+
+    def __init__(self):
+        self._out = []
+        self._stack = []
+        self._started = False
+        self._done = False
+        self._in_string = False
+        self._string_is_key = False
+        self._string_closers = ('"',)
+        self._escaped = False
+        self._token = ''
+        # Length of self._out and the closers needed after the last complete value
+        self._safe_length = 0
+        self._safe_closers = ''
+        self._parsed_length = -1
+        self._parsed = None
+        self.repairs = set()
+
+    @property
+    def done(self):
+        """The top level value has been closed"""
+        return self._done
+
+    def feed(self, text):
+        """Consume the next chunk of the reply"""
+        index = 0
+        while index < len(text) and not self._done:
+            if self._in_string and not self._escaped:
+                # Copy plain string content in one go, most of a reply is inside strings
+                match = _STRING_SPECIAL_RE.search(text, index)
+                end = match.start() if match else len(text)
+                if end > index:
+                    self._emit(text[index:end])
+                    index = end
+                    continue
+            self._consume(text[index])
+            index += 1
+        return self
+
+    def partial(self):
+        """
+        The complete values received so far, with the open brackets closed
+
+        Returns:
+            The parsed prefix, or None when nothing is complete yet
+        """
+        if self._safe_length != self._parsed_length:
+            self._parsed_length = self._safe_length
+            self._parsed = self._load()
+        return self._parsed
+
+    def finish(self):
+        """
+        Parse the whole reply, repairing it where needed
+
+        Raises:
+            json.JSONDecodeError: No JSON value could be recovered
+        """
+        self._finish_token()
+        if not self._done:
+            if self._in_string or self._token or self._stack:
+                self.repairs.add('truncated')
+        result = self.partial()
+        if result is None:
+            raise json.JSONDecodeError('No JSON object found in the reply', ''.join(self._out), 0)
+        return result
+
+    def _load(self):
+        if not self._started:
+            return None
+        try:
+            return json.loads(''.join(self._out[:self._safe_length]) + self._safe_closers)
+        except json.JSONDecodeError:
+            return None
+
+    def _emit(self, text):
+        self._out.append(text)
+
+    def _mark_safe(self):
+        self._safe_length = len(self._out)
+        self._safe_closers = ''.join(container.closer for container in reversed(self._stack))
+
+    def _consume(self, char):
+        if self._in_string:
+            self._consume_string(char)
+            return
+
+        if self._token:
+            if char in _TOKEN_CHARS:
+                self._token += char
+                return
+            self._finish_token()
+
+        if not self._started:
+            # Skip prose and code fences before the value
+            if char in _CLOSERS:
+                self._started = True
+                self._open(char)
+            return
+
+        if char in ' \t\r\n':
+            return
+        if char == '"' or char in _SMART_OPEN_QUOTES or char in _SMART_CLOSE_QUOTES:
+            self._open_string(char)
+        elif char in _CLOSERS:
+            if self._begin_value():
+                self._open(char)
+        elif char in '}]':
+            self._close(char)
+        elif char == ':':
+            container = self._stack[-1]
+            if container.is_object and container.state == 'colon':
+                self._emit(':')
+                container.state = 'value'
+        elif char == ',':
+            container = self._stack[-1]
+            if container.state == 'comma':
+                # Written lazily by _begin_value, so a trailing comma is never emitted
+                container.state = 'key' if container.is_object else 'value'
+        elif char in _TOKEN_CHARS:
+            if self._begin_value():
+                self._token = char
+
+    def _begin_value(self):
+        """Write the separator a new key or value needs, False if it can't start here"""
+        container = self._stack[-1]
+        if container.state == 'comma':
+            self.repairs.add('missing_comma')
+            container.state = 'key' if container.is_object else 'value'
+        if container.state == 'colon':
+            self.repairs.add('missing_colon')
+            self._emit(':')
+            container.state = 'value'
+            return True
+        if container.is_object and container.state == 'value':
+            return True
+        if container.is_object and container.state == 'key':
+            return False
+        if container.has_items:
+            self._emit(',')
+        container.has_items = True
+        return True
+
+    def _open(self, char):
+        self._emit(char)
+        self._stack.append(_Container(char))
+        self._mark_safe()
+
+    def _close(self, char):
+        container = self._stack[-1]
+        if char != container.closer:
+            self.repairs.add('mismatched_bracket')
+        if container.has_items and container.state == ('key' if container.is_object else 'value'):
+            self.repairs.add('trailing_comma')
+        elif container.is_object and container.state in ('colon', 'value'):
+            # A key without a value
+            self.repairs.add('missing_value')
+            if container.state == 'colon':
+                self._emit(':')
+            self._emit('null')
+        self._emit(container.closer)
+        self._stack.pop()
+        self._end_value()
+
+    def _end_value(self):
+        if not self._stack:
+            self._done = True
+            self._mark_safe()
+            return
+        container = self._stack[-1]
+        container.state = 'comma'
+        self._mark_safe()
+
+    def _open_string(self, char):
+        container = self._stack[-1]
+        is_key = container.is_object and container.state in ('key', 'comma')
+        if is_key:
+            if container.state == 'comma':
+                self.repairs.add('missing_comma')
+            if container.has_items:
+                self._emit(',')
+            container.has_items = True
+        elif not self._begin_value():
+            return
+        if char != '"':
+            self.repairs.add('smart_quotes')
+            self._string_closers = ('"', _SMART_OPEN_QUOTES.get(char, char), *_SMART_CLOSE_QUOTES)
+        else:
+            self._string_closers = ('"',)
+        self._string_is_key = is_key
+        self._in_string = True
+        self._emit('"')
+
+    def _consume_string(self, char):
+        if self._escaped:
+            self._escaped = False
+            if char not in _VALID_ESCAPES:
+                # e.g. \' is not a JSON escape, keep the backslash as text
+                self.repairs.add('invalid_escape')
+                self._emit('\\')
+            self._emit('\\' + char)
+        elif char == '\\':
+            self._escaped = True
+        elif char in self._string_closers:
+            self._in_string = False
+            self._emit('"')
+            if self._string_is_key:
+                self._stack[-1].state = 'colon'
+            else:
+                self._end_value()
+        elif char < ' ':
+            self.repairs.add('control_characters')
+            self._emit(_STRING_ESCAPES.get(char, f'\\u{ord(char):04x}'))
+        else:
+            self._emit(char)
+
+    def _finish_token(self):
+        token, self._token = self._token, ''
+        if not token:
+            return
+        if token in _LITERALS:
+            if token != _LITERALS[token]:
+                self.repairs.add('python_literals')
+            self._emit(_LITERALS[token])
+        else:
+            try:
+                float(token)
+            except ValueError:
+                # Unquoted text or a cut off literal, leave it out
+                self.repairs.add('invalid_token')
+                self._emit('null')
+            else:
+                self._emit(token)
+        self._end_value()
+
+
+def parse_json(response_text):
+    """
+    Parse an LLM reply into JSON, repairing common defects
+
+    Returns:
+        tuple: (value, repairs), repairs is the set of defects that were fixed
+
+    Raises:
+        json.JSONDecodeError: No JSON value could be recovered
+    """
+    # Most replies are valid JSON, possibly in a code fence
+    try:
+        return json.loads(response_text.replace('```json', '').replace('```', '').strip()), set()
+    except json.JSONDecodeError:
+        pass
+
+    parser = IncrementalJSONParser().feed(response_text)
+    return parser.finish(), parser.repairs
+
+
+def recipe_schema():
+    """
+    Expected type of each recipe field, with the Recipe column limits
+
+    default replaces a null value, type() is used when there is none.
+    items and properties give the shape of list items and nested objects,
+    they are only used for the Gemini response schema.
+    """
+    from ..models import Recipe
+
+    def max_length(field):
+        return Recipe._meta.get_field(field).max_length
+
+    return {
+        'name': {'type': str, 'required': True, 'max_length': max_length('recipe_name')},
+        'description': {'type': str},
+        'difficulty': {'type': str, 'choices': [choice for choice, _ in Recipe.RECIPE_DIFFICULTY_CHOICES], 'default': 'Easy'},
+        'prep_time': {'type': str, 'max_length': max_length('prep_time')},
+        'cook_time': {'type': str, 'max_length': max_length('cook_time')},
+        'total_time': {'type': str, 'max_length': max_length('total_time')},
+        'servings': {'type': int, 'default': 1},
+        'main_ingredients': {'type': list, 'items': str},
+        'additional_ingredients': {'type': list, 'items': {'name': str, 'amount': str, 'optional': bool}},
+        'instructions': {'type': list, 'required': True, 'items': str},
+        'tips': {'type': list, 'items': str},
+        'nutrition': {'type': dict, 'properties': {'calories': int, 'protein': str, 'carbs': str, 'fat': str}},
+    }
+
+
+_SCHEMA_TYPES = {str: 'string', int: 'integer', bool: 'boolean', list: 'array', dict: 'object'}
+
+
+def _object_schema(properties):
+    """OpenAPI object schema with every property required, properties maps names to types or rules"""
+    return {
+        'type': 'object',
+        'properties': {name: _field_schema(rules) for name, rules in properties.items()},
+        'required': list(properties),
+    }
+
+
+def _field_schema(rules):
+    if isinstance(rules, dict) and 'type' not in rules:
+        return _object_schema(rules)
+    if not isinstance(rules, dict):
+        return {'type': _SCHEMA_TYPES[rules]}
+    if 'properties' in rules:
+        return _object_schema(rules['properties'])
+
+    schema = {'type': _SCHEMA_TYPES[rules['type']]}
+    if 'items' in rules:
+        schema['items'] = _field_schema(rules['items'])
+    if 'choices' in rules:
+        schema['enum'] = rules['choices']
+    # The response schema has no string length limit, the model gets it as a hint
+    if 'max_length' in rules:
+        schema['description'] = f"At most {rules['max_length']} characters"
+    return schema
+
+
+def recipe_response_schema(variants=1):
+    """Gemini response schema (OpenAPI subset) of a reply with `variants` recipes, built from recipe_schema"""
+    return {
+        'type': 'object',
+        'properties': {
+            'recipes': {
+                'type': 'array',
+                'items': _object_schema(recipe_schema()),
+                'min_items': variants,
+                'max_items': variants,
+            },
+            'success': {'type': 'boolean'},
+            'message': {'type': 'string'},
+        },
+        'required': ['recipes', 'success', 'message'],
+    }
+
+
+def recipe_batch_response_schema(count):
+    """Gemini response schema of a reply to a batch prompt, one result per numbered request"""
+    return {
+        'type': 'object',
+        'properties': {
+            'results': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'request': {'type': 'integer'},
+                        'recipe': _object_schema(recipe_schema()),
+                    },
+                    'required': ['request', 'recipe'],
+                },
+                'max_items': count,
+            },
+        },
+        'required': ['results'],
+    }
+
+
+def _coerce(value, rules):
+    """
+    Convert a usable near-miss to the field's type, e.g. "4" or 4.0 servings or 'easy' difficulty
+
+    Returns:
+        The converted value, or None when it can't be converted
+    """
+    expected = rules['type']
+    # bool is an int subclass, but not a serving count
+    if isinstance(value, bool) and expected is not bool:
+        return None
+    if expected is int:
+        if isinstance(value, str):
+            try:
+                value = float(value.strip())
+            except ValueError:
+                return None
+        if isinstance(value, float):
+            return int(value) if value.is_integer() else None
+        return value if isinstance(value, int) else None
+    if expected is str:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if isinstance(value, (int, float)):
+            value = str(value)
+        if not isinstance(value, str):
+            return None
+        if 'choices' in rules:
+            return next((choice for choice in rules['choices'] if choice.lower() == value.strip().lower()), None)
+        return value
+    return value if isinstance(value, expected) else None
+
+
+def validate_recipe_data(recipe_data):
+    """
+    Check that parsed reply data holds at least one storable recipe
+
+    Optional fields sent as null are set to their default in place, the
+    Recipe columns are NOT NULL. Values of the wrong type or case that
+    still mean something (see _coerce) are converted in place too, so a
+    usable reply isn't retried on another key.
+
+    Raises:
+        RecipeSchemaError: Describes the first problem found
+    """
+    if not isinstance(recipe_data, dict) or not isinstance(recipe_data.get('recipes'), list) or not recipe_data['recipes']:
+        raise RecipeSchemaError("Invalid response structure from Gemini API")
+
+    schema = recipe_schema()
+    for index, recipe in enumerate(recipe_data['recipes']):
+        if not isinstance(recipe, dict):
+            raise RecipeSchemaError(f"Recipe {index} is not an object")
+        for field, rules in schema.items():
+            value = recipe.get(field)
+            if value is None or value == '' or value == []:
+                if rules.get('required'):
+                    raise RecipeSchemaError(f"Recipe {index} is missing {field}")
+                if field in recipe and value is None:
+                    recipe[field] = rules['default'] if 'default' in rules else rules['type']()
+                continue
+            coerced = _coerce(value, rules)
+            if coerced is None:
+                if 'choices' in rules and isinstance(value, str):
+                    raise RecipeSchemaError(f"Recipe {index} {field} must be one of {', '.join(rules['choices'])}")
+                raise RecipeSchemaError(f"Recipe {index} {field} must be {rules['type'].__name__}")
+            if 'max_length' in rules and len(coerced) > rules['max_length']:
+                raise RecipeSchemaError(f"Recipe {index} {field} is longer than {rules['max_length']} characters")
+            recipe[field] = coerced
+    return recipe_data
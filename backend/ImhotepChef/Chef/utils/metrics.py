@@ -0,0 +1,252 @@
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from django.conf import settings
+
+# Seconds, from a cache hit to a slow Gemini call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    type = 'counter'
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        self.registry.changed()
+
+    def state(self):
+        """JSON-able definition and values, merged with other processes' by add_states"""
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'values': [[list(key), value] for key, value in self._values.items()],
+        }
+
+
+class Histogram(Counter):
+    """Distribution of observed values per label set, in cumulative buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def inc(self, amount=1.0, **labels):
+        raise TypeError('Histograms are updated with observe()')
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Count per bucket (the last one is +Inf), then the sum of the values
+        index = next((index for index, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self.registry.lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+        self.registry.changed()
+
+    def state(self):
+        state = super().state()
+        state['buckets'] = list(self.buckets)
+        state['values'] = [[list(key), list(counts)] for key, counts in self._values.items()]
+        return state
+
+
+def add_states(total, state):
+    """Add the metric states of one process to the running total of several"""
+    for name, metric in state.items():
+        merged = total.setdefault(name, dict(metric, values={}))
+        for labels, value in metric['values']:
+            key = tuple(labels)
+            if metric['type'] == 'histogram':
+                current = merged['values'].get(key) or [0] * len(value)
+                merged['values'][key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged['values'][key] = merged['values'].get(key, 0.0) + value
+    return total
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_states(states):
+    """Prometheus text exposition format of merged metric states"""
+    lines = []
+    for name in sorted(states):
+        metric = states[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key in sorted(metric['values']):
+            value = metric['values'][key]
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_labels(metric['labelnames'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip([*metric['buckets'], math.inf], value[:-1]):
+                cumulative += count
+                le = (('le', _number(float(bound)) if bound != math.inf else '+Inf'),)
+                lines.append(f"{name}_bucket{_labels(metric['labelnames'], key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labelnames'], key)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(metric['labelnames'], key)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry:
+    """
+    In-process metrics, rendered in the Prometheus text format
+
+    With settings.METRICS_MULTIPROC_DIR set, every process writes its
+    metrics to its own file in that directory, at most every
+    METRICS_FLUSH_INTERVAL seconds and on exit, and render() adds up the
+    files of all processes. Files of stopped processes are kept, so
+    counters don't go back when a worker is recycled. Empty the directory
+    when the app is redeployed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._flush_lock = threading.Lock()
+        self._last_flush = 0.0
+        self._exit_hook = False
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def states(self):
+        """This process's metrics, as JSON-able states"""
+        with self.lock:
+            return {name: metric.state() for name, metric in self._metrics.items()}
+
+    def changed(self):
+        """Write this process's file when the last write is older than METRICS_FLUSH_INTERVAL"""
+        if settings.METRICS_MULTIPROC_DIR and time.monotonic() - self._last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        directory = settings.METRICS_MULTIPROC_DIR
+        # Another thread is writing the file already
+        if not directory or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = time.monotonic()
+            if not self._exit_hook:
+                atexit.register(self.flush)
+                self._exit_hook = True
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+            # Write and rename, so a scrape never reads half a file
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as metrics_file:
+                json.dump(self.states(), metrics_file)
+            os.replace(f'{path}.tmp', path)
+        except OSError as flush_error:
+            print(f"Could not write metrics: {flush_error}")
+        finally:
+            self._flush_lock.release()
+
+    def render(self):
+        """All metrics in the Prometheus text format, of every process in multiprocess mode"""
+        directory = settings.METRICS_MULTIPROC_DIR
+        if not directory:
+            return render_states(add_states({}, self.states()))
+
+        self.flush()
+        total = {}
+        for path in sorted(glob.glob(os.path.join(directory, 'metrics_*.json'))):
+            try:
+                with open(path, encoding='utf-8') as metrics_file:
+                    add_states(total, json.load(metrics_file))
+            except (OSError, ValueError) as read_error:
+                print(f"Skipping metrics file {path}: {read_error}")
+        return render_states(total)
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time to build the response, per view', ['view', 'method', 'status']
+)
+DB_QUERIES_PER_REQUEST = REGISTRY.histogram(
+    'db_queries_per_request', 'SQL queries run while building a response, per view', ['view'], QUERY_COUNT_BUCKETS
+)
+DB_QUERY_TIME_PER_REQUEST = REGISTRY.histogram(
+    'db_query_time_per_request_seconds', 'Time spent in SQL while building a response, per view', ['view']
+)
+RECIPE_CACHE_LOOKUPS = REGISTRY.counter(
+    'recipe_cache_lookups_total', 'Recipe cache lookups per tier (local, shared, database) and result', ['tier', 'result']
+)
+RECIPE_FALLBACKS = REGISTRY.counter(
+    'recipe_fallbacks_total', 'Fallback recipes served instead of a generated one, per reason', ['reason']
+)
+LLM_CALL_DURATION = REGISTRY.histogram(
+    'llm_call_duration_seconds', 'LLM call latency per API key and outcome', ['key', 'outcome']
+)
+LLM_CALL_ERRORS = REGISTRY.counter(
+    'llm_call_errors_total', 'Failed LLM calls per API key and kind (failure, timeout, rate_limited)', ['key', 'kind']
+)
+LLM_CIRCUIT_OPENS = REGISTRY.counter(
+    'llm_circuit_opens_total', 'Times the circuit breaker of an API key opened', ['key']
+)
+QUOTA_REJECTIONS = REGISTRY.counter(
+    'recipe_quota_rejections_total', 'Generate requests refused by the monthly recipe limit, per endpoint', ['endpoint']
+)
+
+
+def record_key_metrics(event, snapshot):
+    """Key pool listener, records every call and breaker opening"""
+    key = snapshot['key']
+    if event == 'success':
+        LLM_CALL_DURATION.observe(snapshot['last_latency'], key=key, outcome='success')
+    elif event in ('failure', 'timeout', 'rate_limited'):
+        LLM_CALL_DURATION.observe(snapshot['last_latency'], key=key, outcome='error')
+        LLM_CALL_ERRORS.inc(key=key, kind=event)
+    elif event == 'circuit_open':
+        LLM_CIRCUIT_OPENS.inc(key=key)
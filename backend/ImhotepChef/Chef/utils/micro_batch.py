@@ -0,0 +1,82 @@
+import threading
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.results = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collect calls from concurrent threads into batches
+
+    The first caller of a batch waits up to `window` seconds for others to
+    join, or until the batch holds `max_size` items, then runs
+    run_batch(items) for all of them. run_batch returns one result per
+    item, None for an item that failed. Callers get None when the batch
+    failed, or when it did not finish within their timeout, and are
+    expected to handle their item on their own.
+    """
+
+    def __init__(self, run_batch, window=0.05, max_size=4):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_size = max_size
+        self._open = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.batched_items = 0
+
+    def submit(self, item, timeout=None):
+        """
+        Add item to the open batch and wait for its result
+
+        Returns:
+            The item's result, or None
+        """
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            position = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_size:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._run(batch)
+        elif not batch.done.wait(timeout):
+            return None
+        return batch.results[position]
+
+    def _run(self, batch):
+        try:
+            results = self.run_batch(batch.items)
+            if len(results) != len(batch.items):
+                raise ValueError(f"run_batch returned {len(results)} results for {len(batch.items)} items")
+            batch.results = list(results)
+        except Exception as batch_error:
+            print(f"Micro-batch of {len(batch.items)} failed: {batch_error}")
+            batch.results = [None] * len(batch.items)
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.batched_items += len(batch.items)
+            batch.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'batched_items': self.batched_items,
+                'mean_batch_size': self.batched_items / self.batches if self.batches else 0.0,
+            }
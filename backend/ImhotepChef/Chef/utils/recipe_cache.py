@@ -0,0 +1,313 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import RECIPE_CACHE_LOOKUPS
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe in-process cache with a per-entry TTL
+
+    When the cache is full the least recently used entry is evicted.
+    Expired entries are dropped when they are read.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def is_fallback_recipe(recipe):
+    """Whether a recipe dict is the generic one served when generation failed, never cached"""
+    from .ai_get_recipe import FALLBACK_RECIPE_NAME
+
+    return recipe.get('name') == FALLBACK_RECIPE_NAME
+
+
+class RecipeCache:
+    """
+    Read-through recipe cache keyed by ingredient fingerprint
+
+    Tier 1 is a per-process LRU, tier 2 is the shared Django cache
+    configured under settings.RECIPE_CACHE_ALIAS. The database is only
+    queried when both tiers miss. Returned dicts are shared between
+    requests and must not be mutated.
+
+    Besides the recipe served for an ingredient set, an entry can hold the
+    set's variant pool, the different recipes stored for it.
+    """
+
+    KEY_PREFIX = 'recipe:'
+    POOL_KEY_PREFIX = 'pool:'
+    ROTATION_KEY_PREFIX = 'rotation:'
+
+    def __init__(self, local_size=None, local_ttl=None, shared_ttl=None, alias=None):
+        self.local = LRUCache(
+            max_size=local_size if local_size is not None else settings.RECIPE_CACHE_LOCAL_SIZE,
+            ttl=local_ttl if local_ttl is not None else settings.RECIPE_CACHE_LOCAL_TTL,
+        )
+        self.shared_ttl = shared_ttl if shared_ttl is not None else settings.RECIPE_CACHE_SHARED_TTL
+        self.alias = alias or settings.RECIPE_CACHE_ALIAS
+        self._stats_lock = threading.Lock()
+        # Per-process rotation counters, used when the shared tier is unavailable
+        self._rotations = {}
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.loads = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def get(self, fingerprint):
+        """Get a cached recipe dict from the local tier, then the shared tier"""
+        return self._get(fingerprint)
+
+    def _get(self, key):
+        recipe = self.local.get(key)
+        if recipe is not None:
+            RECIPE_CACHE_LOOKUPS.inc(tier='local', result='hit')
+            return recipe
+        RECIPE_CACHE_LOOKUPS.inc(tier='local', result='miss')
+
+        try:
+            recipe = self.shared.get(self.KEY_PREFIX + key)
+        except Exception as cache_error:
+            print(f"Shared recipe cache unavailable: {cache_error}")
+            recipe = None
+
+        with self._stats_lock:
+            if recipe is None:
+                self.shared_misses += 1
+            else:
+                self.shared_hits += 1
+        RECIPE_CACHE_LOOKUPS.inc(tier='shared', result='miss' if recipe is None else 'hit')
+
+        if recipe is not None:
+            self.local.set(key, recipe)
+        return recipe
+
+    def set(self, fingerprint, recipe):
+        """Store a recipe dict in both tiers, unless it is the fallback served when generation failed"""
+        if is_fallback_recipe(recipe):
+            return
+        self._set(fingerprint, recipe)
+
+    def _set(self, key, value):
+        self.local.set(key, value)
+        try:
+            self.shared.set(self.KEY_PREFIX + key, value, self.shared_ttl)
+        except Exception as cache_error:
+            print(f"Shared recipe cache unavailable: {cache_error}")
+
+    def delete(self, fingerprint):
+        self.local.delete(fingerprint)
+        try:
+            self.shared.delete(self.KEY_PREFIX + fingerprint)
+        except Exception as cache_error:
+            print(f"Shared recipe cache unavailable: {cache_error}")
+
+    def clear(self):
+        """Drop this process's local tier and the whole shared tier, e.g. after recipes are re-keyed"""
+        self.local.clear()
+        try:
+            self.shared.clear()
+        except Exception as cache_error:
+            print(f"Shared recipe cache unavailable: {cache_error}")
+
+    def get_or_load(self, fingerprint, loader):
+        """
+        Read-through lookup
+
+        Args:
+            fingerprint (str): Ingredient set fingerprint
+            loader (callable): Called on a miss in both tiers, returns a recipe dict or None
+
+        Returns:
+            dict or None: The cached or loaded recipe
+        """
+        recipe = self.get(fingerprint)
+        if recipe is not None:
+            return recipe
+
+        with self._stats_lock:
+            self.loads += 1
+        recipe = loader()
+        RECIPE_CACHE_LOOKUPS.inc(tier='database', result='hit' if recipe else 'miss')
+        if recipe is not None:
+            self.set(fingerprint, recipe)
+        return recipe
+
+    def get_or_load_pool(self, fingerprint, loader):
+        """
+        Read-through lookup of an ingredient set's variant pool
+
+        Args:
+            loader (callable): Called on a miss in both tiers, returns a list of recipe dicts
+
+        Returns:
+            list: The cached or loaded pool, empty when the set has no recipes
+        """
+        pool = self._get(self.POOL_KEY_PREFIX + fingerprint)
+        if pool is not None:
+            return pool
+
+        with self._stats_lock:
+            self.loads += 1
+        pool = loader()
+        RECIPE_CACHE_LOOKUPS.inc(tier='database', result='hit' if pool else 'miss')
+        self.set_pool(fingerprint, pool)
+        return pool
+
+    def set_pool(self, fingerprint, pool):
+        """Store the variant pool of an ingredient set in both tiers, without fallback recipes"""
+        pool = [recipe for recipe in pool if not is_fallback_recipe(recipe)]
+        if pool:
+            self._set(self.POOL_KEY_PREFIX + fingerprint, pool)
+
+    def next_rotation(self, fingerprint):
+        """
+        Count the pool hits of an ingredient set, so they can take turns over its variants
+
+        The count is shared by all processes through the shared tier, and
+        kept per process while the shared tier is unavailable. incr() is only
+        atomic on Redis and memcached; on the default file based backend it is a
+        read-modify-write, so concurrent hits can get the same count and serve
+        the same variant twice. The rotation only spreads variants, so an
+        occasional repeat is accepted.
+        """
+        key = self.KEY_PREFIX + self.ROTATION_KEY_PREFIX + fingerprint
+        try:
+            # add() is a no-op when the counter exists
+            self.shared.add(key, 0, self.shared_ttl)
+            return self.shared.incr(key)
+        except Exception as cache_error:
+            print(f"Shared recipe cache unavailable: {cache_error}")
+        with self._stats_lock:
+            self._rotations[fingerprint] = self._rotations.get(fingerprint, 0) + 1
+            return self._rotations[fingerprint]
+
+    async def aget(self, fingerprint):
+        """Async version of get, the shared tier is awaited"""
+        recipe = self.local.get(fingerprint)
+        if recipe is not None:
+            RECIPE_CACHE_LOOKUPS.inc(tier='local', result='hit')
+            return recipe
+        RECIPE_CACHE_LOOKUPS.inc(tier='local', result='miss')
+
+        try:
+            recipe = await self.shared.aget(self.KEY_PREFIX + fingerprint)
+        except Exception as cache_error:
+            print(f"Shared recipe cache unavailable: {cache_error}")
+            recipe = None
+
+        with self._stats_lock:
+            if recipe is None:
+                self.shared_misses += 1
+            else:
+                self.shared_hits += 1
+        RECIPE_CACHE_LOOKUPS.inc(tier='shared', result='miss' if recipe is None else 'hit')
+
+        if recipe is not None:
+            self.local.set(fingerprint, recipe)
+        return recipe
+
+    async def aset(self, fingerprint, recipe):
+        """Async version of set"""
+        if is_fallback_recipe(recipe):
+            return
+        self.local.set(fingerprint, recipe)
+        try:
+            await self.shared.aset(self.KEY_PREFIX + fingerprint, recipe, self.shared_ttl)
+        except Exception as cache_error:
+            print(f"Shared recipe cache unavailable: {cache_error}")
+
+    async def aget_or_load(self, fingerprint, loader):
+        """Async version of get_or_load, loader is a coroutine function"""
+        recipe = await self.aget(fingerprint)
+        if recipe is not None:
+            return recipe
+
+        with self._stats_lock:
+            self.loads += 1
+        recipe = await loader()
+        RECIPE_CACHE_LOOKUPS.inc(tier='database', result='hit' if recipe else 'miss')
+        if recipe is not None:
+            await self.aset(fingerprint, recipe)
+        return recipe
+
+    def stats(self):
+        """Hit/miss counters for both tiers"""
+        return {
+            'local_size': len(self.local),
+            'local_max_size': self.local.max_size,
+            'local_hits': self.local.hits,
+            'local_misses': self.local.misses,
+            'local_evictions': self.local.evictions,
+            'local_expirations': self.local.expirations,
+            'shared_hits': self.shared_hits,
+            'shared_misses': self.shared_misses,
+            'loads': self.loads,
+        }
+
+
+_recipe_cache = None
+_recipe_cache_lock = threading.Lock()
+
+
+def get_recipe_cache():
+    """Get the process-wide recipe cache, created on first use"""
+    global _recipe_cache
+    if _recipe_cache is None:
+        with _recipe_cache_lock:
+            if _recipe_cache is None:
+                _recipe_cache = RecipeCache()
+    return _recipe_cache
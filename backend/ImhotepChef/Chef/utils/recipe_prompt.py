@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+import time
+
+# The original prompt, with a full JSON example of the reply
+FULL_TEMPLATE = '''
+You are a professional chef AI assistant. Create {recipe_count} using the following ingredients: {ingredients}
+
+Requirements:
+1. Use as many of the provided ingredients as possible (at least 3)
+2. Minimize additional ingredients - only add essential ones that are commonly found in most kitchens
+3. Focus on simple, practical cooking techniques
+4. Provide detailed cooking instructions
+5. Include preparation and cooking times
+6. Specify serving size
+7. Add difficulty level (Easy, Medium, Hard)
+
+Please respond with a valid JSON format following this exact structure:
+
+{{
+    "recipes": [
+        {{
+            "id": 1,
+            "name": "Recipe Name",
+            "description": "Brief description of the dish",
+            "difficulty": "Easy/Medium/Hard",
+            "prep_time": "15 minutes",
+            "cook_time": "30 minutes",
+            "total_time": "45 minutes",
+            "servings": 4,
+            "main_ingredients": ["ingredient1", "ingredient2", "ingredient3"],
+            "additional_ingredients": [
+                {{
+                    "name": "ingredient name",
+                    "amount": "1 cup",
+                    "optional": false
+                }}
+            ],
+            "instructions": [
+                "Step 1: Detailed instruction",
+                "Step 2: Detailed instruction",
+                "Step 3: Detailed instruction"
+            ],
+            "tips": [
+                "Helpful cooking tip 1",
+                "Helpful cooking tip 2"
+            ],
+            "nutrition": {{
+                "calories": 350,
+                "protein": "25g",
+                "carbs": "30g",
+                "fat": "15g"
+            }}
+        }}
+    ],
+    "success": true,
+    "message": "Recipe generated successfully"
+}}
+
+IMPORTANT: Keep additional ingredients to a minimum (maximum 5 items). Only include basic pantry staples like salt, pepper, oil, garlic, onion if absolutely necessary. Make sure the JSON is properly formatted and valid.
+'''
+
+# One-line type sketch of a recipe in the reply
+RECIPE_SKETCH = (
+    '{"name":str,"description":str,"difficulty":"Easy"|"Medium"|"Hard","prep_time":str,"cook_time":str,'
+    '"total_time":str,"servings":int,"main_ingredients":[str],"additional_ingredients":'
+    '[{"name":str,"amount":str,"optional":bool}],"instructions":[str],"tips":[str],'
+    '"nutrition":{"calories":int,"protein":str,"carbs":str,"fat":str}}'
+)
+
+# Same requirements with the reply shape as a one-line type sketch, about a third of the tokens
+COMPACT_TEMPLATE = '''You are a professional chef. Create {recipe_count} using these ingredients: {ingredients}
+Use at least 3 of them, simple techniques and detailed steps. Add at most 5 common pantry staples.
+Reply with JSON only:
+{{"recipes":[{recipe_sketch}],"success":true,"message":str}}
+'''
+
+# For structured output, the response schema sent with the call gives the reply shape
+STRUCTURED_TEMPLATE = '''You are a professional chef. Create {recipe_count} using these ingredients: {ingredients}
+Use at least 3 of them, simple techniques and detailed steps. Add at most 5 common pantry staples.
+'''
+
+PROMPT_TEMPLATES = {
+    'full': FULL_TEMPLATE,
+    'compact': COMPACT_TEMPLATE,
+    'structured': STRUCTURED_TEMPLATE,
+}
+
+# Several requests in one call (micro-batching), one numbered line per request
+BATCH_TEMPLATE = '''You are a professional chef. Create 1 recipe for each numbered request below, using its ingredients.
+Use at least 3 of each request's ingredients, simple techniques and detailed steps. Add at most 5 common pantry staples per recipe.
+{requests}
+'''
+
+BATCH_REPLY_SKETCH = '''Reply with JSON only, one result per request:
+{{"results":[{{"request":int,"recipe":{recipe_sketch}}}]}}
+'''
+
+# Output token cap: a recipe reply is ~600-900 tokens, plus a little per ingredient
+# used. The headroom keeps long recipes from being cut off.
+OUTPUT_TOKENS_BASE = 900
+OUTPUT_TOKENS_PER_INGREDIENT = 40
+OUTPUT_TOKENS_HEADROOM = 1.5
+OUTPUT_TOKENS_MIN = 1024
+
+# Gemini tokens average about 4 characters of English text
+CHARS_PER_TOKEN = 4
+
+_record_lock = threading.Lock()
+
+
+def prompt_template():
+    """GEMINI_PROMPT_TEMPLATE, or the template for the output mode when it is not set"""
+    from .config import Gemini_Config
+
+    if Gemini_Config.PROMPT_TEMPLATE:
+        return Gemini_Config.PROMPT_TEMPLATE
+    return 'structured' if Gemini_Config.STRUCTURED_OUTPUT else 'compact'
+
+
+def recipe_count(variants):
+    """How many recipes the prompt asks for, as it reads in the prompt"""
+    if variants == 1:
+        return "1 recipe"
+    return f"{variants} different recipes, varied in style and difficulty,"
+
+
+def build_recipe_prompt(array_of_ingredients, template=None, variants=1):
+    """
+    Build the Gemini prompt for a list of ingredients
+
+    Args:
+        array_of_ingredients (list): Ingredients to cook with
+        template (str): Optional, a PROMPT_TEMPLATES name (default prompt_template())
+        variants (int): Recipes to ask for in the one reply
+    """
+    template = PROMPT_TEMPLATES[template or prompt_template()]
+    return template.format(
+        ingredients=", ".join(array_of_ingredients),
+        recipe_count=recipe_count(variants),
+        recipe_sketch=RECIPE_SKETCH
+    )
+
+
+def build_batch_recipe_prompt(ingredient_sets):
+    """
+    Build one Gemini prompt asking for a recipe per ingredient set
+
+    Requests are numbered from 1 in the order given. The reply shape is
+    spelled out unless structured output sends it as a schema.
+    """
+    from .config import Gemini_Config
+
+    requests = "\n".join(
+        f"{number}. {', '.join(ingredients)}" for number, ingredients in enumerate(ingredient_sets, start=1)
+    )
+    prompt = BATCH_TEMPLATE.format(requests=requests)
+    if not Gemini_Config.STRUCTURED_OUTPUT:
+        prompt += BATCH_REPLY_SKETCH.format(recipe_sketch=RECIPE_SKETCH)
+    return prompt
+
+
+def output_token_cap(array_of_ingredients, ceiling=None, variants=1):
+    """max_output_tokens for a request, sized to the recipes it asks for (at most GEMINI_MAX_OUTPUT_TOKENS)"""
+    from .config import Gemini_Config
+
+    ceiling = ceiling or Gemini_Config.MAX_OUTPUT_TOKENS
+    estimate = (OUTPUT_TOKENS_BASE + OUTPUT_TOKENS_PER_INGREDIENT * len(array_of_ingredients)) * variants
+    return int(min(max(estimate * OUTPUT_TOKENS_HEADROOM, OUTPUT_TOKENS_MIN), ceiling))
+
+
+def estimate_tokens(text):
+    """Rough token count of a text, for when the API doesn't report usage"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def token_usage(prompt, response_text, usage_metadata=None):
+    """
+    Input and output token counts of a call
+
+    Returns:
+        tuple: (input_tokens, output_tokens, estimated), the counts reported
+        by the API when available and estimated from the text otherwise
+    """
+    input_tokens = getattr(usage_metadata, 'prompt_token_count', 0)
+    output_tokens = getattr(usage_metadata, 'candidates_token_count', 0)
+    if input_tokens and output_tokens:
+        return input_tokens, output_tokens, False
+    return estimate_tokens(prompt), estimate_tokens(response_text), True
+
+
+def log_token_usage(prompt, response_text, usage_metadata=None, latency=None, max_output_tokens=None):
+    """Print the token counts of a call, and append it to GEMINI_RECORD_RESPONSES_PATH if set"""
+    from .config import Gemini_Config
+
+    input_tokens, output_tokens, estimated = token_usage(prompt, response_text, usage_metadata)
+    cap = f" of {max_output_tokens}" if max_output_tokens else ""
+    print(f"Gemini tokens: {input_tokens} in, {output_tokens}{cap} out{' (estimated)' if estimated else ''}")
+
+    if Gemini_Config.RECORD_RESPONSES_PATH:
+        record_response(Gemini_Config.RECORD_RESPONSES_PATH, {
+            'kind': 'call',
+            'template': prompt_template(),
+            'structured': Gemini_Config.STRUCTURED_OUTPUT,
+            'prompt': prompt,
+            'response_text': response_text,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'max_output_tokens': max_output_tokens,
+            'latency': latency,
+            'recorded_at': time.time(),
+        })
+
+
+def log_request_outcome(attempts, parse_failures, succeeded):
+    """Print how many calls one recipe request took, and record it like log_token_usage"""
+    from .config import Gemini_Config
+
+    print(f"Gemini request: {attempts} attempt(s), {parse_failures} parse failure(s)")
+    if Gemini_Config.RECORD_RESPONSES_PATH:
+        record_response(Gemini_Config.RECORD_RESPONSES_PATH, {
+            'kind': 'request',
+            'template': prompt_template(),
+            'structured': Gemini_Config.STRUCTURED_OUTPUT,
+            'attempts': attempts,
+            'parse_failures': parse_failures,
+            'succeeded': succeeded,
+            'recorded_at': time.time(),
+        })
+
+
+def record_response(path, record):
+    """Append one call or request outcome to a JSONL response set for compare_prompt_templates"""
+    try:
+        with _record_lock, open(path, 'a', encoding='utf-8') as response_file:
+            response_file.write(json.dumps(record) + os.linesep)
+    except OSError as record_error:
+        print(f"Could not record Gemini response: {record_error}")
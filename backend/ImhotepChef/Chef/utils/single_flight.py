@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.db import connection
+
+
+def cache_add_is_atomic(cache):
+    """Whether cache.add is atomic across the processes sharing the cache (not on the file based backend)"""
+    return isinstance(cache, (RedisCache, BaseMemcachedCache, LocMemCache)) or type(cache).__module__.startswith('django_redis.')
+
+
+def advisory_lock_id(lock_key):
+    """PostgreSQL advisory lock ID of a lock key, a signed 64-bit integer"""
+    return int.from_bytes(hashlib.blake2b(lock_key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution
+
+    Inside one process, the first caller for a key runs the function and
+    the other threads wait for its result. Across processes, the running
+    caller holds a lock; callers in other processes poll `peek` (usually a
+    cache lookup) until the result shows up or the lock is released.
+
+    The lock is taken with `cache.add` when the shared cache does that
+    atomically (redis, memcached), and otherwise with a PostgreSQL advisory
+    lock, released with the database session if the process dies. On any
+    other setup, e.g. the file based cache with SQLite, calls are only
+    coalesced inside each process.
+    """
+
+    LOCK_PREFIX = 'single-flight:'
+
+    def __init__(self, alias=None, timeout=None, poll_interval=0.2):
+        self.alias = alias or settings.RECIPE_CACHE_ALIAS
+        self.timeout = timeout if timeout is not None else settings.RECIPE_SINGLE_FLIGHT_TIMEOUT
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self._warned_in_process = False
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def do(self, key, fn, peek=None, timeout=None):
+        """
+        Run fn once for all concurrent callers with the same key
+
+        Args:
+            key (str): Coalescing key, e.g. an ingredient fingerprint
+            fn (callable): The expensive call
+            peek (callable): Optional, returns a result published by another process or None
+            timeout (float): Optional, wait at most this long (e.g. the request's remaining budget)
+
+        Returns:
+            The result of fn (or of peek) shared by every waiting caller
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            if call.done.wait(timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            # The leader is stuck, stop waiting and do the work ourselves
+            return fn()
+
+        try:
+            call.result = self._run_locked(key, fn, peek, timeout)
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_locked(self, key, fn, peek, timeout):
+        lock_key = self.LOCK_PREFIX + key
+        token = uuid.uuid4().hex
+        give_up_at = time.monotonic() + timeout
+
+        while True:
+            if self._acquire(lock_key, token):
+                try:
+                    # Another process may have published the result while we were waiting
+                    if peek is not None:
+                        result = peek()
+                        if result is not None:
+                            return result
+                    return fn()
+                finally:
+                    self._release(lock_key, token)
+
+            if peek is not None:
+                result = peek()
+                if result is not None:
+                    return result
+
+            if time.monotonic() >= give_up_at:
+                return fn()
+            time.sleep(self.poll_interval)
+
+    async def ado(self, key, fn, peek=None, timeout=None):
+        """
+        Async version of do, fn and peek are coroutine functions
+
+        Waiting callers share one task per key and event loop. The task is
+        shielded, so a waiter that disconnects does not cancel it for the others.
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        loop = asyncio.get_running_loop()
+        call_key = (loop, key)
+        with self._lock:
+            task = self._async_calls.get(call_key)
+            leader = task is None
+            if leader:
+                task = loop.create_task(self._arun_locked(key, fn, peek, timeout))
+                self._async_calls[call_key] = task
+                task.add_done_callback(lambda done: self._forget_task(call_key, done))
+
+        if leader:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            # The leader is stuck, stop waiting and do the work ourselves
+            return await fn()
+
+    def _forget_task(self, call_key, task):
+        with self._lock:
+            if self._async_calls.get(call_key) is task:
+                del self._async_calls[call_key]
+
+    async def _arun_locked(self, key, fn, peek, timeout):
+        lock_key = self.LOCK_PREFIX + key
+        token = uuid.uuid4().hex
+        give_up_at = time.monotonic() + timeout
+
+        while True:
+            if await self._aacquire(lock_key, token):
+                try:
+                    if peek is not None:
+                        result = await peek()
+                        if result is not None:
+                            return result
+                    return await fn()
+                finally:
+                    await self._arelease(lock_key, token)
+
+            if peek is not None:
+                result = await peek()
+                if result is not None:
+                    return result
+
+            if time.monotonic() >= give_up_at:
+                return await fn()
+            await asyncio.sleep(self.poll_interval)
+
+    def _lock_backend(self):
+        """Where the cross-process lock is taken: 'cache', 'database', or None for this process only"""
+        if cache_add_is_atomic(self.shared):
+            return 'cache'
+        if connection.vendor == 'postgresql':
+            return 'database'
+        if not self._warned_in_process:
+            self._warned_in_process = True
+            print("Single-flight only coalesces inside this process: the recipe cache can't add atomically and the database has no advisory locks")
+        return None
+
+    def _acquire(self, lock_key, token):
+        backend = self._lock_backend()
+        try:
+            if backend == 'cache':
+                return self.shared.add(lock_key, token, self.timeout)
+            if backend == 'database':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_try_advisory_lock(%s)', [advisory_lock_id(lock_key)])
+                    return cursor.fetchone()[0]
+        except Exception as lock_error:
+            # Without the shared lock we still coalesce inside this process
+            print(f"Single-flight lock unavailable: {lock_error}")
+        return True
+
+    def _release(self, lock_key, token):
+        backend = self._lock_backend()
+        try:
+            if backend == 'cache':
+                if self.shared.get(lock_key) == token:
+                    self.shared.delete(lock_key)
+            elif backend == 'database':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [advisory_lock_id(lock_key)])
+        except Exception as lock_error:
+            print(f"Single-flight lock unavailable: {lock_error}")
+
+    async def _aacquire(self, lock_key, token):
+        if self._lock_backend() != 'cache':
+            # The advisory lock belongs to the database session, which lives on the sync thread
+            return await sync_to_async(self._acquire)(lock_key, token)
+        try:
+            return await self.shared.aadd(lock_key, token, self.timeout)
+        except Exception as cache_error:
+            print(f"Single-flight lock unavailable: {cache_error}")
+            return True
+
+    async def _arelease(self, lock_key, token):
+        if self._lock_backend() != 'cache':
+            await sync_to_async(self._release)(lock_key, token)
+            return
+        try:
+            if await self.shared.aget(lock_key) == token:
+                await self.shared.adelete(lock_key)
+        except Exception as cache_error:
+            print(f"Single-flight lock unavailable: {cache_error}")
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Get the process-wide single-flight group for recipe generation"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
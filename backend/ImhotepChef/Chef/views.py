@@ -1,9 +1,14 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.views.decorators.http import require_GET
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .models import User
+from .utils.metrics import CONTENT_TYPE, REGISTRY
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -34,4 +39,18 @@ def get_user_usage_count(request):
         'user_id': user.id,
         'user_count': user_count,
         'message': f'User has generated {user_count} recipes this month'
-    })
\ No newline at end of file
+    })
+
+@require_GET
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, in the text exposition format
+
+    Disabled (404) until METRICS_TOKEN is set, then the token is required.
+    """
+    if not settings.METRICS_TOKEN:
+        return HttpResponse('Not Found', status=404, content_type='text/plain')
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
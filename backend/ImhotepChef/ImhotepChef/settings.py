@@ -97,6 +97,8 @@ SIMPLE_JWT = {
 
 
 MIDDLEWARE = [
+    # First, so its latency covers the other middleware
+    'Chef.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -179,6 +181,97 @@ DATABASES = {
     }
 }
 
+# Recipe request limits, these bound the size of the Gemini prompt
+RECIPE_MAX_INGREDIENTS = config('RECIPE_MAX_INGREDIENTS', default=20, cast=int)
+RECIPE_MAX_INGREDIENT_LENGTH = config('RECIPE_MAX_INGREDIENT_LENGTH', default=60, cast=int)
+
+# Cache configuration
+# The default cache is per-process; the recipe cache is shared between worker processes
+# (file based by default, point RECIPE_CACHE_BACKEND at redis/memcached in production)
+RECIPE_CACHE_ALIAS = 'recipes'
+RECIPE_CACHE_LOCAL_SIZE = config('RECIPE_CACHE_LOCAL_SIZE', default=1024, cast=int)
+RECIPE_CACHE_LOCAL_TTL = config('RECIPE_CACHE_LOCAL_TTL', default=300, cast=int)
+RECIPE_CACHE_SHARED_TTL = config('RECIPE_CACHE_SHARED_TTL', default=24 * 60 * 60, cast=int)
+# Longest time a request waits for an identical in-flight generation before calling Gemini itself.
+# Across processes this needs a redis/memcached recipe cache or PostgreSQL (advisory locks);
+# with the file based cache on another database, generations are only shared inside a process
+RECIPE_SINGLE_FLIGHT_TIMEOUT = config('RECIPE_SINGLE_FLIGHT_TIMEOUT', default=120, cast=int)
+
+# End-to-end time budget per endpoint, in seconds. Gemini attempts, lock waits and saves
+# only get what is left; when it runs out the request falls back right away
+RECIPE_GENERATE_DEADLINE = config('RECIPE_GENERATE_DEADLINE', default=45, cast=float)
+RECIPE_GENERATE_ASYNC_DEADLINE = config('RECIPE_GENERATE_ASYNC_DEADLINE', default=45, cast=float)
+RECIPE_GENERATE_STREAM_DEADLINE = config('RECIPE_GENERATE_STREAM_DEADLINE', default=90, cast=float)
+RECIPE_GENERATE_BATCH_DEADLINE = config('RECIPE_GENERATE_BATCH_DEADLINE', default=90, cast=float)
+
+# Batch generation: ingredient sets per request, and Gemini calls run at once per request
+RECIPE_BATCH_MAX_SIZE = config('RECIPE_BATCH_MAX_SIZE', default=10, cast=int)
+RECIPE_BATCH_MAX_WORKERS = config('RECIPE_BATCH_MAX_WORKERS', default=4, cast=int)
+
+# Background recipe jobs (recipes/generate/jobs/, run by `manage.py run_recipe_worker`)
+# A claimed job is leased for RECIPE_JOB_LEASE seconds, keep it above RECIPE_JOB_DEADLINE
+# so a live worker never loses its job. Failed attempts are retried after
+# RECIPE_JOB_RETRY_DELAY seconds, doubling each time
+RECIPE_JOB_DEADLINE = config('RECIPE_JOB_DEADLINE', default=90, cast=float)
+RECIPE_JOB_LEASE = config('RECIPE_JOB_LEASE', default=180, cast=float)
+RECIPE_JOB_MAX_ATTEMPTS = config('RECIPE_JOB_MAX_ATTEMPTS', default=3, cast=int)
+RECIPE_JOB_RETRY_DELAY = config('RECIPE_JOB_RETRY_DELAY', default=10, cast=float)
+RECIPE_WORKER_THREADS = config('RECIPE_WORKER_THREADS', default=4, cast=int)
+RECIPE_WORKER_POLL_INTERVAL = config('RECIPE_WORKER_POLL_INTERVAL', default=1, cast=float)
+
+# LLM backend behind recipe generation: 'gemini', or 'fake' for load tests and local runs
+# without keys. The fake replies with valid recipes after a latency drawn from
+# FAKE_LLM_LATENCY_DISTRIBUTION ('fixed', 'uniform' within FAKE_LLM_LATENCY_SPREAD of
+# FAKE_LLM_LATENCY, or 'lognormal' with median FAKE_LLM_LATENCY and sigma
+# FAKE_LLM_LATENCY_SPREAD), and fails or truncates the given shares of calls
+LLM_BACKEND = config('LLM_BACKEND', default='gemini')
+FAKE_LLM_LATENCY = config('FAKE_LLM_LATENCY', default=0.5, cast=float)
+FAKE_LLM_LATENCY_DISTRIBUTION = config('FAKE_LLM_LATENCY_DISTRIBUTION', default='lognormal')
+FAKE_LLM_LATENCY_SPREAD = config('FAKE_LLM_LATENCY_SPREAD', default=0.5, cast=float)
+FAKE_LLM_ERROR_RATE = config('FAKE_LLM_ERROR_RATE', default=0.0, cast=float)
+FAKE_LLM_RATE_LIMIT_RATE = config('FAKE_LLM_RATE_LIMIT_RATE', default=0.0, cast=float)
+FAKE_LLM_TRUNCATE_RATE = config('FAKE_LLM_TRUNCATE_RATE', default=0.0, cast=float)
+FAKE_LLM_KEYS = config('FAKE_LLM_KEYS', default=2, cast=int)
+FAKE_LLM_SEED = config('FAKE_LLM_SEED', default=0, cast=int)
+
+# Multi-variant generation: recipes asked for per Gemini call. Above 1, they are all stored
+# as the ingredient set's variant pool, and requests for the set take turns over the pool
+# (or pick from it by difficulty) before Gemini is called again. Only the sync endpoint,
+# recipes/generate/, asks for variants and rotates over the pool; the async, stream, batch
+# and job endpoints ask for one recipe and serve the newest stored one for the set
+RECIPE_VARIANTS_PER_CALL = config('RECIPE_VARIANTS_PER_CALL', default=1, cast=int)
+RECIPE_VARIANT_POOL_SIZE = config('RECIPE_VARIANT_POOL_SIZE', default=6, cast=int)
+
+# Prometheus metrics at /api/metrics/, behind 'Authorization: Bearer <METRICS_TOKEN>'. The
+# endpoint answers 404 while the token is empty. With several worker processes, point METRICS_MULTIPROC_DIR at a
+# directory they share: each writes its metrics there at most every METRICS_FLUSH_INTERVAL
+# seconds and a scrape adds them up. Empty the directory on deploy
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_MULTIPROC_DIR = config('METRICS_MULTIPROC_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=1, cast=float)
+
+# Similar recipe reuse (Jaccard similarity of ingredient sets, 0.0 - 1.0)
+# Requests above RECIPE_SIMILARITY_THRESHOLD reuse a stored recipe instead of calling Gemini,
+# the lower fallback threshold applies only when every Gemini API key failed
+RECIPE_SIMILARITY_THRESHOLD = config('RECIPE_SIMILARITY_THRESHOLD', default=0.75, cast=float)
+RECIPE_FALLBACK_SIMILARITY_THRESHOLD = config('RECIPE_FALLBACK_SIMILARITY_THRESHOLD', default=0.3, cast=float)
+INGREDIENT_INDEX_REFRESH_INTERVAL = config('INGREDIENT_INDEX_REFRESH_INTERVAL', default=60, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'imhotepchef-default',
+    },
+    RECIPE_CACHE_ALIAS: {
+        'BACKEND': config('RECIPE_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('RECIPE_CACHE_LOCATION', default=os.path.join(BASE_DIR, '.cache', 'recipes')),
+        'TIMEOUT': RECIPE_CACHE_SHARED_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RECIPE_CACHE_SHARED_MAX_ENTRIES', default=50000, cast=int),
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -32,6 +32,10 @@ python manage.py makemigrations Chef
 python manage.py makemigrations
 python manage.py migrate
 
+# Move recipe bodies still stored per history row to the shared Recipe table
+echo "Collapsing duplicate recipes..."
+python manage.py collapse_recipe_history
+
 # Create superuser if it doesn't exist
 echo "Creating superuser..."
 python manage.py shell -c "